@@ -4,9 +4,9 @@ from fastapi import APIRouter, Request, Response
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
-from .. import database
-from ..core.config import get_active_password
+from ..core.config import get_active_password_async
 from ..core.logging_config import get_logger
+from ..repository import session_repo
 
 logger = get_logger(__name__)
 
@@ -19,7 +19,7 @@ COOKIE_NAME = "tgstate_session"
 
 @router.post("/api/auth/login")
 async def login(payload: LoginRequest, response: Response):
-    active_password = get_active_password()
+    active_password = await get_active_password_async()
     # 确保密码比对时处理两端空格，避免复制粘贴带来的隐形字符问题
     input_pwd = payload.password.strip()
     stored_pwd = (active_password or "").strip()
@@ -27,7 +27,7 @@ async def login(payload: LoginRequest, response: Response):
     if input_pwd and input_pwd == stored_pwd:
         # 登录成功，生成会话ID并创建会话
         session_id = secrets.token_urlsafe(32)
-        database.create_session(session_id, expires_in_hours=24)
+        await session_repo.create(session_id, expires_in_hours=24)
 
         logger.info(f"【登录】用户登录成功。会话ID: {session_id[:8]}...")
         response = JSONResponse(content={"status": "ok", "message": "登录成功"})
@@ -50,7 +50,7 @@ async def logout(request: Request):
     # 登出，清除 Cookie 和数据库中的会话
     session_id = request.cookies.get(COOKIE_NAME)
     if session_id:
-        database.delete_session(session_id)
+        await session_repo.delete(session_id)
         logger.info(f"【登出】用户登出成功。会话ID: {session_id[:8]}...")
     else:
         logger.debug("【登出】登出请求，但无会话信息")
@@ -5,8 +5,8 @@ from typing import Any
 
 from fastapi import HTTPException, Request
 
-from .. import database
-from ..core.config import get_active_password
+from ..core.config import get_active_password_async
+from ..repository import session_repo
 from .auth import COOKIE_NAME
 
 logger = logging.getLogger(__name__)
@@ -23,13 +23,23 @@ def http_error(status_code: int, message: str, *, code: str = "error", details:
     return HTTPException(status_code=status_code, detail=error_payload(message, code=code, details=details))
 
 
-def ensure_upload_auth(request: Request, app_settings: dict, submitted_key: str | None) -> None:
+async def note_download_demand(request: Request, file_info: dict) -> None:
+    """通知下载服务该文件刚被访问，优先把它下载到本地。"""
+    download_service = getattr(request.app.state, "download_service", None)
+    if download_service:
+        try:
+            await download_service.request_file(file_info)
+        except Exception as e:
+            logger.warning("记录文件访问需求失败: %s", e)
+
+
+async def ensure_upload_auth(request: Request, app_settings: dict, submitted_key: str | None) -> None:
     picgo_api_key = app_settings.get("PICGO_API_KEY")
-    web_password_set = bool(app_settings.get("PASS_WORD") or get_active_password())
+    web_password_set = bool(app_settings.get("PASS_WORD") or await get_active_password_async())
 
     # 检查会话认证
     session_id = request.cookies.get(COOKIE_NAME)
-    is_authenticated_via_session = session_id and database.get_session(session_id)
+    is_authenticated_via_session = session_id and await session_repo.get(session_id)
 
     # 检查 API Key 认证
     is_authenticated_via_api_key = picgo_api_key and (picgo_api_key == submitted_key)
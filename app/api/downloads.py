@@ -9,8 +9,10 @@ from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from .. import database
+from ..repository import file_repo, settings_repo
+from ..services.download_accelerator import get_host_tunings
 from ..services.download_service import progress_event_queue
+from ..services.download_url_cache import download_url_cache
 from .common import http_error
 
 router = APIRouter()
@@ -52,10 +54,16 @@ def _format_size(size_in_bytes: int) -> str:
         size_in_bytes /= 1024.0
     return f"{size_in_bytes:.2f} PB"
 
-def _get_local_file_details() -> list[dict]:
+def _request_reconcile(request: Request) -> None:
+    """通知下载服务立即重新扫描待下载文件。"""
+    download_service = getattr(request.app.state, "download_service", None)
+    if download_service:
+        download_service.request_reconcile()
+
+async def _get_local_file_details() -> list[dict]:
     """获取所有本地文件的详细信息，包括文件系统状态。"""
-    db_files = database.get_local_files()
-    download_dir = database.get_app_settings_from_db().get("DOWNLOAD_DIR", "/app/downloads")
+    db_files = await file_repo.list_local()
+    download_dir = (await settings_repo.get()).get("DOWNLOAD_DIR", "/app/downloads")
 
     detailed_files = []
     for file_rec in db_files:
@@ -78,7 +86,7 @@ def _get_local_file_details() -> list[dict]:
 async def get_download_config():
     """获取自动下载配置"""
     try:
-        settings = database.get_app_settings_from_db()
+        settings = await settings_repo.get()
         # Remap from DB keys to API keys
         config_data = {
             "enabled": settings.get("AUTO_DOWNLOAD_ENABLED", False),
@@ -95,10 +103,10 @@ async def get_download_config():
 
 
 @router.post("/api/downloads/config", response_model=dict)
-async def save_download_config(payload: SaveConfigPayload):
+async def save_download_config(payload: SaveConfigPayload, request: Request):
     """保存自动下载配置"""
     try:
-        current_settings = database.get_app_settings_from_db()
+        current_settings = await settings_repo.get()
 
         update_data = {
             "AUTO_DOWNLOAD_ENABLED": payload.enabled,
@@ -110,7 +118,8 @@ async def save_download_config(payload: SaveConfigPayload):
         }
         current_settings.update(update_data)
 
-        database.save_app_settings_to_db(current_settings)
+        await settings_repo.save(current_settings)
+        _request_reconcile(request)
 
         return {"status": "success", "message": "配置已保存。"}
     except Exception as e:
@@ -122,7 +131,7 @@ async def save_download_config(payload: SaveConfigPayload):
 async def get_local_stats():
     """获取本地存储统计信息"""
     try:
-        local_files = _get_local_file_details()
+        local_files = await _get_local_file_details()
 
         total_size = sum(f["actual_size"] for f in local_files if f["exists"])
         exists_count = sum(1 for f in local_files if f["exists"])
@@ -144,7 +153,7 @@ async def get_local_stats():
 async def get_local_files_list():
     """获取本地文件列表及其状态"""
     try:
-        detailed_files = _get_local_file_details()
+        detailed_files = await _get_local_file_details()
         return {"status": "success", "data": detailed_files}
     except Exception as e:
         logger.error("获取本地文件列表出错: %s", e)
@@ -156,12 +165,12 @@ async def delete_local_file(payload: DeleteLocalFilePayload):
     """删除指定的本地文件（不会删除Telegram上的文件）"""
     try:
         file_id = payload.file_id
-        db_file = database.get_file_by_id(file_id)
+        db_file = await file_repo.get(file_id)
 
         if not db_file or not db_file.get("local_path"):
             raise http_error(404, "数据库中未找到该文件的本地记录。")
 
-        download_dir = database.get_app_settings_from_db().get("DOWNLOAD_DIR", "/app/downloads")
+        download_dir = (await settings_repo.get()).get("DOWNLOAD_DIR", "/app/downloads")
         full_path = os.path.join(download_dir, db_file["local_path"])
 
         if os.path.exists(full_path):
@@ -169,7 +178,7 @@ async def delete_local_file(payload: DeleteLocalFilePayload):
             logger.info("已从本地删除文件: %s", full_path)
 
         # 无论本地文件是否存在，都清空数据库记录
-        database.clear_local_path(file_id)
+        await file_repo.clear_local_path(file_id)
 
         return {"status": "success", "message": "本地文件记录已清除。"}
     except Exception as e:
@@ -177,6 +186,33 @@ async def delete_local_file(payload: DeleteLocalFilePayload):
         raise http_error(500, "删除本地文件失败。") from e
 
 
+@router.get("/api/downloads/workers", response_model=dict)
+async def get_download_workers(request: Request):
+    """获取下载工作协程池的状态（每个工作协程当前处理的文件与进度、各下载主机的自适应参数以及下载链接缓存统计）"""
+    download_service = getattr(request.app.state, "download_service", None)
+    if not download_service:
+        return {
+            "status": "success",
+            "data": {
+                "running": False, "size": 0, "queued": 0, "lanes": {}, "workers": [],
+                "hosts": {}, "url_cache": download_url_cache.stats(),
+            },
+        }
+    workers = download_service.get_worker_status()
+    return {
+        "status": "success",
+        "data": {
+            "running": download_service.running,
+            "size": len(workers),
+            "queued": download_service.download_queue.qsize(),
+            "lanes": download_service.download_queue.lane_sizes(),
+            "workers": workers,
+            "hosts": get_host_tunings(),
+            "url_cache": download_url_cache.stats(),
+        },
+    }
+
+
 @router.get("/api/downloads/progress-stream")
 async def download_progress_stream(request: Request):
     """用于流式传输下载进度的 SSE 端点。"""
@@ -201,10 +237,11 @@ async def download_progress_stream(request: Request):
 
 
 @router.post("/api/downloads/clear-errors", response_model=dict)
-async def clear_download_errors():
+async def clear_download_errors(request: Request):
     """清除所有下载错误标记，允许重新尝试下载"""
     try:
-        cleared_count = database.clear_error_markers()
+        cleared_count = await file_repo.clear_error_markers()
+        _request_reconcile(request)
         return {
             "status": "success",
             "message": f"已清除 {cleared_count} 个错误标记",
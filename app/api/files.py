@@ -3,6 +3,7 @@ from __future__ import annotations
 import asyncio
 import mimetypes
 import os
+from collections import deque
 from urllib.parse import quote
 
 import httpx
@@ -10,17 +11,61 @@ from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse, FileResponse
 from pydantic import BaseModel
 
-from .. import database
-from ..core.config import get_app_settings
 from ..core.http_client import get_http_client
 from ..core.logging_config import get_logger
-from ..services.download_accelerator import DownloadAccelerator
-from ..services.telegram_service import TelegramService, get_telegram_service
-from .common import http_error
+from ..database import BLOB_KIND_MANIFEST, BLOB_KIND_SINGLE, DOWNLOAD_STATE_COMPLETED
+from ..repository import file_repo, settings_repo
+from ..services.download_accelerator import EXPIRED_URL_STATUS_CODES, DownloadAccelerator
+from ..services.download_service import discard_partial_download
+from ..services.download_url_cache import download_url_cache
+from ..services.telegram_service import CHUNK_SIZE_BYTES, TelegramService, get_telegram_service
+from .common import http_error, note_download_demand
 
 router = APIRouter()
 logger = get_logger(__name__)
 
+
+def parse_range_header(range_header: str | None, file_size: int) -> tuple[int, int] | None:
+    """
+    解析单个字节范围，支持 bytes=a-b、bytes=a-（到文件末尾）与 bytes=-n（最后 n 个字节），返回闭区间 (start, end)。
+    Range 头缺失、格式无效或包含多个范围时返回 None（按完整内容响应）。
+
+    Raises:
+        ValueError: 范围无法满足（应返回 416）
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        start = int(start_str) if start_str else None
+        end = int(end_str) if end_str else None
+    except ValueError:
+        return None
+
+    if start is None:
+        if end is None:
+            return None
+        if end <= 0:
+            raise ValueError("空的后缀范围")
+        start, end = max(0, file_size - end), file_size - 1
+    elif end is None:
+        end = file_size - 1
+    elif end < start:
+        return None
+    if start >= file_size:
+        raise ValueError("范围超出文件大小")
+    return start, min(end, file_size - 1)
+
+
+def _range_not_satisfiable(file_size: int) -> Response:
+    return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+
+
 async def serve_local_file(
     local_path: str,
     filename: str,
@@ -78,45 +123,32 @@ async def serve_local_file(
         return Response(status_code=200, headers=common_headers)
 
     # Range 请求处理
-    range_header = request.headers.get("Range")
-    if range_header:
-        try:
-            unit, ranges = range_header.split("=")
-            if unit != "bytes":
-                raise ValueError
-            start_str, end_str = ranges.split("-")
-            start = int(start_str)
-            end = int(end_str) if end_str else file_size - 1
-
-            if start >= file_size:
-                return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
-
-            if end >= file_size:
-                end = file_size - 1
-
-            length = end - start + 1
-
-            common_headers.update({
-                "Content-Range": f"bytes {start}-{end}/{file_size}",
-                "Content-Length": str(length)
-            })
-
-            async def range_streamer():
-                with open(local_path, "rb") as f:
-                    f.seek(start)
-                    remaining = length
-                    chunk_size = 64 * 1024  # 64KB chunks
-                    while remaining > 0:
-                        chunk = f.read(min(chunk_size, remaining))
-                        if not chunk:
-                            break
-                        yield chunk
-                        remaining -= len(chunk)
-
-            return StreamingResponse(range_streamer(), status_code=206, headers=common_headers)
+    try:
+        byte_range = parse_range_header(request.headers.get("Range"), file_size)
+    except ValueError:
+        return _range_not_satisfiable(file_size)
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+
+        common_headers.update({
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+            "Content-Length": str(length)
+        })
+
+        async def range_streamer():
+            with open(local_path, "rb") as f:
+                f.seek(start)
+                remaining = length
+                chunk_size = 64 * 1024  # 64KB chunks
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    yield chunk
+                    remaining -= len(chunk)
 
-        except (ValueError, Exception):
-            pass  # Fallback to full content
+        return StreamingResponse(range_streamer(), status_code=206, headers=common_headers)
 
     # 完整文件响应（使用 FileResponse 更高效）
     return FileResponse(
@@ -130,27 +162,60 @@ async def serve_local_file(
         }
     )
 
+async def _remember_blob_layout(file_id: str, manifest: dict | None) -> None:
+    """将探测到的存储形式回填到数据库，之后访问该文件无需再探测。"""
+    try:
+        if manifest is None:
+            await file_repo.update_blob_layout(file_id, BLOB_KIND_SINGLE)
+        else:
+            await file_repo.update_blob_layout(file_id, BLOB_KIND_MANIFEST, len(manifest["chunk_ids"]), CHUNK_SIZE_BYTES)
+    except Exception as e:
+        logger.warning(f"【Telegram流式】回填文件存储形式失败。file_id: {file_id[:20]}...，错误: {e}")
+
+
+async def _stream_download(
+    client: httpx.AsyncClient,
+    telegram_service: TelegramService,
+    real_file_id: str,
+    download_url: str,
+    headers: dict | None = None,
+):
+    """输出单个文件的响应体；链接已失效（403 / 404 / 410）时丢弃缓存的链接，重新获取后再请求一次。"""
+    for attempt in range(2):
+        async with client.stream("GET", download_url, headers=headers) as resp:
+            if attempt or resp.status_code not in EXPIRED_URL_STATUS_CODES:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes():
+                    yield chunk
+                return
+        download_url_cache.invalidate(real_file_id)
+        download_url = await telegram_service.get_download_url(real_file_id)
+        if not download_url:
+            raise Exception("无法获取下载链接（文件可能已过期或不存在）")
+
+
 async def serve_file(
     file_id: str,
     filename: str,
     telegram_service: TelegramService,
     client: httpx.AsyncClient,
     request: Request,
-    force_download: bool = False
+    force_download: bool = False,
+    file_size: int | None = None,
+    blob_kind: str | None = None,
 ):
     """
     Common logic to serve a file given its file_id (composite) and filename.
     Supports Range requests, Content-Disposition customization.
+    file_size is the size recorded in the DB; it is required for Range / Content-Length on split files.
+    blob_kind is the storage layout recorded in the DB; when known, no probe request is needed to tell
+    a split file from a single document. Unknown layouts are probed once and written back.
     """
     try:
         _, real_file_id = file_id.split(":", 1)
     except ValueError:
         real_file_id = file_id
 
-    download_url = await telegram_service.get_download_url(real_file_id)
-    if not download_url:
-        raise http_error(404, "文件未找到或下载链接已过期。", code="file_not_found")
-
     # --- Header Preparation ---
     filename_encoded = quote(str(filename))
 
@@ -198,45 +263,52 @@ async def serve_file(
     # --- Range Handling ---
     range_header = request.headers.get("Range")
 
-    # First, peek content to check if it's a manifest (TG split file)
-    # We only read a small chunk to identify manifest
-    try:
-        # Use a separate request for head check to avoid consuming the stream
-        # However, getting Content-Length for Range support is tricky with TG API if we don't know it.
-        # DB has `filesize`, let's use it if possible, but serve_file signature relies on passing it or fetching.
-        # Here we just fetch head.
-
-        # Optimization: We need to know if it's manifest.
-        # Note: If it's a HEAD request from client, we still might need to fetch a bit from TG to know if it's manifest.
-        # But if we just want to return headers for a simple file, maybe we can skip?
-        # No, because if it's manifest, content-type and size are different (manifest is text, real file is binary).
-        # So we MUST fetch head from TG even for HEAD request.
-
-        head_resp = await client.get(download_url, headers={"Range": "bytes=0-127"})
-        head_resp.raise_for_status()
-        first_bytes = head_resp.content
-    except httpx.RequestError as e:
-        raise http_error(503, "无法连接到 Telegram 服务器。", code="tg_unreachable", details=str(e)) from e
+    # Check whether it's a manifest (TG split file). Parsed manifests are cached (memory + DB),
+    # so only the first access downloads it; the 128-byte peek is skipped when the DB knows the layout.
+    manifest = None
+    if blob_kind != BLOB_KIND_SINGLE:
+        try:
+            manifest = await telegram_service.get_manifest(
+                real_file_id, client, file_size, known_manifest=blob_kind == BLOB_KIND_MANIFEST
+            )
+        except httpx.RequestError as e:
+            raise http_error(503, "无法连接到 Telegram 服务器。", code="tg_unreachable", details=str(e)) from e
+        except httpx.HTTPStatusError:
+            raise
+        except Exception as e:
+            raise http_error(404, "文件未找到或下载链接已过期。", code="file_not_found") from e
+        if blob_kind is None:
+            await _remember_blob_layout(file_id, manifest)
 
     # Check for manifest (large file split)
-    if first_bytes.startswith(b"tgstate-blob\n"):
-        # Manifest processing (No Range support for split files yet, complex to implement)
-        manifest_resp = await client.get(download_url)
-        manifest_resp.raise_for_status()
-        manifest_content = manifest_resp.content
-
-        lines = manifest_content.decode("utf-8").strip().split("\n")
-        if len(lines) < 3:
-            raise http_error(500, "清单文件格式错误。", code="manifest_invalid")
-        # original_filename = lines[1]
-        chunk_file_ids = [cid for cid in lines[2:] if cid.strip()]
-
-        # Force attachment for split files usually, but respect user preference if previewable (e.g. large video?)
-        # For now, let's keep basic logic. Streaming split files with Range is hard.
-        # We will serve it sequentially without Range support for now.
+    if manifest is not None:
+        chunk_file_ids = manifest["chunk_ids"]
+        if not file_size and None not in manifest["chunk_sizes"]:
+            file_size = sum(manifest["chunk_sizes"])
+
+        # 分块大小固定（除最后一块外均为 CHUNK_SIZE_BYTES），结合数据库中的文件大小即可把偏移映射到分块
+        if file_size:
+            common_headers["Content-Length"] = str(file_size)
 
         if request.method == "HEAD":
-             return Response(status_code=200, headers=common_headers)
+            return Response(status_code=200, headers=common_headers)
+
+        if file_size:
+            try:
+                byte_range = parse_range_header(range_header, file_size)
+            except ValueError:
+                return _range_not_satisfiable(file_size)
+            if byte_range:
+                start, end = byte_range
+                common_headers.update({
+                    "Content-Range": f"bytes {start}-{end}/{file_size}",
+                    "Content-Length": str(end - start + 1)
+                })
+                return StreamingResponse(
+                    stream_chunks(chunk_file_ids, telegram_service, client, start, end),
+                    status_code=206,
+                    headers=common_headers
+                )
 
         return StreamingResponse(
             stream_chunks(chunk_file_ids, telegram_service, client),
@@ -244,22 +316,21 @@ async def serve_file(
         )
 
     # Standard Single File
+    download_url = await telegram_service.get_download_url(real_file_id)
+    if not download_url:
+        raise http_error(404, "文件未找到或下载链接已过期。", code="file_not_found")
 
-    # Get total size for Range
-    async def get_remote_file_size():
-        # Try HEAD
+    # Total size for Range / Content-Length comes from the DB; only legacy links without a record need a HEAD
+    if not file_size:
         try:
-             h_resp = await client.head(download_url)
-             if h_resp.headers.get("Content-Length"):
-                 return int(h_resp.headers["Content-Length"])
+            h_resp = await client.head(download_url)
+            if h_resp.headers.get("Content-Length"):
+                file_size = int(h_resp.headers["Content-Length"])
         except Exception:
-             pass
-        return None
-
-    file_size = await get_remote_file_size()
+            pass
 
     # Multi-threaded download acceleration for full file downloads
-    settings = get_app_settings()
+    settings = await settings_repo.get()
     thread_count = settings.get("DOWNLOAD_THREADS", 4)
     use_acceleration = (
         thread_count > 1
@@ -271,12 +342,19 @@ async def serve_file(
 
     if use_acceleration:
         accelerator = DownloadAccelerator(client, thread_count)
-        supports_range, _ = await accelerator.supports_range_requests(download_url)
+        # Range support is remembered per host, so this normally costs no request
+        supports_range, _ = await accelerator.supports_range_requests(download_url, file_size)
 
         if supports_range:
             async def accelerated_streamer():
-                async for chunk in accelerator.accelerated_download(download_url, file_size):
-                    yield chunk
+                try:
+                    async for chunk in accelerator.accelerated_download(download_url, file_size):
+                        yield chunk
+                except httpx.HTTPStatusError as e:
+                    # 已开始输出，无法换链接重试；丢弃失效的链接，客户端重试时重新获取
+                    if e.response.status_code in EXPIRED_URL_STATUS_CODES:
+                        download_url_cache.invalidate(real_file_id)
+                    raise
 
             if file_size:
                 common_headers["Content-Length"] = str(file_size)
@@ -285,41 +363,22 @@ async def serve_file(
 
     # Handle Range (Only for GET)
     if range_header and file_size and request.method != "HEAD":
-        # Parse Range: bytes=0-1024
         try:
-            unit, ranges = range_header.split("=")
-            if unit != "bytes":
-                raise ValueError
-            start_str, end_str = ranges.split("-")
-            start = int(start_str)
-            end = int(end_str) if end_str else file_size - 1
-
-            if start >= file_size:
-                return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
-
-            # Correct end if out of bounds
-            if end >= file_size:
-                end = file_size - 1
-
-            length = end - start + 1
-
+            byte_range = parse_range_header(range_header, file_size)
+        except ValueError:
+            return _range_not_satisfiable(file_size)
+        if byte_range:
+            start, end = byte_range
             common_headers.update({
                 "Content-Range": f"bytes {start}-{end}/{file_size}",
-                "Content-Length": str(length)
+                "Content-Length": str(end - start + 1)
             })
 
             # Stream partial content
-            async def range_streamer():
-                async with client.stream("GET", download_url, headers={"Range": f"bytes={start}-{end}"}) as resp:
-                    resp.raise_for_status()
-                    async for chunk in resp.aiter_bytes():
-                        yield chunk
-
-            return StreamingResponse(range_streamer(), status_code=206, headers=common_headers)
-
-        except (ValueError, Exception):
-            # Fallback to full content if Range parsing fails
-            pass
+            range_streamer = _stream_download(
+                client, telegram_service, real_file_id, download_url, {"Range": f"bytes={start}-{end}"}
+            )
+            return StreamingResponse(range_streamer, status_code=206, headers=common_headers)
 
     # Full content stream
     if file_size:
@@ -328,13 +387,9 @@ async def serve_file(
     if request.method == "HEAD":
         return Response(status_code=200, headers=common_headers)
 
-    async def single_file_streamer():
-        async with client.stream("GET", download_url) as resp:
-            resp.raise_for_status()
-            async for chunk in resp.aiter_bytes():
-                yield chunk
-
-    return StreamingResponse(single_file_streamer(), headers=common_headers)
+    return StreamingResponse(
+        _stream_download(client, telegram_service, real_file_id, download_url), headers=common_headers
+    )
 
 
 @router.api_route("/d/{file_id}/{filename}", methods=["GET", "HEAD"])
@@ -355,10 +410,14 @@ async def download_file_legacy(
 
     # 增加下载计数（仅GET请求）
     if request.method == "GET":
-        database.increment_download_count(file_id)
+        await file_repo.increment_download_count(file_id)
 
+    meta = await file_repo.get(file_id)
     force_download = download == "1" or download == "true"
-    return await serve_file(file_id, filename, telegram_service, client, request, force_download)
+    return await serve_file(
+        file_id, filename, telegram_service, client, request, force_download,
+        meta.get('filesize') if meta else None, meta.get('blob_kind') if meta else None,
+    )
 
 
 @router.api_route("/d/{identifier}", methods=["GET", "HEAD"])
@@ -373,37 +432,42 @@ async def download_file_short(
     优先从本地文件系统读取，避免频繁访问 Telegram API。
     """
     # Lookup metadata
-    meta = database.get_file_by_id(identifier)
+    meta = await file_repo.get(identifier)
     if not meta:
          raise http_error(404, "文件不存在", code="file_not_found")
 
     # 增加下载计数（仅GET请求）
     if request.method == "GET":
-        database.increment_download_count(meta['file_id'])
+        await file_repo.increment_download_count(meta['file_id'])
 
     # 优先从本地文件系统读取
-    if meta.get('local_path'):
+    if meta.get('download_state') == DOWNLOAD_STATE_COMPLETED and meta.get('local_path'):
         local_path_value = meta['local_path']
-        # 跳过占位符标记（__downloading_, __error_）
-        if not local_path_value.startswith('__'):
-            from ..core.config import get_app_settings
-            settings = get_app_settings()
-            download_dir = settings.get('DOWNLOAD_DIR', '/app/downloads')
-            full_local_path = os.path.join(download_dir, local_path_value)
+        settings = await settings_repo.get()
+        download_dir = settings.get('DOWNLOAD_DIR', '/app/downloads')
+        full_local_path = os.path.join(download_dir, local_path_value)
 
-            if os.path.exists(full_local_path):
-                logger.info(f"【本地文件】从本地提供文件: {meta['filename']}")
-                return await serve_local_file(full_local_path, meta['filename'], request, download == "1" or download == "true")
+        if os.path.exists(full_local_path):
+            logger.info(f"【本地文件】从本地提供文件: {meta['filename']}")
+            return await serve_local_file(full_local_path, meta['filename'], request, download == "1" or download == "true")
 
     # Fallback: 从 Telegram 流式传输（如果本地不可用）
     logger.warning(f"【Telegram流式】本地文件不存在，从 Telegram 提供: {meta['filename']}")
+    await note_download_demand(request, meta)
     try:
         telegram_service = get_telegram_service()
     except Exception as e:
         raise http_error(503, "未配置 BOT_TOKEN/CHANNEL_NAME，下载不可用", code="cfg_missing") from e
 
     force_download = download == "1" or download == "true"
-    return await serve_file(meta['file_id'], meta['filename'], telegram_service, client, request, force_download)
+    return await serve_file(
+        meta['file_id'], meta['filename'], telegram_service, client, request, force_download,
+        meta.get('filesize'), meta.get('blob_kind'),
+    )
+
+
+# 分页请求未指定 limit 时的默认页大小
+DEFAULT_PAGE_SIZE = 100
 
 
 @router.get("/api/files")
@@ -411,12 +475,45 @@ async def get_files_list(
     category: str | None = Query(None),
     sort_by: str | None = Query(None, pattern="^(filename|filesize|upload_date)$"),
     sort_order: str | None = Query(None, pattern="^(asc|desc)$"),
-    local_only: bool = Query(False, description="是否只返回本地已下载的文件")
+    local_only: bool = Query(False, description="是否只返回本地已下载的文件"),
+    limit: int | None = Query(None, ge=1, le=1000, description="每页数量；指定后按游标分页返回"),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor"),
 ):
-    # Pass parameters to get_all_files
-    return database.get_all_files(
-        category=category, sort_by=sort_by, sort_order=sort_order, local_only=local_only
-    )
+    """
+    获取文件列表。
+
+    - 未指定 limit / cursor 时保持旧行为，直接返回完整列表。
+    - 指定后使用 keyset 分页，返回 {"items", "next_cursor", "limit"}；
+      总数请使用 /api/files/count 单独获取。
+    """
+    if limit is None and cursor is None:
+        return await file_repo.query(
+            category=category, sort_by=sort_by, sort_order=sort_order, local_only=local_only
+        )
+
+    page_size = limit or DEFAULT_PAGE_SIZE
+    try:
+        page = await file_repo.page(
+            category=category,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            local_only=local_only,
+            limit=page_size,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise http_error(400, str(e), code="invalid_cursor") from e
+    return {**page, "limit": page_size}
+
+
+@router.get("/api/files/count")
+async def get_files_count(
+    category: str | None = Query(None),
+    local_only: bool = Query(False, description="是否只统计本地已下载的文件"),
+):
+    """获取符合过滤条件的文件总数。"""
+    total = await file_repo.count(category=category, local_only=local_only)
+    return {"total": total}
 
 
 @router.delete("/api/files/{file_id}")
@@ -430,17 +527,21 @@ async def delete_file(
         raise http_error(503, "未配置 BOT_TOKEN/CHANNEL_NAME，删除不可用", code="cfg_missing") from e
 
     logger.info(f"【删除】请求删除文件。文件ID: {file_id}")
-    delete_result = await telegram_service.delete_file_with_chunks(file_id)
+    meta = await file_repo.get(file_id)
+    delete_result = await telegram_service.delete_file_with_chunks(file_id, meta.get('blob_kind') if meta else None)
 
     if delete_result.get("main_message_deleted"):
-        was_deleted_from_db = database.delete_file_metadata(file_id)
+        was_deleted_from_db = await file_repo.delete(file_id)
         delete_result["db_status"] = "deleted" if was_deleted_from_db else "not_found_in_db"
     else:
         # 即使 Telegram 删除失败（可能已手动删除），我们也尝试从 DB 删除，避免死数据
         logger.warning(f"【删除】Telegram 删除报告失败 ({delete_result.get('error')})，但尝试强制清理 DB。文件ID: {file_id}")
-        was_deleted_from_db = database.delete_file_metadata(file_id)
+        was_deleted_from_db = await file_repo.delete(file_id)
         delete_result["db_status"] = "force_deleted" if was_deleted_from_db else "not_found_in_db"
 
+    if delete_result.get("db_status") in ("deleted", "force_deleted"):
+        await discard_partial_download(file_id)
+
     # 只要 DB 删除了，或者 TG 删除了，我们都视为成功
     if delete_result.get("status") == "success" or delete_result.get("db_status") in ("deleted", "force_deleted"):
         logger.info(f"【删除】删除操作完成。文件ID: {file_id}，状态: {delete_result.get('db_status')}")
@@ -488,30 +589,126 @@ async def batch_delete_files(
     return {"status": "completed", "deleted": successful_deletions, "failed": failed_deletions}
 
 
-async def stream_chunks(chunk_composite_ids, telegram_service: TelegramService, client: httpx.AsyncClient):
-    for chunk_id in chunk_composite_ids:
-        try:
-            _, actual_chunk_id = chunk_id.split(":", 1)
-        except (ValueError, IndexError):
-            continue
+# 流式输出分块文件时的预读：当前分块之外提前下载的分块数，以及每个分块的缓冲上限（字节）。
+# 每个下载流最多缓冲 (STREAM_PREFETCH_CHUNKS + 1) × STREAM_PREFETCH_BUFFER 字节，缓冲满时暂停读取该分块。
+STREAM_PREFETCH_CHUNKS = int(os.getenv("STREAM_PREFETCH_CHUNKS", "2"))
+STREAM_PREFETCH_BUFFER = int(os.getenv("STREAM_PREFETCH_BUFFER", str(8 * 1024 * 1024)))
+_STREAM_PIECE_SIZE = 64 * 1024
+_CHUNK_END = object()
+
+
+async def _iter_chunk_body(resp: httpx.Response, skip: int, length: int | None):
+    """输出分块响应体；服务器忽略 Range（返回 200）时自行跳过前缀并截断到 length。"""
+    if resp.status_code == 206:
+        skip = 0
+    remaining = length
+    async for data in resp.aiter_bytes(_STREAM_PIECE_SIZE):
+        if skip:
+            if len(data) <= skip:
+                skip -= len(data)
+                continue
+            data = data[skip:]
+            skip = 0
+        if remaining is not None:
+            data = data[:remaining]
+            remaining -= len(data)
+        if data:
+            yield data
+        if remaining == 0:
+            break
+
 
+async def _fetch_chunk(
+    queue: asyncio.Queue,
+    actual_chunk_id: str,
+    chunk_start: int,
+    length: int | None,
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+):
+    """下载一个分块，把数据片段依次放入有界队列；完成时放入 _CHUNK_END，出错时放入异常对象。"""
+    headers = None
+    if chunk_start or length is not None:
+        chunk_end = "" if length is None else chunk_start + length - 1
+        headers = {"Range": f"bytes={chunk_start}-{chunk_end}"}
+    try:
         chunk_url = await telegram_service.get_download_url(actual_chunk_id)
         if not chunk_url:
-            continue
+            raise Exception("无法获取分块下载链接")
+        async with client.stream("GET", chunk_url, headers=headers) as chunk_resp:
+            if chunk_resp.status_code not in (200, 206):
+                if chunk_resp.status_code in EXPIRED_URL_STATUS_CODES:
+                    download_url_cache.invalidate(actual_chunk_id)
+                await asyncio.sleep(1)
+                chunk_url = await telegram_service.get_download_url(actual_chunk_id)
+                if not chunk_url:
+                    raise Exception("无法获取分块下载链接")
+                async with client.stream("GET", chunk_url, headers=headers) as retry_resp:
+                    retry_resp.raise_for_status()
+                    async for chunk_data in _iter_chunk_body(retry_resp, chunk_start, length):
+                        await queue.put(chunk_data)
+            else:
+                async for chunk_data in _iter_chunk_body(chunk_resp, chunk_start, length):
+                    await queue.put(chunk_data)
+        await queue.put(_CHUNK_END)
+    except Exception as e:
+        await queue.put(e)
 
-        try:
-            async with client.stream("GET", chunk_url) as chunk_resp:
-                if chunk_resp.status_code != 200:
-                    await asyncio.sleep(1)
-                    chunk_url = await telegram_service.get_download_url(actual_chunk_id)
-                    if not chunk_url:
-                        break
-                    async with client.stream("GET", chunk_url) as retry_resp:
-                        retry_resp.raise_for_status()
-                        async for chunk_data in retry_resp.aiter_bytes():
-                            yield chunk_data
-                else:
-                    async for chunk_data in chunk_resp.aiter_bytes():
-                        yield chunk_data
-        except httpx.RequestError:
-            break
+
+async def stream_chunks(
+    chunk_composite_ids,
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+    start: int = 0,
+    end: int | None = None,
+):
+    """
+    按顺序流式输出清单中的分块。
+    start / end 为文件内的字节偏移（闭区间）：按 CHUNK_SIZE_BYTES 映射到第 N 个分块及块内偏移，
+    只请求覆盖该范围的分块，首尾分块使用 Range 请求。
+
+    输出当前分块的同时，后续 STREAM_PREFETCH_CHUNKS 个分块已并发获取下载链接并开始下载，
+    分块边界不再等待 getFile 与新建连接；每个分块的缓冲有上限，输出顺序不变。
+    """
+    if not chunk_composite_ids:
+        return
+    first_index = start // CHUNK_SIZE_BYTES
+    last_index = len(chunk_composite_ids) - 1
+    if end is not None:
+        last_index = min(last_index, end // CHUNK_SIZE_BYTES)
+
+    plans = []
+    for index in range(first_index, last_index + 1):
+        chunk_start = start - index * CHUNK_SIZE_BYTES if index == first_index else 0
+        chunk_end = end - index * CHUNK_SIZE_BYTES if end is not None and index == last_index else None
+        length = chunk_end - chunk_start + 1 if chunk_end is not None else None
+        plans.append((index, chunk_composite_ids[index].split(":", 1)[-1], chunk_start, length))
+
+    buffer_pieces = max(1, STREAM_PREFETCH_BUFFER // _STREAM_PIECE_SIZE)
+    window: deque[tuple[int, asyncio.Queue, asyncio.Task]] = deque()
+    next_plan = 0
+    try:
+        while window or next_plan < len(plans):
+            while next_plan < len(plans) and len(window) <= max(0, STREAM_PREFETCH_CHUNKS):
+                index, actual_chunk_id, chunk_start, length = plans[next_plan]
+                queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_pieces)
+                task = asyncio.create_task(_fetch_chunk(queue, actual_chunk_id, chunk_start, length, telegram_service, client))
+                window.append((index, queue, task))
+                next_plan += 1
+
+            index, queue, _ = window[0]
+            while True:
+                item = await queue.get()
+                if item is _CHUNK_END:
+                    break
+                if isinstance(item, Exception):
+                    # 抛出异常让服务器中断连接：正常结束会被客户端当作完整（但被截断）的响应
+                    logger.error(f"【Telegram流式】分块下载失败，已中止。分块: {index}，错误: {item}")
+                    raise item
+                yield item
+            window.popleft()
+    finally:
+        # 客户端断开或出错时取消仍在预读的分块
+        for _, _, task in window:
+            task.cancel()
+        await asyncio.gather(*(task for _, _, task in window), return_exceptions=True)
@@ -0,0 +1,135 @@
+"""
+流式解析 multipart/form-data 请求体。
+
+FastAPI 的 UploadFile / Form 会先把整个请求体解析完（文件部分暂存到临时文件）才进入处理函数；
+这里直接用 python-multipart 边接收边解析，文件内容以数据块的形式交给调用方，不落盘。
+"""
+
+from __future__ import annotations
+
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from fastapi import Request
+
+from .common import http_error
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+# 事件类型
+FIELD = "field"            # 普通表单字段：(字段名, 值)
+FILE_START = "file_start"  # 文件部分开始：MultipartFile
+FILE_DATA = "file_data"    # 文件数据块：bytes
+FILE_END = "file_end"      # 文件部分结束：MultipartFile
+
+# 普通表单字段的最大长度
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+@dataclass
+class MultipartFile:
+    name: str
+    filename: str
+    content_type: str | None = None
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class _PartCollector:
+    """python-multipart 回调是同步的：先把事件收集起来，由异步迭代器逐个交出。"""
+
+    def __init__(self):
+        self.events: list[tuple[str, object]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: dict[str, str] = {}
+        self._file: MultipartFile | None = None
+        self._field_name = ""
+        self._field_data = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._file = None
+        self._field_name = ""
+        self._field_data = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.decode("latin-1").lower()] = self._header_value.decode("utf-8", "replace")
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get("content-disposition", "").encode("utf-8"))
+        if b"name" not in options:
+            raise ValueError("Content-Disposition 缺少 name")
+        name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            self._file = MultipartFile(
+                name=name,
+                filename=options[b"filename"].decode("utf-8", "replace"),
+                content_type=self._headers.get("content-type"),
+                headers=self._headers,
+            )
+            self.events.append((FILE_START, self._file))
+        else:
+            self._field_name = name
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._file is not None:
+            self.events.append((FILE_DATA, data[start:end]))
+            return
+        if len(self._field_data) + end - start > MAX_FIELD_SIZE:
+            raise ValueError(f"表单字段 {self._field_name} 过长")
+        self._field_data += data[start:end]
+
+    def on_part_end(self) -> None:
+        if self._file is not None:
+            self.events.append((FILE_END, self._file))
+        else:
+            self.events.append((FIELD, (self._field_name, self._field_data.decode("utf-8", "replace"))))
+
+
+async def iter_multipart(request: Request) -> AsyncIterator[tuple[str, object]]:
+    """
+    边接收边解析 multipart/form-data 请求体，依次产出 (事件类型, 值)。
+    调用方处理完当前事件后才会继续读取请求体，处理得慢时上传方随之被限速。
+
+    异常:
+        HTTPException(400): Content-Type 不是 multipart/form-data 或请求体格式错误
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise http_error(400, "请求必须是 multipart/form-data 格式。", code="invalid_multipart")
+
+    collector = _PartCollector()
+    parser = multipart.MultipartParser(params[b"boundary"], collector.callbacks())
+    async for data in request.stream():
+        try:
+            parser.write(data)
+        except Exception as e:
+            raise http_error(400, "multipart 请求体格式错误。", code="invalid_multipart", details=str(e)) from e
+        events, collector.events = collector.events, []
+        for event in events:
+            yield event
+    parser.finalize()
@@ -6,13 +6,13 @@ import uuid
 import telegram
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from telegram.request import HTTPXRequest
 
-from .. import database
-from ..core.config import get_app_settings
+from ..core.config import get_app_settings_async
 from ..core.http_client import apply_runtime_settings
 from ..core.logging_config import get_logger
+from ..repository import session_repo, settings_repo
 from .auth import COOKIE_NAME
 from .common import http_error
 
@@ -30,6 +30,7 @@ class AppConfigRequest(BaseModel):
     PASS_WORD: str | None = None
     BASE_URL: str | None = None
     PICGO_API_KEY: str | None = None
+    DOWNLOAD_THREADS: int | None = Field(default=None, ge=1, le=16)
 
 
 def _validate_config(cfg: dict) -> None:
@@ -48,7 +49,7 @@ def _validate_config(cfg: dict) -> None:
 
 @router.get("/api/app-config")
 async def get_app_config(request: Request):
-    cfg = get_app_settings()
+    cfg = await get_app_settings_async()
     bot_ready = bool(getattr(request.app.state, "bot_ready", False))
     return {
         "status": "ok",
@@ -58,6 +59,7 @@ async def get_app_config(request: Request):
             "PASS_WORD_SET": bool((cfg.get("PASS_WORD") or "").strip()),
             "BASE_URL": cfg.get("BASE_URL") or "",
             "PICGO_API_KEY_SET": bool((cfg.get("PICGO_API_KEY") or "").strip()),
+            "DOWNLOAD_THREADS": (await settings_repo.get()).get("DOWNLOAD_THREADS", 4),
         },
         "bot": {
             "ready": bot_ready,
@@ -82,24 +84,28 @@ def _merge_config(existing: dict, incoming: dict) -> dict:
 
 @router.post("/api/app-config/save")
 async def save_config_only(payload: AppConfigRequest, request: Request):
-    existing = database.get_app_settings_from_db()
+    existing = await settings_repo.get()
     incoming = payload.model_dump()
     merged = _merge_config(existing, incoming)
 
     # Partial validation is implicit in _validate_config (it skips empty values)
     _validate_config(merged)
-    database.save_app_settings_to_db(merged)
+    await settings_repo.save(merged)
+    # 下载线程数无需重启即可生效
+    download_service = getattr(request.app.state, "download_service", None)
+    if download_service and merged.get("DOWNLOAD_THREADS"):
+        download_service.resize_workers(merged["DOWNLOAD_THREADS"])
     logger.info("配置已保存（未应用）")
     return {"status": "ok", "message": "已保存（未应用）"}
 
 
 @router.post("/api/app-config/apply")
 async def save_and_apply(payload: AppConfigRequest, request: Request):
-    existing = database.get_app_settings_from_db()
+    existing = await settings_repo.get()
     incoming = payload.model_dump()
     merged = _merge_config(existing, incoming)
     _validate_config(merged)
-    database.save_app_settings_to_db(merged)
+    await settings_repo.save(merged)
 
     # 只有当 BOT_TOKEN 和 CHANNEL_NAME 都存在时才尝试启动 Bot
     # 但 Web 设置无论如何都会保存生效
@@ -123,10 +129,10 @@ async def save_and_apply(payload: AppConfigRequest, request: Request):
         # 清理旧的会话（如果有的话），虽然创建新会话会替换
         old_session_id = request.cookies.get(COOKIE_NAME)
         if old_session_id:
-            database.delete_session(old_session_id)
+            await session_repo.delete(old_session_id)
 
         new_session_id = str(uuid.uuid4())
-        database.create_session(new_session_id)
+        await session_repo.create(new_session_id)
 
         resp.set_cookie(key=COOKIE_NAME, value=new_session_id, httponly=True, samesite="Lax", path="/")
         logger.info("配置已保存并应用，新会话已创建。")
@@ -140,7 +146,7 @@ async def save_and_apply(payload: AppConfigRequest, request: Request):
 
 @router.post("/api/reset-config")
 async def reset_config(request: Request):
-    database.reset_app_settings_in_db()
+    await settings_repo.reset()
     await apply_runtime_settings(request.app, start_bot=True)
     logger.warning("配置已重置")
     resp = JSONResponse(status_code=200, content={"status": "ok", "message": "配置已重置"})
@@ -151,9 +157,9 @@ async def reset_config(request: Request):
 @router.post("/api/set-password")
 async def set_password(payload: PasswordRequest, request: Request):
     try:
-        current = get_app_settings()
+        current = await get_app_settings_async()
         pwd = (payload.password or "").strip()
-        database.save_app_settings_to_db({**current, "PASS_WORD": pwd})
+        await settings_repo.save({**current, "PASS_WORD": pwd})
         await apply_runtime_settings(request.app, start_bot=False)
         logger.info("密码已更新")
         return {"status": "ok", "message": "密码已成功设置。"}
@@ -171,7 +177,7 @@ class VerifyRequest(BaseModel):
 async def verify_bot(payload: VerifyRequest):
     token = (payload.BOT_TOKEN or "").strip()
     if not token:
-        settings = get_app_settings()
+        settings = await get_app_settings_async()
         token = (settings.get("BOT_TOKEN") or "").strip()
     if not token:
         return {"status": "ok", "available": False, "message": "未提供 BOT_TOKEN"}
@@ -192,7 +198,7 @@ async def verify_channel(payload: VerifyRequest):
     channel = (payload.CHANNEL_NAME or "").strip()
 
     if not token or not channel:
-        settings = get_app_settings()
+        settings = await get_app_settings_async()
         token = token or (settings.get("BOT_TOKEN") or "").strip()
         channel = channel or (settings.get("CHANNEL_NAME") or "").strip()
 
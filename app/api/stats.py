@@ -4,8 +4,10 @@ import logging
 
 from fastapi import APIRouter, Depends
 
-from .. import database
 from ..core.config import Settings, get_settings
+from ..repository import file_repo
+from ..services.download_url_cache import download_url_cache
+from ..services.rate_limiter import telegram_rate_limiter
 from .common import http_error
 
 router = APIRouter()
@@ -16,7 +18,7 @@ logger = logging.getLogger(__name__)
 async def get_dashboard_stats(settings: Settings = Depends(get_settings)):
     """获取仪表板统计数据，并适配前端所需格式"""
     try:
-        raw_stats = database.get_statistics()
+        raw_stats = await file_repo.statistics()
 
         def format_size(size_in_bytes):
             if size_in_bytes is None:
@@ -106,9 +108,21 @@ async def get_dashboard_stats(settings: Settings = Depends(get_settings)):
 @router.get("/api/stats/local-files")
 async def get_local_files_stats(settings: Settings = Depends(get_settings)):
     """获取本地文件列表"""
-    local_files = database.get_local_files()
+    local_files = await file_repo.list_local()
     return {
         "status": "success",
         "count": len(local_files),
         "files": local_files
     }
+
+
+@router.get("/api/stats/telegram")
+async def get_telegram_stats():
+    """获取 Telegram API 调用统计（限速排队 / flood wait 耗时与下载链接缓存命中情况）"""
+    return {
+        "status": "success",
+        "data": {
+            "rate_limiter": telegram_rate_limiter.stats(),
+            "url_cache": download_url_cache.stats(),
+        },
+    }
@@ -5,8 +5,8 @@ import logging
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 
-from .. import database
 from ..core.config import Settings, get_settings
+from ..repository import file_repo, tag_repo
 from .common import http_error
 
 router = APIRouter()
@@ -26,7 +26,7 @@ class TagsRequest(BaseModel):
 @router.post("/api/tags/add")
 async def add_tag(request: TagRequest, settings: Settings = Depends(get_settings)):
     """为文件添加单个标签"""
-    success = database.add_file_tag(request.file_id, request.tag)
+    success = await tag_repo.add(request.file_id, request.tag)
     if not success:
         raise http_error(400, "标签已存在或文件不存在", code="tag_exists")
     return {"status": "success", "message": "标签添加成功"}
@@ -38,7 +38,7 @@ async def batch_add_tags(request: TagsRequest, settings: Settings = Depends(get_
     added = []
     failed = []
     for tag in request.tags:
-        if database.add_file_tag(request.file_id, tag):
+        if await tag_repo.add(request.file_id, tag):
             added.append(tag)
         else:
             failed.append(tag)
@@ -54,7 +54,7 @@ async def batch_add_tags(request: TagsRequest, settings: Settings = Depends(get_
 @router.delete("/api/tags/remove")
 async def remove_tag(request: TagRequest, settings: Settings = Depends(get_settings)):
     """移除文件的标签"""
-    success = database.remove_file_tag(request.file_id, request.tag)
+    success = await tag_repo.remove(request.file_id, request.tag)
     if not success:
         raise http_error(404, "标签不存在", code="tag_not_found")
     return {"status": "success", "message": "标签移除成功"}
@@ -63,27 +63,27 @@ async def remove_tag(request: TagRequest, settings: Settings = Depends(get_setti
 @router.get("/api/tags/file/{file_id}")
 async def get_file_tags(file_id: str, settings: Settings = Depends(get_settings)):
     """获取文件的所有标签"""
-    tags = database.get_file_tags(file_id)
+    tags = await tag_repo.for_file(file_id)
     return {"file_id": file_id, "tags": tags}
 
 
 @router.get("/api/tags/all")
 async def get_all_tags(settings: Settings = Depends(get_settings)):
     """获取所有标签及其使用次数"""
-    tags = database.get_all_tags()
+    tags = await tag_repo.all()
     return {"tags": tags}
 
 
 @router.get("/api/tags/search/{tag}")
 async def search_by_tag(tag: str, settings: Settings = Depends(get_settings)):
     """根据标签搜索文件"""
-    file_ids = database.get_files_by_tag(tag)
+    file_ids = await tag_repo.file_ids(tag)
 
     files = []
     for file_id in file_ids:
-        file_data = database.get_file_by_id(file_id)
+        file_data = await file_repo.get(file_id)
         if file_data:
-            file_data["tags"] = database.get_file_tags(file_id)
+            file_data["tags"] = await tag_repo.for_file(file_id)
             files.append(file_data)
 
     return {
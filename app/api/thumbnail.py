@@ -1,13 +1,14 @@
 import logging
 
 import httpx
-from fastapi import APIRouter, Depends, Query, Response
+from fastapi import APIRouter, Depends, Query, Request, Response
 
-from .. import database
 from ..core.http_client import get_http_client
+from ..database import DOWNLOAD_STATE_COMPLETED
+from ..repository import file_repo, settings_repo
 from ..services.telegram_service import get_telegram_service
 from ..services.thumbnail_service import get_thumbnail_service
-from .common import http_error
+from .common import http_error, note_download_demand
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -16,6 +17,7 @@ logger = logging.getLogger(__name__)
 @router.get("/api/thumbnail/{file_id}")
 async def get_thumbnail(
     file_id: str,
+    request: Request,
     size: str = Query("medium", pattern="^(small|medium|large)$"),
     client: httpx.AsyncClient = Depends(get_http_client),
 ):
@@ -28,7 +30,7 @@ async def get_thumbnail(
     """
 
     # 查询文件元数据
-    file_meta = database.get_file_by_id(file_id)
+    file_meta = await file_repo.get(file_id)
     if not file_meta:
         raise http_error(404, "文件不存在", code="file_not_found")
 
@@ -60,23 +62,21 @@ async def get_thumbnail(
     download_url = None
     local_file_path = None
 
-    if file_meta.get('local_path'):
+    if file_meta.get('download_state') == DOWNLOAD_STATE_COMPLETED and file_meta.get('local_path'):
         local_path_value = file_meta['local_path']
-        # 跳过占位符标记（__downloading_, __error_）
-        if not local_path_value.startswith('__'):
-            from ..core.config import get_app_settings
-            import os
-            settings = get_app_settings()
-            download_dir = settings.get('DOWNLOAD_DIR', '/app/downloads')
-            full_local_path = os.path.join(download_dir, local_path_value)
-
-            if os.path.exists(full_local_path):
-                local_file_path = full_local_path
-                logger.info(f"【缩略图】使用本地文件生成缩略图: {file_meta['filename']}")
+        import os
+        settings = await settings_repo.get()
+        download_dir = settings.get('DOWNLOAD_DIR', '/app/downloads')
+        full_local_path = os.path.join(download_dir, local_path_value)
+
+        if os.path.exists(full_local_path):
+            local_file_path = full_local_path
+            logger.info(f"【缩略图】使用本地文件生成缩略图: {file_meta['filename']}")
 
     # 如果本地文件不存在，从 Telegram 获取
     if not local_file_path:
         logger.info(f"【缩略图】从 Telegram 获取文件生成缩略图: {file_meta['filename']}")
+        await note_download_demand(request, file_meta)
         try:
             telegram_service = get_telegram_service()
         except Exception as e:
@@ -1,62 +1,176 @@
 from __future__ import annotations
 
-import contextlib
-import os
-import shutil
-import tempfile
+import base64
+import binascii
+import json
+from collections.abc import AsyncIterator
 
-from fastapi import APIRouter, Depends, File, Form, Header, Request, UploadFile
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 
-from ..core.config import Settings, get_app_settings, get_settings
+from ..core.config import Settings, get_app_settings_async, get_settings
 from ..core.logging_config import get_logger
-from ..services.telegram_service import get_telegram_service
+from ..services.batch_upload import BATCH_UPLOAD_MAX_FILE_SIZE, BatchUpload
+from ..services.resumable_upload import UploadSessionError, resumable_uploads
+from ..services.telegram_service import CHUNK_SIZE_BYTES, get_telegram_service
 from .common import ensure_upload_auth, http_error
+from .multipart_stream import FIELD, FILE_DATA, FILE_END, FILE_START, iter_multipart
 
 router = APIRouter()
 logger = get_logger(__name__)
 
+# key / token 字段位于文件字段之后时，认证前最多在内存中缓冲的文件大小；更大的文件必须先认证，不落盘
+UPLOAD_PENDING_AUTH_MAX_BYTES = 1024 * 1024
+
+
+def _submitted_key(x_api_key: str | None, authorization: str | None, fields: dict[str, str] | None = None) -> str | None:
+    submitted_key = x_api_key or (fields or {}).get("key") or (fields or {}).get("token")
+    if not submitted_key and authorization and authorization.startswith("Bearer "):
+        submitted_key = authorization.split(" ", 1)[1]
+    return submitted_key
+
+
+async def _upload_settings() -> dict:
+    """读取应用设置，并检查上传所需的 BOT_TOKEN / CHANNEL_NAME 已配置。"""
+    app_settings = await get_app_settings_async()
+    if not (app_settings.get("BOT_TOKEN") or "").strip() or not (app_settings.get("CHANNEL_NAME") or "").strip():
+        logger.error("【上传】缺少配置：BOT_TOKEN 或 CHANNEL_NAME")
+        raise http_error(503, "缺少 BOT_TOKEN 或 CHANNEL_NAME，无法上传", code="cfg_missing")
+    return app_settings
+
+
+async def _ensure_upload_ready(request: Request, x_api_key: str | None, authorization: str | None) -> None:
+    """续传 / 批量接口的公共检查：上传配置齐全且请求已认证（仅使用请求头中的凭据）。"""
+    app_settings = await _upload_settings()
+    await ensure_upload_auth(request, app_settings, _submitted_key(x_api_key, authorization))
+
+
+def _session_error(e: UploadSessionError) -> HTTPException:
+    """会话错误转换为 HTTP 错误；带偏移时同时通过 Upload-Offset 响应头返回，客户端据此续传。"""
+    if e.offset is None:
+        return http_error(e.status_code, e.message, code=e.code)
+    exc = http_error(e.status_code, e.message, code=e.code, details={"offset": e.offset})
+    exc.headers = {"Upload-Offset": str(e.offset)}
+    return exc
+
+
+async def _declared_duplicate(x_content_sha256: str | None, filename: str | None) -> str | None:
+    """客户端通过 X-Content-SHA256 声明的内容已存在时返回已有文件的 short_id。"""
+    if not x_content_sha256:
+        return None
+    existing_short_id = await get_telegram_service().find_duplicate(x_content_sha256.strip().lower())
+    if existing_short_id:
+        logger.info(f"【上传】内容已存在，直接返回。文件名: {filename} -> ID: {existing_short_id}")
+    return existing_short_id
+
+
+def _upload_result(short_id: str) -> dict:
+    file_path = f"/d/{short_id}"
+    return {
+        "file_id": short_id,
+        "short_id": short_id,
+        "download_path": file_path,
+        "path": file_path,
+        "url": file_path,
+    }
+
+
+def _session_headers(session: dict) -> dict[str, str]:
+    return {
+        "Upload-Offset": str(session["received_bytes"]),
+        "Upload-Length": str(session["total_size"]),
+        "Cache-Control": "no-store",
+    }
 
 
 @router.post("/api/upload")
 async def upload_file(
     request: Request,
-    file: UploadFile = File(...),
-    key: str | None = Form(None),
-    token: str | None = Form(None),
     settings: Settings = Depends(get_settings),
     x_api_key: str | None = Header(None),
     authorization: str | None = Header(None),
+    x_content_sha256: str | None = Header(None),
 ):
-    app_settings = get_app_settings()
-    if not (app_settings.get("BOT_TOKEN") or "").strip() or not (app_settings.get("CHANNEL_NAME") or "").strip():
-        logger.error("【上传】缺少配置：BOT_TOKEN 或 CHANNEL_NAME")
-        raise http_error(503, "缺少 BOT_TOKEN 或 CHANNEL_NAME，无法上传", code="cfg_missing")
+    """
+    上传文件（multipart/form-data，文件字段为 file，可选 key / token 字段）。
 
-    submitted_key = x_api_key or key or token
-    if not submitted_key and authorization and authorization.startswith("Bearer "):
-        submitted_key = authorization.split(" ", 1)[1]
+    已认证（会话、X-API-Key / Authorization 请求头，或位于文件字段之前的 key / token 字段）时，
+    请求体边接收边按 19.5MB 分块推送到 Telegram，不写临时文件。key / token 字段位于文件字段之后时，
+    只有不超过 UPLOAD_PENDING_AUTH_MAX_BYTES 的文件会先缓冲在内存中、读完请求体并认证通过后再上传，
+    更大的文件直接返回 401。
+    相同内容（SHA-256）已上传过时返回已有文件的 short_id。未声明哈希时要读完整个文件才能判断是否重复，
+    此时大文件的分块已发送到 Telegram（随后删除）：节省的是存储而不是传输。要在传输前去重，
+    客户端应通过 X-Content-SHA256 请求头预先声明哈希，命中时不再读取文件内容直接返回。
+    """
+    app_settings = await _upload_settings()
 
-    ensure_upload_auth(request, app_settings, submitted_key)
-    logger.info(f"【上传】开始上传文件。文件名: {file.filename}，大小: {file.size or '未知'} 字节")
-
-    temp_file_path = None
+    fields: dict[str, str] = {}
+    upload = None
+    # 认证字段尚未到达时在内存中缓冲文件内容
+    pending = None
+    filename = None
+    completed = False
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as temp_file:
-            temp_file_path = temp_file.name
-            shutil.copyfileobj(file.file, temp_file)
+        async for event, value in iter_multipart(request):
+            if event == FIELD:
+                fields.setdefault(*value)
+            elif event == FILE_START and upload is None and pending is None and value.name == "file":
+                filename = value.filename
+                try:
+                    await ensure_upload_auth(request, app_settings, _submitted_key(x_api_key, authorization, fields))
+                except HTTPException as e:
+                    # key / token 字段可能位于文件之后：小文件先缓冲，读完请求体后再认证（仅在配置了 API Key 时）
+                    if e.status_code != 401 or not app_settings.get("PICGO_API_KEY") or "key" in fields or "token" in fields:
+                        raise
+                    pending = bytearray()
+                    continue
+
+                existing_short_id = await _declared_duplicate(x_content_sha256, filename)
+                if existing_short_id:
+                    return _upload_result(existing_short_id)
+
+                logger.info(f"【上传】开始上传文件。文件名: {filename}，大小: {request.headers.get('content-length') or '未知'} 字节（含表单开销）")
+                upload = get_telegram_service().open_upload(filename)
+            elif event == FILE_DATA and not completed:
+                if upload is not None:
+                    await upload.write(value)
+                elif pending is not None:
+                    if len(pending) + len(value) > UPLOAD_PENDING_AUTH_MAX_BYTES:
+                        raise http_error(
+                            401,
+                            "文件较大时 key / token 字段须位于 file 字段之前（或使用 X-API-Key 请求头）",
+                            code="auth_required_before_file",
+                        )
+                    pending += value
+            elif event == FILE_END and value.filename == filename:
+                completed = True
+
+        if upload is None and pending is None:
+            raise http_error(400, "缺少上传文件（字段名 file）。", code="file_missing")
+        if not completed:
+            raise http_error(400, "上传的文件不完整。", code="upload_incomplete")
 
-        telegram_service = get_telegram_service()
-        file_id = await telegram_service.upload_file(temp_file_path, file.filename)
+        if pending is not None:
+            await ensure_upload_auth(request, app_settings, _submitted_key(x_api_key, authorization, fields))
+
+            existing_short_id = await _declared_duplicate(x_content_sha256, filename)
+            if existing_short_id:
+                return _upload_result(existing_short_id)
+
+            logger.info(f"【上传】开始上传缓冲的文件。文件名: {filename}，大小: {len(pending)} 字节")
+            upload = get_telegram_service().open_upload(filename)
+            await upload.write(bytes(pending))
+        file_id = await upload.finish()
     except Exception as e:
-        logger.error(f"【上传】上传失败。文件名: {file.filename}，错误: {str(e)}", exc_info=e)
+        if upload is not None:
+            await upload.abort()
+        if isinstance(e, HTTPException):
+            raise
+        logger.error(f"【上传】上传失败。文件名: {filename}，错误: {str(e)}", exc_info=e)
         raise http_error(500, "文件上传失败。", code="upload_failed", details=str(e)) from e
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            with contextlib.suppress(OSError):
-                os.unlink(temp_file_path)
 
     if not file_id:
-        logger.error(f"【上传】上传失败：未返回 file_id。文件名: {file.filename}")
+        logger.error(f"【上传】上传失败：未返回 file_id。文件名: {filename}")
         raise http_error(500, "文件上传失败。", code="upload_failed")
 
     # 构造短链 URL: /d/{short_id}
@@ -66,7 +180,7 @@ async def upload_file(
     # 始终返回相对路径，前端负责拼接 origin
     full_url = file_path
 
-    logger.info(f"【上传】上传成功。文件名: {file.filename} -> ID: {file_id}")
+    logger.info(f"【上传】上传成功。文件名: {filename}，大小: {upload.size} 字节 -> ID: {file_id}")
     return {
         "file_id": file_id,          # 这里的 file_id 是用于分享的 ID (即 short_id)
         "short_id": file_id,         # 兼容旧字段
@@ -75,3 +189,296 @@ async def upload_file(
         "url": str(full_url)         # 兼容旧字段
     }
 
+
+
+# ==================== 可续传上传 ====================
+# 流程：POST 创建会话 -> PATCH 按 Upload-Offset 追加数据（中断后用 HEAD 查询偏移继续）-> POST finalize 完成。
+
+
+@router.post("/api/upload/sessions", status_code=201)
+async def create_upload_session(
+    request: Request,
+    response: Response,
+    filename: str = Body(..., embed=True),
+    size: int = Body(..., embed=True),
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """创建续传上传会话，返回 upload_id 与服务端分块大小（客户端按该大小的整数倍发送数据效率最高）。"""
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        session = await resumable_uploads.create(filename, size, get_telegram_service())
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+
+    location = f"/api/upload/sessions/{session['upload_id']}"
+    response.headers.update(_session_headers(session))
+    response.headers["Location"] = location
+    logger.info(f"【续传上传】已创建上传会话。upload_id: {session['upload_id']}，文件名: {filename}，大小: {size} 字节")
+    return {
+        "upload_id": session["upload_id"],
+        "offset": session["received_bytes"],
+        "size": session["total_size"],
+        "chunk_size": CHUNK_SIZE_BYTES,
+        "location": location,
+    }
+
+
+@router.head("/api/upload/sessions/{upload_id}")
+async def head_upload_session(
+    upload_id: str,
+    request: Request,
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """查询当前偏移（Upload-Offset 响应头）。"""
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        session = await resumable_uploads.status(upload_id)
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+    return Response(status_code=200, headers=_session_headers(session))
+
+
+@router.get("/api/upload/sessions/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        session = await resumable_uploads.status(upload_id)
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+    response.headers.update(_session_headers(session))
+    return {
+        "upload_id": upload_id,
+        "filename": session["filename"],
+        "offset": session["received_bytes"],
+        "size": session["total_size"],
+        "chunk_size": CHUNK_SIZE_BYTES,
+        "chunks_uploaded": len(session["chunk_ids"]),
+        "completed": bool(session["short_id"]),
+        "short_id": session["short_id"],
+    }
+
+
+@router.patch("/api/upload/sessions/{upload_id}")
+async def append_upload_session(
+    upload_id: str,
+    request: Request,
+    upload_offset: str | None = Header(None),
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """从 Upload-Offset 处追加请求体数据；连接中断时已收到的数据保留，客户端查询偏移后继续。"""
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        offset = int(upload_offset or "")
+    except ValueError:
+        raise http_error(400, "缺少或无效的 Upload-Offset 请求头。", code="invalid_offset") from None
+    if offset < 0:
+        raise http_error(400, "缺少或无效的 Upload-Offset 请求头。", code="invalid_offset")
+
+    try:
+        new_offset = await resumable_uploads.append(upload_id, offset, request.stream(), get_telegram_service())
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"【续传上传】追加数据失败。upload_id: {upload_id}，错误: {str(e)}", exc_info=e)
+        raise http_error(500, "追加数据失败，请查询偏移后重试。", code="upload_failed", details=str(e)) from e
+    return Response(status_code=204, headers={"Upload-Offset": str(new_offset), "Cache-Control": "no-store"})
+
+
+@router.post("/api/upload/sessions/{upload_id}/finalize")
+async def finalize_upload_session(
+    upload_id: str,
+    request: Request,
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """全部数据上传后提交，返回结果与 /api/upload 相同。"""
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        short_id = await resumable_uploads.finalize(upload_id, get_telegram_service())
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+    except Exception as e:
+        logger.error(f"【续传上传】提交失败。upload_id: {upload_id}，错误: {str(e)}", exc_info=e)
+        raise http_error(500, "文件上传失败。", code="upload_failed", details=str(e)) from e
+    return _upload_result(short_id)
+
+
+@router.delete("/api/upload/sessions/{upload_id}")
+async def delete_upload_session(
+    upload_id: str,
+    request: Request,
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """取消上传并删除已上传到 Telegram 的分块。"""
+    await _ensure_upload_ready(request, x_api_key, authorization)
+    try:
+        await resumable_uploads.abort(upload_id, get_telegram_service())
+    except UploadSessionError as e:
+        raise _session_error(e) from e
+    return {"status": "ok", "upload_id": upload_id}
+
+
+# ==================== 批量上传 ====================
+
+
+@router.post("/api/upload/batch")
+async def upload_batch(
+    request: Request,
+    x_api_key: str | None = Header(None),
+    authorization: str | None = Header(None),
+):
+    """
+    批量上传多个文件，请求体为以下两种格式之一：
+    - multipart/form-data：每个文件部分都作为一个文件上传，可选 key / token 字段需位于第一个文件之前；
+    - application/x-ndjson：每行一个 {"filename": ..., "content": <base64>}。
+
+    所有文件共用一条有界流水线发送到 Telegram（读取请求体的同时即开始上传），元数据成组在单个事务中写入。
+    响应为 NDJSON：每个文件完成时输出一行结果（含 index，与请求中的顺序对应），最后一行为汇总。
+    单个文件需小于一个分块（约 19.5MB），更大的文件在结果中报告为 file_too_large。
+    """
+    app_settings = await _upload_settings()
+    content_type = (request.headers.get("content-type") or "").split(";", 1)[0].strip().lower()
+    is_ndjson = content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl")
+    if is_ndjson:
+        await ensure_upload_auth(request, app_settings, _submitted_key(x_api_key, authorization))
+
+    batch = BatchUpload(get_telegram_service())
+    try:
+        if is_ndjson:
+            await _read_ndjson_batch(request, batch)
+        else:
+            await _read_multipart_batch(request, batch, app_settings, x_api_key, authorization)
+    except BaseException as e:
+        # 已提交的文件继续上传并登记，避免留下未登记的消息；之后再返回错误
+        await batch.close()
+        async for _ in batch.results():
+            pass
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        logger.error(f"【批量上传】读取请求失败。错误: {str(e)}", exc_info=e)
+        raise http_error(400, "读取批量上传请求失败。", code="upload_failed", details=str(e)) from e
+    await batch.close()
+
+    logger.info(f"【批量上传】请求体读取完毕。文件数: {batch.count}")
+    # 请求体需先读完（ASGI 2.3 下流式响应会与读取请求体争用 receive），其余结果随上传完成逐行输出
+    return StreamingResponse(_batch_results(batch), media_type="application/x-ndjson")
+
+
+async def _read_multipart_batch(
+    request: Request, batch: BatchUpload, app_settings: dict, x_api_key: str | None, authorization: str | None
+) -> None:
+    fields: dict[str, str] = {}
+    authenticated = False
+    current: bytearray | None = None
+    too_large = False
+    async for event, value in iter_multipart(request):
+        if event == FIELD:
+            fields.setdefault(*value)
+        elif event == FILE_START:
+            if not authenticated:
+                await ensure_upload_auth(request, app_settings, _submitted_key(x_api_key, authorization, fields))
+                authenticated = True
+            current, too_large = bytearray(), False
+        elif event == FILE_DATA and current is not None and not too_large:
+            if len(current) + len(value) > BATCH_UPLOAD_MAX_FILE_SIZE:
+                # 超过上限的文件不再缓存，只报告错误
+                too_large, current = True, bytearray()
+            else:
+                current += value
+        elif event == FILE_END and current is not None:
+            if too_large:
+                batch.reject(value.filename, "file_too_large", "文件过大，请使用 /api/upload 上传。")
+            else:
+                await batch.add(value.filename, bytes(current))
+            current = None
+
+    if not authenticated:
+        raise http_error(400, "缺少上传文件。", code="file_missing")
+    if current is not None:
+        raise http_error(400, "上传的文件不完整。", code="upload_incomplete")
+
+
+async def _read_ndjson_batch(request: Request, batch: BatchUpload) -> None:
+    # base64 编码后的长度上限，超过的行直接丢弃
+    max_line = (BATCH_UPLOAD_MAX_FILE_SIZE + 2) // 3 * 4 + 64 * 1024
+    async for line in _iter_lines(request, max_line):
+        if line is None:
+            batch.reject(None, "file_too_large", "文件过大，请使用 /api/upload 上传。")
+            continue
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            batch.reject(None, "invalid_item", "该行不是有效的 JSON。")
+            continue
+        filename = item.get("filename") if isinstance(item, dict) else None
+        if not isinstance(filename, str) or not filename:
+            batch.reject(None, "invalid_item", "缺少文件名。")
+            continue
+        try:
+            data = base64.b64decode(item.get("content") or "", validate=True)
+        except (binascii.Error, ValueError, TypeError):
+            batch.reject(filename, "invalid_item", "content 不是有效的 base64。")
+            continue
+        if not data:
+            batch.reject(filename, "invalid_item", "文件内容为空。")
+        elif len(data) > BATCH_UPLOAD_MAX_FILE_SIZE:
+            batch.reject(filename, "file_too_large", "文件过大，请使用 /api/upload 上传。")
+        else:
+            await batch.add(filename, data)
+
+
+async def _iter_lines(request: Request, max_line: int) -> AsyncIterator[bytes | None]:
+    """按行读取请求体；超过 max_line 的行丢弃并产出 None。"""
+    buffer = bytearray()
+    skipping = False
+    async for data in request.stream():
+        buffer += data
+        while (pos := buffer.find(b"\n")) >= 0:
+            line = bytes(buffer[:pos])
+            del buffer[:pos + 1]
+            if skipping:
+                skipping = False
+                yield None
+            else:
+                yield line
+        if len(buffer) > max_line:
+            skipping = True
+            buffer.clear()
+    if skipping:
+        yield None
+    elif buffer:
+        yield bytes(buffer)
+
+
+async def _batch_results(batch: BatchUpload) -> AsyncIterator[bytes]:
+    succeeded = failed = 0
+    try:
+        async for result in batch.results():
+            if "error" in result:
+                failed += 1
+                line = {"status": "error", **result}
+            else:
+                succeeded += 1
+                line = {"status": "ok", **result, **_upload_result(result["short_id"])}
+            yield (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+    except BaseException:
+        # 客户端断开：不再发送排队中的文件，已发送的文件登记后结束
+        await batch.abort()
+        raise
+    logger.info(f"【批量上传】完成。成功: {succeeded}，失败: {failed}")
+    summary = {"status": "done", "total": succeeded + failed, "succeeded": succeeded, "failed": failed}
+    yield (json.dumps(summary, ensure_ascii=False) + "\n").encode("utf-8")
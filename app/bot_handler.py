@@ -5,18 +5,20 @@ from urllib.parse import quote
 from telegram import Update
 from telegram.ext import Application, ContextTypes, MessageHandler, filters
 
-from . import database
 from .core.logging_config import get_logger
-from .events import build_file_event, file_update_queue
+from .database import BLOB_KIND_SINGLE
+from .events import build_file_event, file_update_queue, new_file_queue
+from .repository import file_repo, settings_repo
+from .services.download_service import discard_partial_download
 from .services.telegram_service import get_telegram_service
 
 logger = get_logger(__name__)
 
-def _get_bot_settings(context: ContextTypes.DEFAULT_TYPE) -> dict:
+async def _get_bot_settings(context: ContextTypes.DEFAULT_TYPE) -> dict:
     """获取最新的应用设置。"""
     # 直接从数据库读取以确保获取到的是最新值，而不是启动时的快照
     try:
-        return database.get_app_settings_from_db()
+        return await settings_repo.get()
     except Exception:
         return {}
 
@@ -27,7 +29,7 @@ async def handle_new_file(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     处理新增的文件或照片，将其元数据存入数据库，并通过队列发送通知。
     在函数内部检查消息来源是否为授权的聊天（私聊、群组或频道）。
     """
-    settings = _get_bot_settings(context)
+    settings = await _get_bot_settings(context)
     message = update.message or update.channel_post
 
     # 1. 确保有消息
@@ -104,12 +106,16 @@ async def handle_new_file(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         composite_id = f"{message.message_id}:{file_obj.file_id}"
         logger.info(f"【Bot】处理新文件。文件名: {file_name}，大小: {file_size_mb:.2f}MB，mime_type: {mime_type}，消息ID: {message.message_id}")
 
-        short_id = database.add_file_metadata(
+        # 文件内容不经过本服务，content_hash 由下载服务下载到本地后回填
+        short_id = await file_repo.add(
             filename=file_name,
             file_id=composite_id,
             filesize=file_obj.file_size,
-            mime_type=mime_type
+            mime_type=mime_type,
+            blob_kind=BLOB_KIND_SINGLE,
         )
+        # 通知下载服务立即调度该文件
+        new_file_queue.push(composite_id)
 
         upload_date = message.date.astimezone(UTC).isoformat()
         file_event = build_file_event(
@@ -141,7 +147,7 @@ async def handle_get_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     document = replied_message.document or replied_message.photo[-1]
     file_id = document.file_id
     file_name = getattr(document, "file_name", f"photo_{replied_message.message_id}.jpg")
-    settings = _get_bot_settings(context)
+    settings = await _get_bot_settings(context)
 
     final_file_id = f"{replied_message.message_id}:{file_id}"
     final_file_name = file_name
@@ -175,8 +181,9 @@ async def handle_deleted_message(update: Update, context: ContextTypes.DEFAULT_T
     # 我们通过检查 `update.edited_message` 是否存在来判断消息是否被删除。
     if update.edited_message and not update.edited_message.text:
         message_id = update.edited_message.message_id
-        deleted_file_id = database.delete_file_by_message_id(message_id)
+        deleted_file_id = await file_repo.delete_by_message_id(message_id)
         if deleted_file_id:
+            await discard_partial_download(deleted_file_id)
             delete_event = build_file_event(action="delete", file_id=deleted_file_id)
             await file_update_queue.put(json.dumps(delete_event))
 
@@ -124,3 +124,17 @@ def get_app_settings() -> dict:
         ),
         "BASE_URL": (db_settings.get("BASE_URL") or env.BASE_URL),
     }
+
+
+async def get_active_password_async() -> str | None:
+    """get_active_password 的异步版本：在数据库线程池中读取，避免阻塞事件循环。"""
+    from ..repository import run_in_db
+
+    return await run_in_db(get_active_password)
+
+
+async def get_app_settings_async() -> dict:
+    """get_app_settings 的异步版本：在数据库线程池中读取，避免阻塞事件循环。"""
+    from ..repository import run_in_db
+
+    return await run_in_db(get_app_settings)
@@ -8,8 +8,9 @@ from fastapi import FastAPI
 # 导入应用所需的其他模块
 from .. import database
 from ..bot_handler import create_bot_app
-from ..core.config import get_app_settings
+from ..core.config import get_app_settings, get_app_settings_async
 from ..services.download_service import get_download_service  # New import
+from ..services.download_url_cache import download_url_cache
 from ..services.telegram_service import (
     get_telegram_service,  # New import, needed for DownloadService
 )
@@ -70,8 +71,12 @@ async def _start_bot(app: FastAPI, app_settings: dict) -> None:
 
 async def apply_runtime_settings(app: FastAPI, *, start_bot: bool = True) -> None:
     async with app.state.settings_lock:
-        current = get_app_settings()
+        previous = getattr(app.state, "app_settings", None) or {}
+        current = await get_app_settings_async()
         app.state.app_settings = current
+        if (previous.get("BOT_TOKEN") or "").strip() != (current.get("BOT_TOKEN") or "").strip():
+            # 下载链接中包含 bot token，换 token 后旧链接全部失效
+            download_url_cache.clear()
         bot_ready = _is_bot_ready(current)
         app.state.bot_ready = bot_ready
         app.state.bot_error = None
@@ -148,6 +153,9 @@ async def lifespan(app: FastAPI):
     http_client = httpx.AsyncClient(timeout=timeout, limits=limits)
     logger.info("共享的 HTTP 客户端已创建（支持大文件下载）")
 
+    # 定期清理过期的 Telegram 下载链接
+    download_url_cache.start()
+
     # 3. 启动 Telegram Bot（仅在 BOT_TOKEN + CHANNEL_NAME 都存在时）
     if app.state.bot_ready:
         try:
@@ -186,6 +194,9 @@ async def lifespan(app: FastAPI):
     # 3. 停止 Telegram Bot
     await _stop_bot(app)
 
+    # 4. 停止下载链接缓存的清理任务
+    await download_url_cache.stop()
+
 
 def get_http_client() -> httpx.AsyncClient:
     """
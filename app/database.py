@@ -1,8 +1,12 @@
+import base64
+import json
 import os
 import random
 import sqlite3
 import string
 import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
 from datetime import datetime, timedelta
 
 from .core.logging_config import get_logger
@@ -14,198 +18,466 @@ DATABASE_URL = os.path.join(DATA_DIR, "file_metadata.db")
 
 logger = get_logger(__name__)
 
-# 使用线程锁来确保多线程环境下的数据库访问安全
-db_lock = threading.Lock()
-
-def get_db_connection() -> sqlite3.Connection:
-    """获取数据库连接。"""
-    conn = sqlite3.connect(DATABASE_URL, check_same_thread=False)
+# 连接级调优参数：WAL 允许读写并发，NORMAL 同步级别在 WAL 下仍保证崩溃一致性
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256MB 内存映射读
+    "PRAGMA cache_size=-65536",    # 64MB 页缓存（负数表示 KiB）
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# 文件的自动下载状态（files.download_state）
+DOWNLOAD_STATE_PENDING = "pending"          # 尚未下载
+DOWNLOAD_STATE_DOWNLOADING = "downloading"  # 下载中（state_changed_at 为开始时间）
+DOWNLOAD_STATE_RETRYING = "retrying"        # 下载失败，等待 next_attempt_at 后重试
+DOWNLOAD_STATE_FAILED = "failed"            # 已达最大重试次数，不再自动重试
+DOWNLOAD_STATE_COMPLETED = "completed"      # 已下载到本地（local_path 有效）
+DOWNLOAD_STATES = (
+    DOWNLOAD_STATE_PENDING,
+    DOWNLOAD_STATE_DOWNLOADING,
+    DOWNLOAD_STATE_RETRYING,
+    DOWNLOAD_STATE_FAILED,
+    DOWNLOAD_STATE_COMPLETED,
+)
+
+# 文件在 Telegram 上的存储形式（files.blob_kind），NULL 表示未知（旧记录，首次访问时探测并回填）
+BLOB_KIND_SINGLE = "single"      # 单个文档
+BLOB_KIND_MANIFEST = "manifest"  # 清单 + 分块（chunk_count / chunk_size 记录分块布局）
+
+DEFAULT_DOWNLOAD_MAX_RETRIES = 5
+# 失败重试的指数退避：第 n 次失败后等待 30s * 2^(n-1)
+DOWNLOAD_RETRY_BASE_DELAY = 30
+# 处于 downloading 超过该时长（秒）视为中断的下载，可重新调度
+DOWNLOAD_STALE_SECONDS = 600
+
+
+def _open_connection(database_url: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(database_url, check_same_thread=False, timeout=5.0)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+
+def get_db_connection() -> sqlite3.Connection:
+    """获取一个独立的数据库连接（已应用调优参数），调用方负责关闭。"""
+    return _open_connection(DATABASE_URL)
+
+
+class ConnectionPool:
+    """
+    SQLite 连接池。
+
+    - 读连接：每个线程持有一个长连接（query_only），在 WAL 模式下彼此并发，且不会被写入阻塞。
+    - 写连接：全局唯一，由 write_lock 串行化，SQLite 同一时刻本就只允许一个写事务。
+    """
+
+    def __init__(self, database_url: str):
+        self.database_url = database_url
+        self.write_lock = threading.Lock()
+        self._writer_conn: sqlite3.Connection | None = None
+        self._local = threading.local()
+        self._reader_conns: list[sqlite3.Connection] = []
+        self._reader_conns_lock = threading.Lock()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """获取当前线程的读连接。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _open_connection(self.database_url)
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+            with self._reader_conns_lock:
+                self._reader_conns.append(conn)
+        yield conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """独占写连接；发生异常时回滚未提交的事务。"""
+        with self.write_lock:
+            if self._writer_conn is None:
+                self._writer_conn = _open_connection(self.database_url)
+            conn = self._writer_conn
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close_all(self) -> None:
+        """关闭池中所有连接（用于进程退出或测试）。"""
+        with self.write_lock:
+            if self._writer_conn is not None:
+                self._writer_conn.close()
+                self._writer_conn = None
+        with self._reader_conns_lock:
+            for conn in self._reader_conns:
+                with suppress(Exception):
+                    conn.close()
+            self._reader_conns.clear()
+        self._local = threading.local()
+
+
+_pool: ConnectionPool | None = None
+_pool_init_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """获取全局连接池；DATABASE_URL 变化时重建。"""
+    global _pool
+    if _pool is None or _pool.database_url != DATABASE_URL:
+        with _pool_init_lock:
+            if _pool is None or _pool.database_url != DATABASE_URL:
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DATABASE_URL)
+    return _pool
+
+
+def _reader():
+    return get_pool().reader()
+
+
+def _writer():
+    return get_pool().writer()
+
+
 def generate_short_id(length=6):
     chars = string.ascii_letters + string.digits
     return ''.join(random.choice(chars) for _ in range(length))
 
 def init_db() -> None:
     """初始化数据库，创建表。"""
-    with db_lock:
-        conn = get_db_connection()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                file_id TEXT NOT NULL UNIQUE,
+                filesize INTEGER NOT NULL,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                short_id TEXT UNIQUE,
+                local_path TEXT,
+                download_count INTEGER DEFAULT 0,
+                mime_type TEXT
+            );
+        """)
+
+        # 检查新列是否存在，不存在则添加
+        cursor.execute("PRAGMA table_info(files)")
+        columns = [info[1] for info in cursor.fetchall()]
+
+        if "short_id" not in columns:
+            logger.info("数据库迁移: 正在添加 short_id 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN short_id TEXT")
+            except Exception as e:
+                logger.error("迁移警告：添加 short_id 列失败: %s", e)
+
+        if "local_path" not in columns:
+            logger.info("数据库迁移: 正在添加 local_path 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN local_path TEXT")
+            except Exception as e:
+                logger.error("迁移警告：添加 local_path 列失败: %s", e)
+
+        if "download_count" not in columns:
+            logger.info("数据库迁移: 正在添加 download_count 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN download_count INTEGER DEFAULT 0")
+            except Exception as e:
+                logger.error("迁移警告：添加 download_count 列失败: %s", e)
+
+        if "mime_type" not in columns:
+            logger.info("数据库迁移: 正在添加 mime_type 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN mime_type TEXT")
+            except Exception as e:
+                logger.error("迁移警告：添加 mime_type 列失败: %s", e)
+
+        if "retry_count" not in columns:
+            logger.info("数据库迁移: 正在添加 retry_count 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN retry_count INTEGER DEFAULT 0")
+            except Exception as e:
+                logger.error("迁移警告：添加 retry_count 列失败: %s", e)
+
+        if "last_retry_time" not in columns:
+            logger.info("数据库迁移: 正在添加 last_retry_time 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN last_retry_time TIMESTAMP")
+            except Exception as e:
+                logger.error("迁移警告：添加 last_retry_time 列失败: %s", e)
+
+        if "category" not in columns:
+            logger.info("数据库迁移: 正在添加 category 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN category TEXT")
+            except Exception as e:
+                logger.error("迁移警告：添加 category 列失败: %s", e)
+
+        if "download_state" not in columns:
+            logger.info("数据库迁移: 正在添加 download_state / state_changed_at / next_attempt_at 列...")
+            try:
+                cursor.execute(f"ALTER TABLE files ADD COLUMN download_state TEXT NOT NULL DEFAULT '{DOWNLOAD_STATE_PENDING}'")
+                cursor.execute("ALTER TABLE files ADD COLUMN state_changed_at TIMESTAMP")
+                cursor.execute("ALTER TABLE files ADD COLUMN next_attempt_at TIMESTAMP")
+                _migrate_local_path_markers(cursor)
+            except Exception as e:
+                logger.error("迁移警告：添加 download_state 列失败: %s", e)
+
+        if "blob_kind" not in columns:
+            logger.info("数据库迁移: 正在添加 blob_kind / chunk_count / chunk_size 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN blob_kind TEXT")
+                cursor.execute("ALTER TABLE files ADD COLUMN chunk_count INTEGER")
+                cursor.execute("ALTER TABLE files ADD COLUMN chunk_size INTEGER")
+            except Exception as e:
+                logger.error("迁移警告：添加 blob_kind 列失败: %s", e)
+
+        if "content_hash" not in columns:
+            logger.info("数据库迁移: 正在添加 content_hash 列...")
+            try:
+                cursor.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+            except Exception as e:
+                logger.error("迁移警告：添加 content_hash 列失败: %s", e)
+
+        # 回填文件类别：与写入时使用同一套推断规则（mime_type 优先，其次扩展名）
         try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    file_id TEXT NOT NULL UNIQUE,
-                    filesize INTEGER NOT NULL,
-                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    short_id TEXT UNIQUE,
-                    local_path TEXT,
-                    download_count INTEGER DEFAULT 0,
-                    mime_type TEXT
-                );
-            """)
-
-            # 检查新列是否存在，不存在则添加
-            cursor.execute("PRAGMA table_info(files)")
-            columns = [info[1] for info in cursor.fetchall()]
-
-            if "short_id" not in columns:
-                logger.info("数据库迁移: 正在添加 short_id 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN short_id TEXT")
-                except Exception as e:
-                    logger.error("迁移警告：添加 short_id 列失败: %s", e)
-
-            if "local_path" not in columns:
-                logger.info("数据库迁移: 正在添加 local_path 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN local_path TEXT")
-                except Exception as e:
-                    logger.error("迁移警告：添加 local_path 列失败: %s", e)
-
-            if "download_count" not in columns:
-                logger.info("数据库迁移: 正在添加 download_count 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN download_count INTEGER DEFAULT 0")
-                except Exception as e:
-                    logger.error("迁移警告：添加 download_count 列失败: %s", e)
-
-            if "mime_type" not in columns:
-                logger.info("数据库迁移: 正在添加 mime_type 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN mime_type TEXT")
-                except Exception as e:
-                    logger.error("迁移警告：添加 mime_type 列失败: %s", e)
-
-            if "retry_count" not in columns:
-                logger.info("数据库迁移: 正在添加 retry_count 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN retry_count INTEGER DEFAULT 0")
-                except Exception as e:
-                    logger.error("迁移警告：添加 retry_count 列失败: %s", e)
-
-            if "last_retry_time" not in columns:
-                logger.info("数据库迁移: 正在添加 last_retry_time 列...")
-                try:
-                    cursor.execute("ALTER TABLE files ADD COLUMN last_retry_time TIMESTAMP")
-                except Exception as e:
-                    logger.error("迁移警告：添加 last_retry_time 列失败: %s", e)
-
-            # 确保唯一索引存在
+            conn.create_function("file_category", 2, _get_file_category_from_mime, deterministic=True)
+            cursor.execute("UPDATE files SET category = file_category(mime_type, filename) WHERE category IS NULL")
+            if cursor.rowcount > 0:
+                logger.info("数据库迁移: 已为 %d 个文件回填 category", cursor.rowcount)
+        except Exception as e:
+            logger.error("迁移警告：回填 category 失败: %s", e)
+
+        # 确保唯一索引存在
+        try:
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_files_short_id ON files(short_id)")
+        except Exception as e:
+            logger.error("迁移警告：创建索引 idx_files_short_id 失败: %s", e)
+
+        # 文件列表 keyset 分页使用的 (排序字段, id) 复合索引
+        for column in FILE_SORT_COLUMNS:
             try:
-                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_files_short_id ON files(short_id)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_files_{column}_id ON files({column}, id)")
             except Exception as e:
-                logger.error("迁移警告：创建索引 idx_files_short_id 失败: %s", e)
-
-            # 创建文件标签表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS file_tags (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    file_id TEXT NOT NULL,
-                    tag TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(file_id, tag),
-                    FOREIGN KEY(file_id) REFERENCES files(file_id) ON DELETE CASCADE
-                );
-            """)
-
-            # 创建标签索引以便快速查询
+                logger.error("迁移警告：创建索引 idx_files_%s_id 失败: %s", column, e)
+
+        # 按内容哈希去重使用的部分索引（未计算哈希的旧记录不进入索引）
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash) WHERE content_hash IS NOT NULL")
+        except Exception as e:
+            logger.error("迁移警告：创建索引 idx_files_content_hash 失败: %s", e)
+
+        # 按类别过滤 / 统计使用的索引（同时覆盖类别内按上传时间的默认排序）
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_category ON files(category, upload_date, id)")
+        except Exception as e:
+            logger.error("迁移警告：创建索引 idx_files_category 失败: %s", e)
+
+        # 下载调度使用的部分索引：只索引对应状态的行，调度器只需读取到期的少量记录
+        for index_sql in (
+            f"CREATE INDEX IF NOT EXISTS idx_files_state_pending ON files(upload_date, id) WHERE download_state = '{DOWNLOAD_STATE_PENDING}'",
+            f"CREATE INDEX IF NOT EXISTS idx_files_state_retrying ON files(next_attempt_at) WHERE download_state = '{DOWNLOAD_STATE_RETRYING}'",
+            f"CREATE INDEX IF NOT EXISTS idx_files_state_downloading ON files(state_changed_at) WHERE download_state = '{DOWNLOAD_STATE_DOWNLOADING}'",
+            f"CREATE INDEX IF NOT EXISTS idx_files_state_completed ON files(upload_date, id) WHERE download_state = '{DOWNLOAD_STATE_COMPLETED}'",
+        ):
             try:
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_tags_tag ON file_tags(tag)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_tags_file_id ON file_tags(file_id)")
+                cursor.execute(index_sql)
             except Exception as e:
-                logger.error("创建标签索引失败: %s", e)
-
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS app_settings (
-                    id INTEGER PRIMARY KEY CHECK (id = 1),
-                    bot_token TEXT,
-                    channel_name TEXT,
-                    pass_word TEXT,
-                    picgo_api_key TEXT,
-                    base_url TEXT,
-                    auto_download_enabled INTEGER DEFAULT 1,
-                    download_dir TEXT DEFAULT '/app/downloads',
-                    download_file_types TEXT DEFAULT 'image,video',
-                    download_max_size INTEGER DEFAULT 52428800,
-                    download_min_size INTEGER DEFAULT 0
-                );
-            """)
-
-            # 检查app_settings新列
-            cursor.execute("PRAGMA table_info(app_settings)")
-            settings_columns = [info[1] for info in cursor.fetchall()]
-
-            if "auto_download_enabled" not in settings_columns:
-                logger.info("正在将 auto_download_enabled 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN auto_download_enabled INTEGER DEFAULT 1")
-                    # 更新现有记录为启用状态
-                    cursor.execute("UPDATE app_settings SET auto_download_enabled = 1 WHERE auto_download_enabled IS NULL")
-                except Exception as e:
-                    logger.error("添加 auto_download_enabled 失败: %s", e)
-
-            if "download_dir" not in settings_columns:
-                logger.info("正在将 download_dir 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN download_dir TEXT DEFAULT '/app/downloads'")
-                except Exception as e:
-                    logger.error("添加 download_dir 失败: %s", e)
-
-            if "download_file_types" not in settings_columns:
-                logger.info("正在将 download_file_types 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN download_file_types TEXT DEFAULT 'image,video'")
-                except Exception as e:
-                    logger.error("添加 download_file_types 失败: %s", e)
-
-            if "download_max_size" not in settings_columns:
-                logger.info("正在将 download_max_size 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN download_max_size INTEGER DEFAULT 52428800")
-                except Exception as e:
-                    logger.error("添加 download_max_size 失败: %s", e)
-
-            if "download_min_size" not in settings_columns:
-                logger.info("正在将 download_min_size 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN download_min_size INTEGER DEFAULT 0")
-                except Exception as e:
-                    logger.error("添加 download_min_size 失败: %s", e)
-
-            if "download_threads" not in settings_columns:
-                logger.info("正在将 download_threads 添加到 app_settings...")
-                try:
-                    cursor.execute("ALTER TABLE app_settings ADD COLUMN download_threads INTEGER DEFAULT 4")
-                except Exception as e:
-                    logger.error("添加 download_threads 失败: %s", e)
-
-            # 确保存在单行设置记录，并默认启用自动下载
-            cursor.execute("INSERT OR IGNORE INTO app_settings (id, auto_download_enabled) VALUES (1, 1)")
-            # 如果记录已存在但 auto_download_enabled 为 NULL 或 0，更新为 1
-            cursor.execute("UPDATE app_settings SET auto_download_enabled = 1 WHERE id = 1 AND auto_download_enabled = 0")
-
-            # 创建会话表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL
-                );
-            """)
-
-            # 创建过期时间索引以便快速清理过期会话
+                logger.error("迁移警告：创建下载状态索引失败: %s", e)
+
+        # 创建文件标签表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS file_tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(file_id, tag),
+                FOREIGN KEY(file_id) REFERENCES files(file_id) ON DELETE CASCADE
+            );
+        """)
+
+        # 创建标签索引以便快速查询
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_tags_tag ON file_tags(tag)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_tags_file_id ON file_tags(file_id)")
+        except Exception as e:
+            logger.error("创建标签索引失败: %s", e)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS app_settings (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                bot_token TEXT,
+                channel_name TEXT,
+                pass_word TEXT,
+                picgo_api_key TEXT,
+                base_url TEXT,
+                auto_download_enabled INTEGER DEFAULT 1,
+                download_dir TEXT DEFAULT '/app/downloads',
+                download_file_types TEXT DEFAULT 'image,video',
+                download_max_size INTEGER DEFAULT 52428800,
+                download_min_size INTEGER DEFAULT 0
+            );
+        """)
+
+        # 检查app_settings新列
+        cursor.execute("PRAGMA table_info(app_settings)")
+        settings_columns = [info[1] for info in cursor.fetchall()]
+
+        if "auto_download_enabled" not in settings_columns:
+            logger.info("正在将 auto_download_enabled 添加到 app_settings...")
             try:
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)")
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN auto_download_enabled INTEGER DEFAULT 1")
+                # 更新现有记录为启用状态
+                cursor.execute("UPDATE app_settings SET auto_download_enabled = 1 WHERE auto_download_enabled IS NULL")
             except Exception as e:
-                logger.error("创建索引 idx_sessions_expires_at 失败: %s", e)
+                logger.error("添加 auto_download_enabled 失败: %s", e)
+
+        if "download_dir" not in settings_columns:
+            logger.info("正在将 download_dir 添加到 app_settings...")
+            try:
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN download_dir TEXT DEFAULT '/app/downloads'")
+            except Exception as e:
+                logger.error("添加 download_dir 失败: %s", e)
+
+        if "download_file_types" not in settings_columns:
+            logger.info("正在将 download_file_types 添加到 app_settings...")
+            try:
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN download_file_types TEXT DEFAULT 'image,video'")
+            except Exception as e:
+                logger.error("添加 download_file_types 失败: %s", e)
+
+        if "download_max_size" not in settings_columns:
+            logger.info("正在将 download_max_size 添加到 app_settings...")
+            try:
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN download_max_size INTEGER DEFAULT 52428800")
+            except Exception as e:
+                logger.error("添加 download_max_size 失败: %s", e)
+
+        if "download_min_size" not in settings_columns:
+            logger.info("正在将 download_min_size 添加到 app_settings...")
+            try:
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN download_min_size INTEGER DEFAULT 0")
+            except Exception as e:
+                logger.error("添加 download_min_size 失败: %s", e)
+
+        if "download_threads" not in settings_columns:
+            logger.info("正在将 download_threads 添加到 app_settings...")
+            try:
+                cursor.execute("ALTER TABLE app_settings ADD COLUMN download_threads INTEGER DEFAULT 4")
+            except Exception as e:
+                logger.error("添加 download_threads 失败: %s", e)
+
+        # 确保存在单行设置记录，并默认启用自动下载
+        cursor.execute("INSERT OR IGNORE INTO app_settings (id, auto_download_enabled) VALUES (1, 1)")
+        # 如果记录已存在但 auto_download_enabled 为 NULL 或 0，更新为 1
+        cursor.execute("UPDATE app_settings SET auto_download_enabled = 1 WHERE id = 1 AND auto_download_enabled = 0")
+
+        # 分块文件清单缓存：清单（按清单的 Telegram file_id）与其分块列表，避免每次访问都下载解析清单
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS manifests (
+                manifest_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS manifest_chunks (
+                manifest_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                chunk_size INTEGER,
+                PRIMARY KEY (manifest_id, chunk_index),
+                FOREIGN KEY(manifest_id) REFERENCES manifests(manifest_id) ON DELETE CASCADE
+            ) WITHOUT ROWID;
+        """)
+
+        # 可续传上传会话：已接收的字节数与已上传到 Telegram 的分块（不足一个分块的尾部数据暂存在 DATA_DIR/uploads 中）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                total_size INTEGER NOT NULL,
+                received_bytes INTEGER NOT NULL DEFAULT 0,
+                first_message_id INTEGER,
+                short_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS upload_session_chunks (
+                upload_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                PRIMARY KEY (upload_id, chunk_index),
+                FOREIGN KEY(upload_id) REFERENCES upload_sessions(upload_id) ON DELETE CASCADE
+            ) WITHOUT ROWID;
+        """)
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions(updated_at)")
+        except Exception as e:
+            logger.error("创建索引 idx_upload_sessions_updated_at 失败: %s", e)
+
+        # 创建会话表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL
+            );
+        """)
+
+        # 创建过期时间索引以便快速清理过期会话
+        try:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)")
+        except Exception as e:
+            logger.error("创建索引 idx_sessions_expires_at 失败: %s", e)
+
+        conn.commit()
+        logger.info("数据库已成功初始化")
+
+def _migrate_local_path_markers(cursor: sqlite3.Cursor) -> None:
+    """
+    将旧版本写在 local_path 中的状态标记（__downloading_<ts>、__error_*）迁移到 download_state。
+
+    - __downloading_*：进程已重启，下载不可能仍在进行，回到 pending
+    - __error_*：按重试次数区分 retrying / failed，next_attempt_at 按指数退避规则计算
+    - 其他非空 local_path：completed
+    """
+    cursor.execute(f"""
+        UPDATE files SET download_state = '{DOWNLOAD_STATE_COMPLETED}', state_changed_at = CURRENT_TIMESTAMP
+        WHERE local_path IS NOT NULL AND local_path != '' AND local_path NOT GLOB '__*'
+    """)
+    cursor.execute(f"""
+        UPDATE files SET
+            download_state = CASE WHEN COALESCE(retry_count, 0) >= {DEFAULT_DOWNLOAD_MAX_RETRIES}
+                                  THEN '{DOWNLOAD_STATE_FAILED}' ELSE '{DOWNLOAD_STATE_RETRYING}' END,
+            state_changed_at = COALESCE(last_retry_time, CURRENT_TIMESTAMP),
+            next_attempt_at = CASE WHEN COALESCE(retry_count, 0) >= {DEFAULT_DOWNLOAD_MAX_RETRIES} THEN NULL
+                                   ELSE datetime(COALESCE(last_retry_time, CURRENT_TIMESTAMP),
+                                                 '+' || ({DOWNLOAD_RETRY_BASE_DELAY} << MIN(MAX(COALESCE(retry_count, 0) - 1, 0), 16)) || ' seconds')
+                                   END,
+            local_path = NULL
+        WHERE local_path GLOB '__error_*'
+    """)
+    cursor.execute(f"""
+        UPDATE files SET download_state = '{DOWNLOAD_STATE_PENDING}', state_changed_at = CURRENT_TIMESTAMP, local_path = NULL
+        WHERE local_path GLOB '__*'
+    """)
+    cursor.execute("UPDATE files SET local_path = NULL WHERE local_path = ''")
+    logger.info("数据库迁移: 已将 local_path 中的下载状态标记迁移到 download_state 列")
 
-            conn.commit()
-            logger.info("数据库已成功初始化")
-        finally:
-            conn.close()
 
 # 辅助函数，用于将 mime 类型映射到分类
 def _get_file_category_from_mime(mime_type: str | None, filename: str | None = None) -> str:
@@ -250,6 +522,67 @@ def _get_file_category_from_mime(mime_type: str | None, filename: str | None = N
     return "other"
 
 
+# 文件类别（英文存储值）及其中文别名
+FILE_CATEGORIES = ("image", "video", "audio", "document", "other")
+FILE_CATEGORY_ALIASES = {
+    **{c: c for c in FILE_CATEGORIES},
+    "图片": "image",
+    "视频": "video",
+    "音频": "audio",
+    "文档": "document",
+    "其他": "other",
+}
+
+# 文件列表允许的排序字段（同时也是 keyset 游标的排序键），每个字段都有 (字段, id) 复合索引
+FILE_SORT_COLUMNS = ("filename", "filesize", "upload_date")
+
+_FILE_LIST_COLUMNS = (
+    "id, filename, file_id, filesize, upload_date, short_id, mime_type, category, local_path, "
+    "download_state, retry_count, last_retry_time, next_attempt_at, blob_kind, chunk_count, chunk_size, content_hash"
+)
+
+
+def _build_file_filters(category: str | None, local_only: bool) -> tuple[list[str], list]:
+    """根据类别和本地模式构造 WHERE 子句列表及其参数。"""
+    where_clauses = []
+    params = []
+
+    # 本地模式：返回已下载 + 下载中 + 重试中 + 失败的文件（即已进入下载流程的文件）
+    if local_only:
+        where_clauses.append(f"download_state != '{DOWNLOAD_STATE_PENDING}'")
+
+    if category:
+        # 支持英文和中文 category 参数，直接命中 category 列索引
+        normalized = FILE_CATEGORY_ALIASES.get(category.lower())
+        if normalized:
+            where_clauses.append("category = ?")
+            params.append(normalized)
+
+    return where_clauses, params
+
+
+def _normalize_sort(sort_by: str | None, sort_order: str | None) -> tuple[str, str]:
+    """返回白名单内的排序字段与方向，默认按上传时间倒序。"""
+    safe_sort_by = sort_by if sort_by in FILE_SORT_COLUMNS else "upload_date"
+    safe_sort_order = "ASC" if sort_order and sort_order.lower() == "asc" else "DESC"
+    return safe_sort_by, safe_sort_order
+
+
+def _file_rows_to_dicts(rows) -> list[dict]:
+    files = []
+    # 使用默认的 max_retries 值5，避免在读取过程中再次查询设置
+    # 如果需要使用配置的值，调用者应该先获取设置再调用此函数
+    max_retries = 5
+
+    for row in rows:
+        d = dict(row)
+        d.pop("id", None)
+        # 计算下载状态，传递 max_retries
+        d['download_status'] = _compute_download_status(d, max_retries)
+        files.append(d)
+    return files
+
+
 def get_all_files(category: str | None = None, sort_by: str | None = None, sort_order: str | None = None, local_only: bool = True) -> list[dict]:
     """
     从数据库中获取所有文件的元数据，支持按类别、排序字段和排序顺序过滤。
@@ -262,86 +595,110 @@ def get_all_files(category: str | None = None, sort_by: str | None = None, sort_
                     - True: 返回已下载、下载中、重试中的文件
                     - False: 返回所有文件
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            query = "SELECT filename, file_id, filesize, upload_date, short_id, mime_type, local_path, retry_count, last_retry_time FROM files"
-            params = []
-
-            where_clauses = []
-
-            # 本地模式：返回已下载 + 下载中 + 重试中的文件
-            if local_only:
-                # local_path 不为空（包括成功下载的、__downloading_、__error_）
-                where_clauses.append("local_path IS NOT NULL AND local_path != ''")
-
-            if category:
-                # 支持英文和中文 category 参数
-                category_lower = category.lower()
-
-                if category_lower in ("image", "图片"):
-                    where_clauses.append("mime_type LIKE 'image/%'")
-                elif category_lower in ("video", "视频"):
-                    where_clauses.append("mime_type LIKE 'video/%'")
-                elif category_lower in ("audio", "音频"):
-                    where_clauses.append("mime_type LIKE 'audio/%'")
-                elif category_lower in ("document", "文档"):
-                    where_clauses.append("mime_type IN ('application/pdf', 'application/msword', 'application/vnd.ms-excel', 'application/vnd.ms-powerpoint', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.openxmlformats-officedocument.presentationml.presentation')")
-                elif category_lower in ("other", "其他"):
-                    # For 'other', filter out known types that have specific categories
-                    known_mime_types = [
-                        "image/%", "video/%", "audio/%", "application/pdf", "application/msword",
-                        "application/vnd.ms-excel", "application/vnd.ms-powerpoint",
-                        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                    ]
-                    # Construct NOT LIKE and NOT IN clauses
-                    not_like_clauses = [f"mime_type NOT LIKE '{mt}'" for mt in ["image/%", "video/%", "audio/%"]]
-                    not_in_clauses = [f"mime_type NOT IN ({', '.join(['?' for _ in known_mime_types[3:]])})"]
-                    where_clauses.append(f"(mime_type IS NULL OR ({' AND '.join(not_like_clauses)} AND {not_in_clauses[0]}))")
-                    params.extend(known_mime_types[3:])
-
-
-            if where_clauses:
-                query += " WHERE " + " AND ".join(where_clauses)
-
-            order_map = {
-                "filename": "filename",
-                "filesize": "filesize",
-                "upload_date": "upload_date"
-            }
-            # Default sort_by and sort_order if not provided
-            safe_sort_by = order_map.get(sort_by, "upload_date")
-            safe_sort_order = "DESC" # Default
+    where_clauses, params = _build_file_filters(category, local_only)
+    safe_sort_by, safe_sort_order = _normalize_sort(sort_by, sort_order)
+
+    query = f"SELECT {_FILE_LIST_COLUMNS} FROM files"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    query += f" ORDER BY {safe_sort_by} {safe_sort_order}, id {safe_sort_order}"
+
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return _file_rows_to_dicts(cursor.fetchall())
+
 
-            if sort_order and sort_order.lower() == "asc":
-                safe_sort_order = "ASC"
-            # else remains "DESC"
+def encode_files_cursor(sort_by: str, sort_order: str, value, row_id: int) -> str:
+    """将分页位置编码为不透明的游标字符串。"""
+    raw = json.dumps([sort_by, sort_order, value, row_id], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
 
-            query += f" ORDER BY {safe_sort_by} {safe_sort_order}"
 
-            cursor.execute(query, params)
-            files = []
-            # 使用默认的 max_retries 值5，避免在锁内部再次查询导致死锁
-            # 如果需要使用配置的值，调用者应该先获取设置再调用此函数
-            max_retries = 5
+def decode_files_cursor(cursor: str) -> tuple[str, str, object, int]:
+    """
+    解析游标字符串。
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_by, sort_order, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise ValueError("无效的分页游标") from e
+    if sort_by not in FILE_SORT_COLUMNS or sort_order not in ("ASC", "DESC") or not isinstance(row_id, int):
+        raise ValueError("无效的分页游标")
+    return sort_by, sort_order, value, row_id
+
+
+def get_files_page(
+    category: str | None = None,
+    sort_by: str | None = None,
+    sort_order: str | None = None,
+    local_only: bool = True,
+    limit: int = 100,
+    cursor: str | None = None,
+) -> dict:
+    """
+    按 keyset（排序字段 + id）分页获取文件列表，翻页代价与页码无关。
 
-            for row in cursor.fetchall():
-                d = dict(row)
-                # 计算下载状态，传递 max_retries
-                d['download_status'] = _compute_download_status(d, max_retries)
-                files.append(d)
-            return files
-        finally:
-            conn.close()
+    Args:
+        category / sort_by / sort_order / local_only: 同 get_all_files
+        limit: 每页数量
+        cursor: 上一页返回的 next_cursor；为空表示第一页
+
+    Returns:
+        {"items": [...], "next_cursor": str | None}
+
+    Raises:
+        ValueError: 游标无效，或游标与当前排序方式不一致
+    """
+    where_clauses, params = _build_file_filters(category, local_only)
+    safe_sort_by, safe_sort_order = _normalize_sort(sort_by, sort_order)
+
+    if cursor:
+        cursor_sort_by, cursor_sort_order, last_value, last_id = decode_files_cursor(cursor)
+        if (cursor_sort_by, cursor_sort_order) != (safe_sort_by, safe_sort_order):
+            raise ValueError("分页游标与当前排序方式不一致")
+        comparator = ">" if safe_sort_order == "ASC" else "<"
+        where_clauses.append(f"({safe_sort_by}, id) {comparator} (?, ?)")
+        params.extend([last_value, last_id])
+
+    query = f"SELECT {_FILE_LIST_COLUMNS} FROM files"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    # 多取一行用于判断是否还有下一页
+    query += f" ORDER BY {safe_sort_by} {safe_sort_order}, id {safe_sort_order} LIMIT ?"
+    params.append(limit + 1)
+
+    with _reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_files_cursor(safe_sort_by, safe_sort_order, last[safe_sort_by], last["id"])
+
+    return {"items": _file_rows_to_dicts(rows), "next_cursor": next_cursor}
+
+
+def count_files(category: str | None = None, local_only: bool = True) -> int:
+    """统计符合过滤条件的文件数量（与 get_files_page 使用相同的过滤条件）。"""
+    where_clauses, params = _build_file_filters(category, local_only)
+    query = "SELECT COUNT(*) FROM files"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+
+    with _reader() as conn:
+        return conn.execute(query, params).fetchone()[0]
 
 
 def _compute_download_status(file_info: dict, max_retries: int = 5) -> dict:
     """
-    根据文件的 local_path 和 retry_count 计算下载状态。
+    根据文件的 download_state 和 retry_count 计算下载状态。
 
     Args:
         file_info: 文件信息字典
@@ -355,17 +712,17 @@ def _compute_download_status(file_info: dict, max_retries: int = 5) -> dict:
             "max_retries": 最大重试次数
         }
     """
-    local_path = file_info.get('local_path') or ''
+    state = file_info.get('download_state') or DOWNLOAD_STATE_PENDING
     retry_count = file_info.get('retry_count') or 0
 
-    if not local_path:
+    if state == DOWNLOAD_STATE_PENDING:
         return {"status": "pending", "label": "待下载"}
 
-    if local_path.startswith('__downloading_'):
+    if state == DOWNLOAD_STATE_DOWNLOADING:
         return {"status": "downloading", "label": "下载中"}
 
-    if local_path.startswith('__error_'):
-        if retry_count >= max_retries:
+    if state in (DOWNLOAD_STATE_RETRYING, DOWNLOAD_STATE_FAILED):
+        if state == DOWNLOAD_STATE_FAILED or retry_count >= max_retries:
             return {
                 "status": "failed",
                 "label": "下载失败",
@@ -380,107 +737,206 @@ def _compute_download_status(file_info: dict, max_retries: int = 5) -> dict:
                 "max_retries": max_retries
             }
 
-    # 有有效的 local_path，表示下载完成
     return {"status": "completed", "label": "已下载"}
 
 
-def add_file_metadata(filename: str, file_id: str, filesize: int, mime_type: str = None) -> str:
+def add_file_metadata(
+    filename: str,
+    file_id: str,
+    filesize: int,
+    mime_type: str = None,
+    blob_kind: str | None = None,
+    chunk_count: int | None = None,
+    chunk_size: int | None = None,
+    content_hash: str | None = None,
+) -> str:
     """
     向数据库中添加一个新的文件元数据记录。
     如果 file_id 已存在，则忽略。
+    blob_kind / chunk_count / chunk_size 记录文件在 Telegram 上的存储形式，提供文件时据此直接决定读取方式。
+    content_hash 为文件内容的 SHA-256（十六进制），用于按内容去重。
     返回: short_id
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
+    with _writer() as conn:
+        short_id = _insert_file_metadata(
+            conn.cursor(), filename, file_id, filesize, mime_type, blob_kind, chunk_count, chunk_size, content_hash
+        )
+        conn.commit()
+        return short_id
 
-            # 尝试生成唯一的 short_id
-            for attempt in range(5):
+
+def add_files_metadata(records: list[dict]) -> list[str]:
+    """
+    在一个事务中批量添加文件元数据（批量上传使用），返回与 records 顺序对应的 short_id 列表。
+    每条记录的键与 add_file_metadata 的参数相同；file_id 已存在的记录返回现有的 short_id。
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        short_ids = [
+            _insert_file_metadata(
+                cursor,
+                record["filename"],
+                record["file_id"],
+                record["filesize"],
+                record.get("mime_type"),
+                record.get("blob_kind"),
+                record.get("chunk_count"),
+                record.get("chunk_size"),
+                record.get("content_hash"),
+            )
+            for record in records
+        ]
+        conn.commit()
+        return short_ids
+
+
+def _insert_file_metadata(
+    cursor: sqlite3.Cursor,
+    filename: str,
+    file_id: str,
+    filesize: int,
+    mime_type: str | None,
+    blob_kind: str | None,
+    chunk_count: int | None,
+    chunk_size: int | None,
+    content_hash: str | None,
+) -> str:
+    """插入一条文件记录（不提交），返回 short_id。"""
+    category = _get_file_category_from_mime(mime_type, filename)
+
+    # 尝试生成唯一的 short_id
+    for attempt in range(5):
+        short_id = generate_short_id()
+        try:
+            cursor.execute(
+                """
+                INSERT INTO files (filename, file_id, filesize, short_id, mime_type, category, blob_kind, chunk_count, chunk_size, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (filename, file_id, filesize, short_id, mime_type, category, blob_kind, chunk_count, chunk_size, content_hash)
+            )
+            logger.info(f"【数据库】文件元数据已添加。文件名: {filename}，short_id: {short_id}，文件大小: {filesize} bytes")
+            return short_id
+        except sqlite3.IntegrityError as e:
+            if "short_id" in str(e):
+                logger.debug(f"【数据库】short_id 冲突，重试 (尝试 {attempt + 1}/5)。生成的ID: {short_id}")
+                continue # 冲突重试
+            # 可能是 file_id 冲突，如果是这样，查询现有的 short_id
+            cursor.execute("SELECT short_id FROM files WHERE file_id = ?", (file_id,))
+            row = cursor.fetchone()
+            if row and row[0]:
+                logger.info(f"【数据库】文件已存在，返回现有的 short_id: {row[0]}")
+                return row[0]
+            # 如果有记录但没 short_id (旧数据)，更新它
+            if row:
                 short_id = generate_short_id()
-                try:
-                    cursor.execute(
-                        "INSERT INTO files (filename, file_id, filesize, short_id, mime_type) VALUES (?, ?, ?, ?, ?)",
-                        (filename, file_id, filesize, short_id, mime_type)
-                    )
-                    conn.commit()
-                    logger.info(f"【数据库】文件元数据已添加。文件名: {filename}，short_id: {short_id}，文件大小: {filesize} bytes")
-                    return short_id
-                except sqlite3.IntegrityError as e:
-                    if "short_id" in str(e):
-                        logger.debug(f"【数据库】short_id 冲突，重试 (尝试 {attempt + 1}/5)。生成的ID: {short_id}")
-                        continue # 冲突重试
-                    # 可能是 file_id 冲突，如果是这样，查询现有的 short_id
-                    cursor.execute("SELECT short_id FROM files WHERE file_id = ?", (file_id,))
-                    row = cursor.fetchone()
-                    if row and row[0]:
-                        logger.info(f"【数据库】文件已存在，返回现有的 short_id: {row[0]}")
-                        return row[0]
-                    # 如果有记录但没 short_id (旧数据)，更新它
-                    if row:
-                        short_id = generate_short_id()
-                        cursor.execute("UPDATE files SET short_id = ? WHERE file_id = ?", (short_id, file_id))
-                        conn.commit()
-                        logger.info(f"【数据库】为旧记录补充 short_id。文件名: {filename}，short_id: {short_id}")
-                        return short_id
-                    logger.error(f"【数据库】file_id 冲突但记录不存在。file_id: {file_id}")
-                    raise e
-
-            # 如果多次重试失败（极低概率），抛错
-            logger.error(f"【数据库】生成唯一 short_id 失败，已重试 5 次。文件名: {filename}")
-            raise Exception("Failed to generate unique short_id")
-
-        finally:
-            conn.close()
+                cursor.execute("UPDATE files SET short_id = ? WHERE file_id = ?", (short_id, file_id))
+                logger.info(f"【数据库】为旧记录补充 short_id。文件名: {filename}，short_id: {short_id}")
+                return short_id
+            logger.error(f"【数据库】file_id 冲突但记录不存在。file_id: {file_id}")
+            raise e
+
+    # 如果多次重试失败（极低概率），抛错
+    logger.error(f"【数据库】生成唯一 short_id 失败，已重试 5 次。文件名: {filename}")
+    raise Exception("Failed to generate unique short_id")
+
 
 def get_file_by_id(identifier: str) -> dict | None:
     """通过 file_id 或 short_id 从数据库中获取单个文件元数据。"""
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            logger.debug(f"【数据库】查询文件。标识符: {identifier}")
-            cursor.execute("SELECT filename, filesize, upload_date, file_id, short_id FROM files WHERE short_id = ? OR file_id = ?", (identifier, identifier))
-            result = cursor.fetchone()
-            if result:
-                logger.debug(f"【数据库】文件查询成功。文件名: {result['filename']}，file_id: {result['file_id'][:20]}...，short_id: {result['short_id']}")
-                return {
-                    "filename": result["filename"],
-                    "filesize": result["filesize"],
-                    "upload_date": result["upload_date"],
-                    "file_id": result["file_id"],
-                    "short_id": result["short_id"]
-                }
-            logger.debug(f"【数据库】文件未找到。标识符: {identifier}")
-            return None
-        finally:
-            conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        logger.debug(f"【数据库】查询文件。标识符: {identifier}")
+        cursor.execute(
+            """
+            SELECT filename, filesize, upload_date, file_id, short_id, mime_type, category,
+                   local_path, download_state, retry_count, blob_kind, chunk_count, chunk_size, content_hash
+            FROM files WHERE short_id = ? OR file_id = ?
+            """,
+            (identifier, identifier),
+        )
+        result = cursor.fetchone()
+        if result:
+            logger.debug(f"【数据库】文件查询成功。文件名: {result['filename']}，file_id: {result['file_id'][:20]}...，short_id: {result['short_id']}")
+            file_info = dict(result)
+            file_info["download_status"] = _compute_download_status(file_info)
+            return file_info
+        logger.debug(f"【数据库】文件未找到。标识符: {identifier}")
+        return None
+
+def get_file_by_content_hash(content_hash: str) -> dict | None:
+    """
+    按内容哈希查找已有文件（有多条时返回最早的一条），用于上传去重。
+    Bot 直接收到的文件登记时没有哈希（内容不经过本服务），下载服务下载到本地后才回填，在此之前不会被匹配。
+    """
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT filename, filesize, file_id, short_id FROM files WHERE content_hash = ? ORDER BY id LIMIT 1",
+            (content_hash,),
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def get_local_copy_by_content_hash(content_hash: str, exclude_file_id: str | None = None) -> str | None:
+    """返回内容相同且已下载到本地的文件的 local_path（相对下载目录），没有时返回 None。"""
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT local_path FROM files
+            WHERE content_hash = ? AND file_id != ? AND download_state = '{DOWNLOAD_STATE_COMPLETED}'
+              AND local_path IS NOT NULL
+            ORDER BY id LIMIT 1
+            """,
+            (content_hash, exclude_file_id or ""),
+        )
+        row = cursor.fetchone()
+        return row["local_path"] if row else None
+
+
+def update_content_hash(file_id: str, content_hash: str) -> bool:
+    """回填文件的内容哈希（下载完成后计算得到）。"""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE files SET content_hash = ? WHERE file_id = ?", (content_hash, file_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def update_blob_layout(file_id: str, blob_kind: str, chunk_count: int | None = None, chunk_size: int | None = None) -> bool:
+    """回填旧记录的存储形式（首次访问时探测得到）。"""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE files SET blob_kind = ?, chunk_count = ?, chunk_size = ? WHERE file_id = ?",
+            (blob_kind, chunk_count, chunk_size, file_id),
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
 
 def delete_file_metadata(file_id: str) -> bool:
     """
     根据 file_id 从数据库中删除文件元数据。
     返回: 如果成功删除了一行，则为 True，否则为 False。
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            # 先查询文件信息用于日志
-            cursor.execute("SELECT filename FROM files WHERE file_id = ?", (file_id,))
-            file_row = cursor.fetchone()
-            filename = file_row['filename'] if file_row else 'unknown'
-
-            cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
-            conn.commit()
-            # cursor.rowcount 会返回受影响的行数
-            deleted = cursor.rowcount > 0
-            if deleted:
-                logger.info(f"【数据库】文件元数据已删除。文件名: {filename}，file_id: {file_id[:20]}...")
-            else:
-                logger.warning(f"【数据库】文件元数据删除失败（未找到）。file_id: {file_id[:20]}...")
-            return deleted
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        # 先查询文件信息用于日志
+        cursor.execute("SELECT filename FROM files WHERE file_id = ?", (file_id,))
+        file_row = cursor.fetchone()
+        filename = file_row['filename'] if file_row else 'unknown'
+
+        cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        conn.commit()
+        # cursor.rowcount 会返回受影响的行数
+        deleted = cursor.rowcount > 0
+        if deleted:
+            logger.info(f"【数据库】文件元数据已删除。文件名: {filename}，file_id: {file_id[:20]}...")
+        else:
+            logger.warning(f"【数据库】文件元数据删除失败（未找到）。file_id: {file_id[:20]}...")
+        return deleted
 
 def delete_file_by_message_id(message_id: int) -> str | None:
     """
@@ -488,94 +944,82 @@ def delete_file_by_message_id(message_id: int) -> str | None:
     因为一个消息ID只对应一个文件，所以我们可以这样做。
     """
     file_id_to_delete = None
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            # 首先，根据 message_id 找到对应的 file_id
-            # 我们使用 LIKE 操作符，因为 file_id 是 "message_id:actual_file_id" 的格式
-            cursor.execute("SELECT file_id FROM files WHERE file_id LIKE ?", (f"{message_id}:%",))
-            result = cursor.fetchone()
-            if result:
-                file_id_to_delete = result[0]
-                # 然后，删除这条记录
-                cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id_to_delete,))
-                conn.commit()
-                logger.info("已从数据库中删除与消息ID %s 关联的文件: %s", message_id, file_id_to_delete)
-            return file_id_to_delete
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        # 首先，根据 message_id 找到对应的 file_id
+        # 我们使用 LIKE 操作符，因为 file_id 是 "message_id:actual_file_id" 的格式
+        cursor.execute("SELECT file_id FROM files WHERE file_id LIKE ?", (f"{message_id}:%",))
+        result = cursor.fetchone()
+        if result:
+            file_id_to_delete = result[0]
+            # 然后，删除这条记录
+            cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id_to_delete,))
+            conn.commit()
+            logger.info("已从数据库中删除与消息ID %s 关联的文件: %s", message_id, file_id_to_delete)
+        return file_id_to_delete
 
 def get_app_settings_from_db() -> dict:
     """获取应用设置（从数据库单行配置）。"""
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT bot_token, channel_name, pass_word, picgo_api_key, base_url,
-                       auto_download_enabled, download_dir, download_file_types, download_max_size, download_min_size,
-                       download_threads
-                FROM app_settings WHERE id = 1
-            """)
-            row = cursor.fetchone()
-            if not row:
-                return {}
-            return {
-                "BOT_TOKEN": row[0],
-                "CHANNEL_NAME": row[1],
-                "PASS_WORD": row[2],
-                "PICGO_API_KEY": row[3],
-                "BASE_URL": row[4],
-                "AUTO_DOWNLOAD_ENABLED": bool(row[5]) if row[5] is not None else False,
-                "DOWNLOAD_DIR": row[6] or "/app/downloads",
-                "DOWNLOAD_FILE_TYPES": row[7] or "image,video",
-                "DOWNLOAD_MAX_SIZE": row[8] or 10737418240,  # 10GB
-                "DOWNLOAD_MIN_SIZE": row[9] or 0,
-                "DOWNLOAD_THREADS": row[10] or 4,
-            }
-        finally:
-            conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT bot_token, channel_name, pass_word, picgo_api_key, base_url,
+                   auto_download_enabled, download_dir, download_file_types, download_max_size, download_min_size,
+                   download_threads
+            FROM app_settings WHERE id = 1
+        """)
+        row = cursor.fetchone()
+        if not row:
+            return {}
+        return {
+            "BOT_TOKEN": row[0],
+            "CHANNEL_NAME": row[1],
+            "PASS_WORD": row[2],
+            "PICGO_API_KEY": row[3],
+            "BASE_URL": row[4],
+            "AUTO_DOWNLOAD_ENABLED": bool(row[5]) if row[5] is not None else False,
+            "DOWNLOAD_DIR": row[6] or "/app/downloads",
+            "DOWNLOAD_FILE_TYPES": row[7] or "image,video",
+            "DOWNLOAD_MAX_SIZE": row[8] or 10737418240,  # 10GB
+            "DOWNLOAD_MIN_SIZE": row[9] or 0,
+            "DOWNLOAD_THREADS": row[10] or 4,
+        }
 
 def save_app_settings_to_db(payload: dict) -> None:
     """保存应用设置到数据库（单行更新）。"""
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            def norm(v):
-                if v is None:
-                    return None
-                if isinstance(v, str):
-                    s = v.strip()
-                    return s if s else None
-                return v
-
-            cursor.execute(
-                """
-                UPDATE app_settings
-                SET bot_token = ?, channel_name = ?, pass_word = ?, picgo_api_key = ?, base_url = ?,
-                    auto_download_enabled = ?, download_dir = ?, download_file_types = ?, download_max_size = ?, download_min_size = ?,
-                    download_threads = ?
-                WHERE id = 1
-                """,
-                (
-                    norm(payload.get("BOT_TOKEN")),
-                    norm(payload.get("CHANNEL_NAME")),
-                    norm(payload.get("PASS_WORD")),
-                    norm(payload.get("PICGO_API_KEY")),
-                    norm(payload.get("BASE_URL")),
-                    1 if payload.get("AUTO_DOWNLOAD_ENABLED") else 0,
-                    norm(payload.get("DOWNLOAD_DIR")) or "/app/downloads",
-                    norm(payload.get("DOWNLOAD_FILE_TYPES")) or "image,video",
-                    payload.get("DOWNLOAD_MAX_SIZE") if payload.get("DOWNLOAD_MAX_SIZE") is not None else 10737418240,  # 10GB
-                    payload.get("DOWNLOAD_MIN_SIZE") if payload.get("DOWNLOAD_MIN_SIZE") is not None else 0,
-                    payload.get("DOWNLOAD_THREADS") if payload.get("DOWNLOAD_THREADS") is not None else 4,
-                )
+    with _writer() as conn:
+        cursor = conn.cursor()
+        def norm(v):
+            if v is None:
+                return None
+            if isinstance(v, str):
+                s = v.strip()
+                return s if s else None
+            return v
+
+        cursor.execute(
+            """
+            UPDATE app_settings
+            SET bot_token = ?, channel_name = ?, pass_word = ?, picgo_api_key = ?, base_url = ?,
+                auto_download_enabled = ?, download_dir = ?, download_file_types = ?, download_max_size = ?, download_min_size = ?,
+                download_threads = ?
+            WHERE id = 1
+            """,
+            (
+                norm(payload.get("BOT_TOKEN")),
+                norm(payload.get("CHANNEL_NAME")),
+                norm(payload.get("PASS_WORD")),
+                norm(payload.get("PICGO_API_KEY")),
+                norm(payload.get("BASE_URL")),
+                1 if payload.get("AUTO_DOWNLOAD_ENABLED") else 0,
+                norm(payload.get("DOWNLOAD_DIR")) or "/app/downloads",
+                norm(payload.get("DOWNLOAD_FILE_TYPES")) or "image,video",
+                payload.get("DOWNLOAD_MAX_SIZE") if payload.get("DOWNLOAD_MAX_SIZE") is not None else 10737418240,  # 10GB
+                payload.get("DOWNLOAD_MIN_SIZE") if payload.get("DOWNLOAD_MIN_SIZE") is not None else 0,
+                payload.get("DOWNLOAD_THREADS") if payload.get("DOWNLOAD_THREADS") is not None else 4,
             )
-            conn.commit()
-        finally:
-            conn.close()
+        )
+        conn.commit()
 
 def reset_app_settings_in_db() -> None:
     """重置应用设置（清空配置）。"""
@@ -606,19 +1050,15 @@ def create_session(session_id: str, expires_in_hours: int = 24) -> None:
         session_id: 会话ID
         expires_in_hours: 会话过期时间（小时），默认24小时
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            expires_at = datetime.now() + timedelta(hours=expires_in_hours)
-            cursor.execute(
-                "INSERT OR REPLACE INTO sessions (session_id, expires_at) VALUES (?, ?)",
-                (session_id, expires_at.isoformat())
-            )
-            conn.commit()
-            logger.info(f"【数据库】会话已创建。会话ID: {session_id[:8]}...，过期时间: {expires_at}")
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        expires_at = datetime.now() + timedelta(hours=expires_in_hours)
+        cursor.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, expires_at) VALUES (?, ?)",
+            (session_id, expires_at.isoformat())
+        )
+        conn.commit()
+        logger.info(f"【数据库】会话已创建。会话ID: {session_id[:8]}...，过期时间: {expires_at}")
 
 def get_session(session_id: str) -> dict | None:
     """
@@ -630,36 +1070,34 @@ def get_session(session_id: str) -> dict | None:
     Returns:
         会话字典（包含 session_id, created_at, expires_at）或 None
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT session_id, created_at, expires_at FROM sessions WHERE session_id = ?",
-                (session_id,)
-            )
-            row = cursor.fetchone()
-            if not row:
-                logger.debug(f"【数据库】会话未找到。会话ID: {session_id[:8]}...")
-                return None
-
-            # 检查会话是否过期
-            expires_at = datetime.fromisoformat(row["expires_at"])
-            if datetime.now() > expires_at:
-                # 会话已过期，删除它
-                cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-                conn.commit()
-                logger.info(f"【数据库】会话已过期并被删除。会话ID: {session_id[:8]}...")
-                return None
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT session_id, created_at, expires_at FROM sessions WHERE session_id = ?",
+            (session_id,)
+        )
+        row = cursor.fetchone()
+
+    if not row:
+        logger.debug(f"【数据库】会话未找到。会话ID: {session_id[:8]}...")
+        return None
+
+    # 检查会话是否过期
+    expires_at = datetime.fromisoformat(row["expires_at"])
+    if datetime.now() > expires_at:
+        # 会话已过期，通过写连接删除它
+        with _writer() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.commit()
+        logger.info(f"【数据库】会话已过期并被删除。会话ID: {session_id[:8]}...")
+        return None
 
-            logger.debug(f"【数据库】会话有效。会话ID: {session_id[:8]}...，过期时间: {row['expires_at']}")
-            return {
-                "session_id": row["session_id"],
-                "created_at": row["created_at"],
-                "expires_at": row["expires_at"]
-            }
-        finally:
-            conn.close()
+    logger.debug(f"【数据库】会话有效。会话ID: {session_id[:8]}...，过期时间: {row['expires_at']}")
+    return {
+        "session_id": row["session_id"],
+        "created_at": row["created_at"],
+        "expires_at": row["expires_at"]
+    }
 
 def delete_session(session_id: str) -> bool:
     """
@@ -671,18 +1109,14 @@ def delete_session(session_id: str) -> bool:
     Returns:
         如果成功删除了会话，返回 True，否则返回 False
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
-            conn.commit()
-            deleted = cursor.rowcount > 0
-            if deleted:
-                logger.info("已删除会话: %s", session_id)
-            return deleted
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+        deleted = cursor.rowcount > 0
+        if deleted:
+            logger.info("已删除会话: %s", session_id)
+        return deleted
 
 def cleanup_expired_sessions() -> int:
     """
@@ -691,19 +1125,15 @@ def cleanup_expired_sessions() -> int:
     Returns:
         删除的会话数量
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            now = datetime.now().isoformat()
-            cursor.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
-            conn.commit()
-            deleted_count = cursor.rowcount
-            if deleted_count > 0:
-                logger.info("已清理 %d 个过期会话", deleted_count)
-            return deleted_count
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        now = datetime.now().isoformat()
+        cursor.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+        conn.commit()
+        deleted_count = cursor.rowcount
+        if deleted_count > 0:
+            logger.info("已清理 %d 个过期会话", deleted_count)
+        return deleted_count
 
 # ==================== 标签管理 ====================
 
@@ -718,23 +1148,19 @@ def add_file_tag(file_id: str, tag: str) -> bool:
     Returns:
         是否成功添加
     """
-    with db_lock:
-        conn = get_db_connection()
+    with _writer() as conn:
+        cursor = conn.cursor()
         try:
-            cursor = conn.cursor()
-            try:
-                cursor.execute(
-                    "INSERT INTO file_tags (file_id, tag) VALUES (?, ?)",
-                    (file_id, tag.strip().lower())
-                )
-                conn.commit()
-                logger.info("为文件 %s 添加标签: %s", file_id, tag)
-                return True
-            except sqlite3.IntegrityError:
-                logger.warning("标签已存在: %s -> %s", file_id, tag)
-                return False
-        finally:
-            conn.close()
+            cursor.execute(
+                "INSERT INTO file_tags (file_id, tag) VALUES (?, ?)",
+                (file_id, tag.strip().lower())
+            )
+            conn.commit()
+            logger.info("为文件 %s 添加标签: %s", file_id, tag)
+            return True
+        except sqlite3.IntegrityError:
+            logger.warning("标签已存在: %s -> %s", file_id, tag)
+            return False
 
 def remove_file_tag(file_id: str, tag: str) -> bool:
     """
@@ -747,21 +1173,17 @@ def remove_file_tag(file_id: str, tag: str) -> bool:
     Returns:
         是否成功移除
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM file_tags WHERE file_id = ? AND tag = ?",
-                (file_id, tag.strip().lower())
-            )
-            conn.commit()
-            deleted = cursor.rowcount > 0
-            if deleted:
-                logger.info("移除文件标签: %s -> %s", file_id, tag)
-            return deleted
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM file_tags WHERE file_id = ? AND tag = ?",
+            (file_id, tag.strip().lower())
+        )
+        conn.commit()
+        deleted = cursor.rowcount > 0
+        if deleted:
+            logger.info("移除文件标签: %s -> %s", file_id, tag)
+        return deleted
 
 def get_file_tags(file_id: str) -> list[str]:
     """
@@ -773,17 +1195,13 @@ def get_file_tags(file_id: str) -> list[str]:
     Returns:
         标签列表
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT tag FROM file_tags WHERE file_id = ? ORDER BY created_at",
-                (file_id,)
-            )
-            return [row[0] for row in cursor.fetchall()]
-        finally:
-            conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT tag FROM file_tags WHERE file_id = ? ORDER BY created_at",
+            (file_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
 
 def get_all_tags() -> list[dict]:
     """
@@ -792,19 +1210,15 @@ def get_all_tags() -> list[dict]:
     Returns:
         [{"tag": "标签名", "count": 使用次数}, ...]
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT tag, COUNT(*) as count
-                FROM file_tags
-                GROUP BY tag
-                ORDER BY count DESC, tag ASC
-            """)
-            return [{"tag": row[0], "count": row[1]} for row in cursor.fetchall()]
-        finally:
-            conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT tag, COUNT(*) as count
+            FROM file_tags
+            GROUP BY tag
+            ORDER BY count DESC, tag ASC
+        """)
+        return [{"tag": row[0], "count": row[1]} for row in cursor.fetchall()]
 
 def get_files_by_tag(tag: str) -> list[str]:
     """
@@ -816,83 +1230,348 @@ def get_files_by_tag(tag: str) -> list[str]:
     Returns:
         文件ID列表
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT file_id FROM file_tags WHERE tag = ? ORDER BY created_at DESC",
+            (tag.strip().lower(),)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+# ==================== 清单缓存 ====================
+
+def save_manifest(manifest_id: str, filename: str, chunk_ids: list[str], chunk_sizes: list[int | None] | None = None) -> None:
+    """
+    保存（覆盖）一个分块文件清单。
+
+    Args:
+        manifest_id: 清单文件的 Telegram file_id（不含 message_id 前缀）
+        filename: 原始文件名
+        chunk_ids: 分块复合 ID（message_id:file_id）列表，按顺序
+        chunk_sizes: 各分块的字节数；未知时为 None
+    """
+    sizes = chunk_sizes if chunk_sizes is not None else [None] * len(chunk_ids)
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM manifest_chunks WHERE manifest_id = ?", (manifest_id,))
+        cursor.execute(
+            "INSERT OR REPLACE INTO manifests (manifest_id, filename, chunk_count) VALUES (?, ?, ?)",
+            (manifest_id, filename, len(chunk_ids)),
+        )
+        cursor.executemany(
+            "INSERT INTO manifest_chunks (manifest_id, chunk_index, chunk_id, chunk_size) VALUES (?, ?, ?, ?)",
+            [(manifest_id, index, chunk_id, size) for index, (chunk_id, size) in enumerate(zip(chunk_ids, sizes, strict=True))],
+        )
+        conn.commit()
+
+def get_manifest(manifest_id: str) -> dict | None:
+    """读取缓存的清单，返回 {"filename", "chunk_ids", "chunk_sizes"}；不存在或不完整时返回 None。"""
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename, chunk_count FROM manifests WHERE manifest_id = ?", (manifest_id,))
+        header = cursor.fetchone()
+        if not header:
+            return None
+        cursor.execute(
+            "SELECT chunk_id, chunk_size FROM manifest_chunks WHERE manifest_id = ? ORDER BY chunk_index",
+            (manifest_id,),
+        )
+        rows = cursor.fetchall()
+        if len(rows) != header["chunk_count"]:
+            return None
+        return {
+            "filename": header["filename"],
+            "chunk_ids": [row["chunk_id"] for row in rows],
+            "chunk_sizes": [row["chunk_size"] for row in rows],
+        }
+
+def delete_manifest(manifest_id: str) -> bool:
+    """删除缓存的清单及其分块列表。"""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM manifest_chunks WHERE manifest_id = ?", (manifest_id,))
+        cursor.execute("DELETE FROM manifests WHERE manifest_id = ?", (manifest_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+
+# ==================== 可续传上传 ====================
+
+def create_upload_session(upload_id: str, filename: str, total_size: int) -> None:
+    """创建一个可续传上传会话。"""
+    with _writer() as conn:
+        conn.execute(
+            "INSERT INTO upload_sessions (upload_id, filename, total_size) VALUES (?, ?, ?)",
+            (upload_id, filename, total_size),
+        )
+        conn.commit()
+    logger.info(f"【数据库】上传会话已创建。upload_id: {upload_id}，文件名: {filename}，大小: {total_size} bytes")
+
+def get_upload_session(upload_id: str) -> dict | None:
+    """读取上传会话，附带已上传分块的 chunk_ids / chunk_sizes（按顺序）；不存在时返回 None。"""
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT upload_id, filename, total_size, received_bytes, first_message_id, short_id, created_at, updated_at
+            FROM upload_sessions WHERE upload_id = ?
+            """,
+            (upload_id,),
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute(
+            "SELECT chunk_id, chunk_size FROM upload_session_chunks WHERE upload_id = ? ORDER BY chunk_index",
+            (upload_id,),
+        )
+        chunks = cursor.fetchall()
+    session = dict(row)
+    session["chunk_ids"] = [chunk["chunk_id"] for chunk in chunks]
+    session["chunk_sizes"] = [chunk["chunk_size"] for chunk in chunks]
+    return session
+
+def record_upload_chunk(upload_id: str, chunk_index: int, chunk_id: str, chunk_size: int, received_bytes: int) -> None:
+    """
+    记录一个已上传到 Telegram 的分块，并在同一事务中更新已接收字节数。
+    第一个分块的 message_id 同时记为 first_message_id（后续分块回复到它）。
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO upload_session_chunks (upload_id, chunk_index, chunk_id, chunk_size) VALUES (?, ?, ?, ?)",
+            (upload_id, chunk_index, chunk_id, chunk_size),
+        )
+        if chunk_index == 0:
             cursor.execute(
-                "SELECT file_id FROM file_tags WHERE tag = ? ORDER BY created_at DESC",
-                (tag.strip().lower(),)
+                "UPDATE upload_sessions SET first_message_id = ? WHERE upload_id = ?",
+                (int(chunk_id.split(":", 1)[0]), upload_id),
             )
-            return [row[0] for row in cursor.fetchall()]
-        finally:
-            conn.close()
+        cursor.execute(
+            "UPDATE upload_sessions SET received_bytes = ?, updated_at = CURRENT_TIMESTAMP WHERE upload_id = ?",
+            (received_bytes, upload_id),
+        )
+        conn.commit()
+
+def update_upload_progress(upload_id: str, received_bytes: int) -> None:
+    """更新上传会话已接收（已持久化）的字节数。"""
+    with _writer() as conn:
+        conn.execute(
+            "UPDATE upload_sessions SET received_bytes = ?, updated_at = CURRENT_TIMESTAMP WHERE upload_id = ?",
+            (received_bytes, upload_id),
+        )
+        conn.commit()
+
+def complete_upload_session(upload_id: str, short_id: str) -> None:
+    """标记上传会话已完成（记录生成的 short_id，重复提交时直接返回）。"""
+    with _writer() as conn:
+        conn.execute(
+            "UPDATE upload_sessions SET short_id = ?, updated_at = CURRENT_TIMESTAMP WHERE upload_id = ?",
+            (short_id, upload_id),
+        )
+        conn.commit()
+
+def delete_upload_session(upload_id: str) -> bool:
+    """删除上传会话及其分块记录。"""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM upload_session_chunks WHERE upload_id = ?", (upload_id,))
+        cursor.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+
+def get_stale_upload_sessions(max_age_hours: int) -> list[str]:
+    """超过 max_age_hours 小时没有更新的上传会话 ID。"""
+    with _reader() as conn:
+        rows = conn.execute(
+            "SELECT upload_id FROM upload_sessions WHERE updated_at <= datetime('now', ?)",
+            (f"-{max_age_hours} hours",),
+        ).fetchall()
+    return [row["upload_id"] for row in rows]
 
 # ==================== 本地文件管理 ====================
 
 def update_local_path(file_id: str, local_path: str) -> bool:
     """
-    更新文件的本地路径。
+    记录文件已下载到本地：写入本地路径，状态置为 completed 并重置重试计数。
 
     Args:
         file_id: 文件ID
-        local_path: 本地文件路径
+        local_path: 本地文件路径（相对下载目录）
 
     Returns:
         是否成功更新
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            # 如果是成功下载（非错误标记和非下载中标记），重置重试计数
-            if local_path and not local_path.startswith('__'):
-                cursor.execute(
-                    "UPDATE files SET local_path = ?, retry_count = 0, last_retry_time = NULL WHERE file_id = ?",
-                    (local_path, file_id)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE files SET local_path = ? WHERE file_id = ?",
-                    (local_path, file_id)
-                )
-            conn.commit()
-            updated = cursor.rowcount > 0
-            if updated:
-                logger.info("更新文件本地路径: %s -> %s", file_id, local_path)
-            return updated
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            UPDATE files SET local_path = ?, download_state = '{DOWNLOAD_STATE_COMPLETED}',
+                   state_changed_at = CURRENT_TIMESTAMP, retry_count = 0,
+                   last_retry_time = NULL, next_attempt_at = NULL
+            WHERE file_id = ?
+            """,
+            (local_path, file_id)
+        )
+        conn.commit()
+        updated = cursor.rowcount > 0
+        if updated:
+            logger.info("更新文件本地路径: %s -> %s", file_id, local_path)
+        return updated
+
+
+def mark_download_started(file_id: str) -> bool:
+    """
+    将文件标记为下载中，避免被重复调度。
 
+    Args:
+        file_id: 文件ID
 
-def increment_retry_count(file_id: str) -> bool:
+    Returns:
+        是否成功更新
     """
-    增加文件的重试计数并更新最后重试时间。
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            UPDATE files SET download_state = '{DOWNLOAD_STATE_DOWNLOADING}', state_changed_at = CURRENT_TIMESTAMP,
+                   next_attempt_at = NULL
+            WHERE file_id = ?
+            """,
+            (file_id,)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def mark_download_failed(file_id: str, max_retries: int = DEFAULT_DOWNLOAD_MAX_RETRIES) -> str | None:
+    """
+    记录一次下载失败：增加重试计数，按指数退避计算下次尝试时间；
+    达到最大重试次数后状态置为 failed，不再自动重试。
 
     Args:
         file_id: 文件ID
+        max_retries: 最大重试次数
 
     Returns:
-        是否成功更新
+        更新后的下载状态（retrying / failed），文件不存在时为 None
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE files SET retry_count = retry_count + 1, last_retry_time = CURRENT_TIMESTAMP WHERE file_id = ?",
-                (file_id,)
-            )
-            conn.commit()
-            updated = cursor.rowcount > 0
-            if updated:
-                cursor.execute("SELECT retry_count FROM files WHERE file_id = ?", (file_id,))
-                row = cursor.fetchone()
-                if row:
-                    logger.info("增加文件重试计数: %s (当前次数: %d)", file_id, row["retry_count"])
-            return updated
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        # UPDATE 中引用的 retry_count 为更新前的值：第 n 次失败后等待 BASE * 2^(n-1) 秒
+        cursor.execute(
+            f"""
+            UPDATE files SET
+                retry_count = retry_count + 1,
+                last_retry_time = CURRENT_TIMESTAMP,
+                state_changed_at = CURRENT_TIMESTAMP,
+                download_state = CASE WHEN retry_count + 1 >= ?
+                                      THEN '{DOWNLOAD_STATE_FAILED}' ELSE '{DOWNLOAD_STATE_RETRYING}' END,
+                next_attempt_at = CASE WHEN retry_count + 1 >= ? THEN NULL
+                                       ELSE datetime('now', '+' || (? << MIN(retry_count, 16)) || ' seconds') END,
+                local_path = NULL
+            WHERE file_id = ?
+            RETURNING retry_count, download_state
+            """,
+            (max_retries, max_retries, DOWNLOAD_RETRY_BASE_DELAY, file_id)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        if row:
+            logger.info("文件下载失败: %s (重试次数: %d，状态: %s)", file_id, row["retry_count"], row["download_state"])
+        return row["download_state"] if row else None
+
+
+def _download_filters(
+    categories: list[str] | None, min_size: int, max_size: int | None, exclude_file_ids: list[str] | None = None
+) -> tuple[str, list]:
+    """自动下载的类型 / 大小过滤条件（以及需要排除的 file_id），返回 (SQL 条件, 参数)。"""
+    filters = ["filesize >= ?"]
+    filter_params: list = [min_size]
+    if max_size is not None:
+        filters.append("filesize <= ?")
+        filter_params.append(max_size)
+    if categories:
+        filters.append(f"category IN ({', '.join('?' * len(categories))})")
+        filter_params.extend(categories)
+    if exclude_file_ids:
+        filters.append(f"file_id NOT IN ({', '.join('?' * len(exclude_file_ids))})")
+        filter_params.extend(exclude_file_ids)
+    return " AND ".join(filters), filter_params
+
+
+def get_files_due_for_download(
+    categories: list[str] | None = None,
+    min_size: int = 0,
+    max_size: int | None = None,
+    limit: int = 500,
+) -> list[dict]:
+    """
+    获取当前应当下载的文件：到期的重试、待下载文件，以及中断（陈旧）的下载。
+    每一类都只走对应状态的部分索引，不会扫描已下载的文件。
+
+    Args:
+        categories: 允许的文件类别；为空表示不限
+        min_size: 最小文件大小（字节）
+        max_size: 最大文件大小（字节），None 表示不限
+        limit: 最多返回的文件数量
+
+    Returns:
+        文件列表（字段同 get_all_files）
+    """
+    extra, filter_params = _download_filters(categories, min_size, max_size)
+
+    # 状态值以字面量写入 SQL，SQLite 才能匹配到对应的部分索引
+    queries = (
+        (
+            f"""SELECT {_FILE_LIST_COLUMNS} FROM files
+                WHERE download_state = '{DOWNLOAD_STATE_RETRYING}' AND next_attempt_at <= CURRENT_TIMESTAMP AND {extra}
+                ORDER BY next_attempt_at LIMIT ?""",
+            [],
+        ),
+        (
+            f"""SELECT {_FILE_LIST_COLUMNS} FROM files
+                WHERE download_state = '{DOWNLOAD_STATE_PENDING}' AND {extra}
+                ORDER BY upload_date DESC, id DESC LIMIT ?""",
+            [],
+        ),
+        (
+            f"""SELECT {_FILE_LIST_COLUMNS} FROM files
+                WHERE download_state = '{DOWNLOAD_STATE_DOWNLOADING}' AND state_changed_at <= datetime('now', ?) AND {extra}
+                ORDER BY state_changed_at LIMIT ?""",
+            [f"-{DOWNLOAD_STALE_SECONDS} seconds"],
+        ),
+    )
+
+    rows = []
+    with _reader() as conn:
+        for query, state_params in queries:
+            remaining = limit - len(rows)
+            if remaining <= 0:
+                break
+            rows.extend(conn.execute(query, [*state_params, *filter_params, remaining]).fetchall())
+    return _file_rows_to_dicts(rows)
+
+
+def get_next_retry_delay(
+    categories: list[str] | None = None,
+    min_size: int = 0,
+    max_size: int | None = None,
+    exclude_file_ids: list[str] | None = None,
+) -> float | None:
+    """
+    返回距离最早一次待重试下载还有多少秒（已到期时为 0），没有待重试文件时返回 None。
+    与 get_files_due_for_download 使用相同的类型 / 大小过滤，并排除已在队列中或正在下载的文件，
+    因此返回的重试一定会被下一次获取加入队列。
+    """
+    extra, filter_params = _download_filters(categories, min_size, max_size, exclude_file_ids)
+    with _reader() as conn:
+        row = conn.execute(f"""
+            SELECT (julianday(MIN(next_attempt_at)) - julianday('now')) * 86400
+            FROM files WHERE download_state = '{DOWNLOAD_STATE_RETRYING}' AND {extra}
+        """, filter_params).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return max(0.0, row[0])
 
 
 def reset_retry_count(file_id: str) -> bool:
@@ -905,58 +1584,48 @@ def reset_retry_count(file_id: str) -> bool:
     Returns:
         是否成功更新
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE files SET retry_count = 0, last_retry_time = NULL WHERE file_id = ?",
-                (file_id,)
-            )
-            conn.commit()
-            updated = cursor.rowcount > 0
-            if updated:
-                logger.info("重置文件重试计数: %s", file_id)
-            return updated
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE files SET retry_count = 0, last_retry_time = NULL, next_attempt_at = NULL WHERE file_id = ?",
+            (file_id,)
+        )
+        conn.commit()
+        updated = cursor.rowcount > 0
+        if updated:
+            logger.info("重置文件重试计数: %s", file_id)
+        return updated
 
 def get_local_files() -> list[dict]:
     """
-    获取所有已下载到本地的文件（排除错误标记）。
+    获取所有已下载到本地的文件（download_state = completed）。
 
     Returns:
         文件列表
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT filename, file_id, filesize, upload_date, short_id, local_path
-                FROM files
-                WHERE local_path IS NOT NULL
-                  AND local_path != ''
-                  AND local_path NOT GLOB '__*'
-                ORDER BY upload_date DESC
-            """)
-            files = []
-            for row in cursor.fetchall():
-                files.append({
-                    "filename": row["filename"],
-                    "file_id": row["file_id"],
-                    "filesize": row["filesize"],
-                    "upload_date": row["upload_date"],
-                    "short_id": row["short_id"],
-                    "local_path": row["local_path"]
-                })
-            return files
-        finally:
-            conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT filename, file_id, filesize, upload_date, short_id, local_path
+            FROM files
+            WHERE download_state = '{DOWNLOAD_STATE_COMPLETED}'
+            ORDER BY upload_date DESC
+        """)
+        files = []
+        for row in cursor.fetchall():
+            files.append({
+                "filename": row["filename"],
+                "file_id": row["file_id"],
+                "filesize": row["filesize"],
+                "upload_date": row["upload_date"],
+                "short_id": row["short_id"],
+                "local_path": row["local_path"]
+            })
+        return files
 
 def clear_local_path(file_id: str) -> bool:
     """
-    清空文件的本地路径字段。
+    清空文件的本地路径字段，文件回到 pending 状态。
 
     Args:
         file_id: 文件ID
@@ -964,45 +1633,47 @@ def clear_local_path(file_id: str) -> bool:
     Returns:
         是否成功更新
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE files SET local_path = NULL WHERE file_id = ?",
-                (file_id,)
-            )
-            conn.commit()
-            updated = cursor.rowcount > 0
-            if updated:
-                logger.info("已清空文件本地路径: %s", file_id)
-            return updated
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            UPDATE files SET local_path = NULL, download_state = '{DOWNLOAD_STATE_PENDING}',
+                   state_changed_at = CURRENT_TIMESTAMP, next_attempt_at = NULL
+            WHERE file_id = ?
+            """,
+            (file_id,)
+        )
+        conn.commit()
+        updated = cursor.rowcount > 0
+        if updated:
+            logger.info("已清空文件本地路径: %s", file_id)
+        return updated
 
 
 def clear_error_markers() -> int:
     """
-    清除所有错误标记（__error_* 和陈旧的 __downloading_* 标记），以便重试下载。
+    将失败 / 等待重试 / 陈旧下载中的文件重置为 pending，并清零重试计数，以便立即重新下载。
 
     Returns:
-        清除的标记数量
+        重置的文件数量
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            # 清除所有以 __ 开头的占位符标记（错误标记和下载标记）
-            cursor.execute(
-                "UPDATE files SET local_path = NULL WHERE local_path GLOB '__*'"
-            )
-            conn.commit()
-            cleared_count = cursor.rowcount
-            if cleared_count > 0:
-                logger.info(f"【数据库】已清除 {cleared_count} 个错误/下载标记，可重新下载")
-            return cleared_count
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            UPDATE files SET download_state = '{DOWNLOAD_STATE_PENDING}', state_changed_at = CURRENT_TIMESTAMP,
+                   retry_count = 0, last_retry_time = NULL, next_attempt_at = NULL, local_path = NULL
+            WHERE download_state IN ('{DOWNLOAD_STATE_RETRYING}', '{DOWNLOAD_STATE_FAILED}')
+               OR (download_state = '{DOWNLOAD_STATE_DOWNLOADING}'
+                   AND state_changed_at <= datetime('now', ?))
+            """,
+            (f"-{DOWNLOAD_STALE_SECONDS} seconds",)
+        )
+        conn.commit()
+        cleared_count = cursor.rowcount
+        if cleared_count > 0:
+            logger.info(f"【数据库】已清除 {cleared_count} 个错误/下载标记，可重新下载")
+        return cleared_count
 
 # ==================== 下载统计 ====================
 
@@ -1016,18 +1687,14 @@ def increment_download_count(file_id: str) -> bool:
     Returns:
         是否成功更新
     """
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE files SET download_count = download_count + 1 WHERE file_id = ?",
-                (file_id,)
-            )
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE files SET download_count = download_count + 1 WHERE file_id = ?",
+            (file_id,)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
 
 # ==================== 统计查询 ====================
 
@@ -1038,114 +1705,89 @@ def get_statistics() -> dict:
     Returns:
         统计数据字典
     """
-    local_filter = "local_path IS NOT NULL AND local_path != '' AND local_path NOT GLOB '__*'"
-
-    with db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-
-            # 总文件数、总大小、总下载次数（全部文件 = 云端）
-            cursor.execute("SELECT COUNT(*), COALESCE(SUM(filesize), 0), COALESCE(SUM(download_count), 0) FROM files")
-            row = cursor.fetchone()
-            total_files = row[0]
-            total_size = row[1]
-            total_downloads = row[2]
-
-            # 本地已下载文件数、大小
-            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(filesize), 0) FROM files WHERE {local_filter}")
-            row = cursor.fetchone()
-            local_files_count = row[0]
-            local_files_size = row[1]
-
-            # 按MIME类型分类统计（全部文件）
-            cursor.execute("""
-                SELECT
-                    CASE
-                        WHEN mime_type LIKE 'image/%' THEN 'image'
-                        WHEN mime_type LIKE 'video/%' THEN 'video'
-                        WHEN mime_type LIKE 'audio/%' THEN 'audio'
-                        WHEN mime_type LIKE 'application/pdf' THEN 'pdf'
-                        WHEN mime_type LIKE 'text/%' THEN 'text'
-                        ELSE 'other'
-                    END as type,
-                    COUNT(*) as count,
-                    COALESCE(SUM(filesize), 0) as size
-                FROM files
-                WHERE mime_type IS NOT NULL
-                GROUP BY type
-            """)
-            by_type = {}
-            for row in cursor.fetchall():
-                by_type[row[0]] = {"count": row[1], "size": row[2]}
-
-            # 按MIME类型分类统计（仅本地文件）
-            cursor.execute(f"""
-                SELECT
-                    CASE
-                        WHEN mime_type LIKE 'image/%' THEN 'image'
-                        WHEN mime_type LIKE 'video/%' THEN 'video'
-                        WHEN mime_type LIKE 'audio/%' THEN 'audio'
-                        WHEN mime_type LIKE 'application/pdf' THEN 'pdf'
-                        WHEN mime_type LIKE 'text/%' THEN 'text'
-                        ELSE 'other'
-                    END as type,
-                    COUNT(*) as count,
-                    COALESCE(SUM(filesize), 0) as size
-                FROM files
-                WHERE mime_type IS NOT NULL AND {local_filter}
-                GROUP BY type
-            """)
-            local_by_type = {}
-            for row in cursor.fetchall():
-                local_by_type[row[0]] = {"count": row[1], "size": row[2]}
-
-            # 最近7天上传趋势
-            cursor.execute("""
-                SELECT DATE(upload_date) as date, COUNT(*) as count
-                FROM files
-                WHERE upload_date >= datetime('now', '-7 days')
-                GROUP BY DATE(upload_date)
-                ORDER BY date DESC
-            """)
-            recent_uploads = [
-                {"date": row[0], "count": row[1]}
-                for row in cursor.fetchall()
-            ]
-
-            # Top 10 下载文件
-            cursor.execute("""
-                SELECT filename, file_id, short_id, download_count, filesize
-                FROM files
-                WHERE download_count > 0
-                ORDER BY download_count DESC
-                LIMIT 10
-            """)
-            top_downloads = []
-            for row in cursor.fetchall():
-                top_downloads.append({
-                    "filename": row[0],
-                    "file_id": row[1],
-                    "short_id": row[2],
-                    "download_count": row[3],
-                    "filesize": row[4]
-                })
-
-            # 标签总数
-            cursor.execute("SELECT COUNT(DISTINCT tag) FROM file_tags")
-            total_tags = cursor.fetchone()[0]
-
-            return {
-                "total_files": total_files,
-                "total_size": total_size,
-                "total_downloads": total_downloads,
-                "by_type": by_type,
-                "local_by_type": local_by_type,
-                "recent_uploads": recent_uploads,
-                "top_downloads": top_downloads,
-                "local_files_count": local_files_count,
-                "local_files_size": local_files_size,
-                "total_tags": total_tags
-            }
-        finally:
-            conn.close()
+    local_filter = f"download_state = '{DOWNLOAD_STATE_COMPLETED}'"
+
+    with _reader() as conn:
+        cursor = conn.cursor()
+
+        # 总文件数、总大小、总下载次数（全部文件 = 云端）
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(filesize), 0), COALESCE(SUM(download_count), 0) FROM files")
+        row = cursor.fetchone()
+        total_files = row[0]
+        total_size = row[1]
+        total_downloads = row[2]
+
+        # 本地已下载文件数、大小
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(filesize), 0) FROM files WHERE {local_filter}")
+        row = cursor.fetchone()
+        local_files_count = row[0]
+        local_files_size = row[1]
+
+        # 按文件类别统计（全部文件），直接在 category 索引上分组
+        cursor.execute("""
+            SELECT COALESCE(category, 'other') as type, COUNT(*) as count, COALESCE(SUM(filesize), 0) as size
+            FROM files
+            GROUP BY type
+        """)
+        by_type = {}
+        for row in cursor.fetchall():
+            by_type[row[0]] = {"count": row[1], "size": row[2]}
+
+        # 按文件类别统计（仅本地文件）
+        cursor.execute(f"""
+            SELECT COALESCE(category, 'other') as type, COUNT(*) as count, COALESCE(SUM(filesize), 0) as size
+            FROM files
+            WHERE {local_filter}
+            GROUP BY type
+        """)
+        local_by_type = {}
+        for row in cursor.fetchall():
+            local_by_type[row[0]] = {"count": row[1], "size": row[2]}
+
+        # 最近7天上传趋势
+        cursor.execute("""
+            SELECT DATE(upload_date) as date, COUNT(*) as count
+            FROM files
+            WHERE upload_date >= datetime('now', '-7 days')
+            GROUP BY DATE(upload_date)
+            ORDER BY date DESC
+        """)
+        recent_uploads = [
+            {"date": row[0], "count": row[1]}
+            for row in cursor.fetchall()
+        ]
+
+        # Top 10 下载文件
+        cursor.execute("""
+            SELECT filename, file_id, short_id, download_count, filesize
+            FROM files
+            WHERE download_count > 0
+            ORDER BY download_count DESC
+            LIMIT 10
+        """)
+        top_downloads = []
+        for row in cursor.fetchall():
+            top_downloads.append({
+                "filename": row[0],
+                "file_id": row[1],
+                "short_id": row[2],
+                "download_count": row[3],
+                "filesize": row[4]
+            })
+
+        # 标签总数
+        cursor.execute("SELECT COUNT(DISTINCT tag) FROM file_tags")
+        total_tags = cursor.fetchone()[0]
+
+        return {
+            "total_files": total_files,
+            "total_size": total_size,
+            "total_downloads": total_downloads,
+            "by_type": by_type,
+            "local_by_type": local_by_type,
+            "recent_uploads": recent_uploads,
+            "top_downloads": top_downloads,
+            "local_files_count": local_files_count,
+            "local_files_size": local_files_size,
+            "total_tags": total_tags
+        }
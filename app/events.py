@@ -35,7 +35,27 @@ class BroadcastEventBus:
         await self.publish(data)
 
 
+class IngestQueue:
+    """
+    新入库文件的通知队列（单消费者）。
+
+    上传接口和 Bot 在写入文件元数据后推送 file_id，下载服务即时消费，
+    无需等待下一轮对账扫描。队列满时直接丢弃，由下载服务的定期对账兜底。
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=maxsize)
+
+    def push(self, file_id: str) -> None:
+        with contextlib.suppress(asyncio.QueueFull):
+            self._queue.put_nowait(file_id)
+
+    async def get(self) -> str:
+        return await self._queue.get()
+
+
 file_update_queue = BroadcastEventBus()
+new_file_queue = IngestQueue()
 
 
 def build_file_event(
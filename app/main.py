@@ -5,10 +5,9 @@ from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 
-from . import database
 from .api import routes as api_routes
 from .api.common import error_payload
-from .core.config import get_app_settings
+from .core.config import get_app_settings_async
 
 # 导入我们的新生命周期管理器和路由
 from .core.http_client import lifespan
@@ -16,6 +15,7 @@ from .core.http_client import lifespan
 # 导入日志配置
 from .core.logging_config import get_logger, log_request, log_response, setup_logging
 from .pages import router as pages_router
+from .repository import session_repo
 
 # 初始化日志配置
 setup_logging()
@@ -92,7 +92,7 @@ async def check_configured_middleware(request: Request, call_next):
     中间件 1: 检查应用是否已配置
     如果未配置（即未设置密码），则强制所有流量到引导页面。
     """
-    settings = get_app_settings()
+    settings = await get_app_settings_async()
     has_password = bool((settings.get("PASS_HASH") or settings.get("PASS_WORD") or "").strip())
 
     request_path = request.url.path
@@ -116,7 +116,7 @@ async def session_auth_middleware(request: Request, call_next):
     中间件 2: 处理用户会话认证
     这个中间件只在应用已经配置好密码后才起作用。
     """
-    settings = get_app_settings()
+    settings = await get_app_settings_async()
     has_password = bool((settings.get("PASS_HASH") or settings.get("PASS_WORD") or "").strip())
 
     # 如果没设置密码，则这个中间件不做任何事
@@ -145,7 +145,7 @@ async def session_auth_middleware(request: Request, call_next):
     # 检查会话 cookie
     session_id = request.cookies.get(COOKIE_NAME)
     is_authenticated = False
-    if session_id and database.get_session(session_id):
+    if session_id and await session_repo.get(session_id):
         is_authenticated = True
         logger.debug(f"【用户认证】会话有效。会话ID: {session_id[:8]}...，请求: {request.method} {request_path}")
     else:
@@ -4,16 +4,16 @@ from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from starlette.templating import Jinja2Templates
 
-from . import database
-from .core.config import get_app_settings
+from .core.config import get_app_settings_async
+from .repository import file_repo
 from .version import __version__, __author__, __email__, __github__, __repository__, __license__
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
 
-def _page_cfg(request: Request) -> dict:
-    cfg = get_app_settings()
+async def _page_cfg(request: Request) -> dict:
+    cfg = await get_app_settings_async()
     bot_token = (cfg.get("BOT_TOKEN") or "").strip()
     channel = (cfg.get("CHANNEL_NAME") or "").strip()
     bot_ready = bool(bot_token and channel)
@@ -38,8 +38,8 @@ async def main_page(request: Request):
     """
     提供主页。鉴权由中间件处理。
     """
-    files = database.get_all_files()
-    return templates.TemplateResponse("index.html", {"request": request, "files": files, "cfg": _page_cfg(request)})
+    files = await file_repo.query()
+    return templates.TemplateResponse("index.html", {"request": request, "files": files, "cfg": await _page_cfg(request)})
 
 
 @router.get("/settings", response_class=HTMLResponse)
@@ -48,7 +48,7 @@ async def settings_page(request: Request):
     提供设置页面，用于更改密码。
     权限验证已移至全局中间件。
     """
-    return templates.TemplateResponse("settings.html", {"request": request, "cfg": _page_cfg(request)})
+    return templates.TemplateResponse("settings.html", {"request": request, "cfg": await _page_cfg(request)})
 
 @router.get("/login", response_class=HTMLResponse)
 @router.get("/pwd", response_class=HTMLResponse)
@@ -68,10 +68,10 @@ async def image_hosting_page(request: Request):
     权限验证已移至全局中间件。
     """
     # 直接使用 category 参数获取图片文件，基于 mime_type 过滤更可靠
-    files = database.get_all_files(category="image", sort_by="upload_date", sort_order="desc")
+    files = await file_repo.query(category="image", sort_by="upload_date", sort_order="desc")
     return templates.TemplateResponse(
         "image_hosting.html",
-        {"request": request, "files": files, "cfg": _page_cfg(request)},
+        {"request": request, "files": files, "cfg": await _page_cfg(request)},
     )
 
 
@@ -80,12 +80,12 @@ async def share_page(request: Request, file_id: str):
     """
     提供文件分享页面，生成多种格式的下载链接。
     """
-    file_info = database.get_file_by_id(file_id)
+    file_info = await file_repo.get(file_id)
     if not file_info:
         return templates.TemplateResponse("error.html", {"request": request, "message": "文件未找到！"}, status_code=404)
 
     # 构建完整的文件URL
-    cfg = get_app_settings()
+    cfg = await get_app_settings_async()
     base_url = (cfg.get("BASE_URL") or "").strip() or str(request.base_url).rstrip("/")
     encoded_filename = quote(file_info["filename"])
     file_url = f"{base_url}/d/{file_id}/{encoded_filename}"
@@ -107,7 +107,7 @@ async def stats_page(request: Request):
     """
     提供统计仪表板页面。
     """
-    return templates.TemplateResponse("stats.html", {"request": request, "cfg": _page_cfg(request)})
+    return templates.TemplateResponse("stats.html", {"request": request, "cfg": await _page_cfg(request)})
 
 
 @router.get("/downloads", response_class=HTMLResponse)
@@ -115,7 +115,7 @@ async def downloads_page(request: Request):
     """
     提供下载管理页面。
     """
-    return templates.TemplateResponse("downloads.html", {"request": request, "cfg": _page_cfg(request)})
+    return templates.TemplateResponse("downloads.html", {"request": request, "cfg": await _page_cfg(request)})
 
 
 @router.get("/about", response_class=HTMLResponse)
@@ -131,7 +131,7 @@ async def about_page(request: Request):
         "github": __github__,
         "repository": __repository__,
         "license": __license__,
-        "cfg": _page_cfg(request)
+        "cfg": await _page_cfg(request)
     })
 
 
@@ -140,4 +140,4 @@ async def guide_page(request: Request):
     """
     提供使用引导页面。
     """
-    return templates.TemplateResponse("guide.html", {"request": request, "cfg": _page_cfg(request)})
+    return templates.TemplateResponse("guide.html", {"request": request, "cfg": await _page_cfg(request)})
@@ -0,0 +1,278 @@
+"""
+数据库的异步访问层。
+
+所有阻塞的 SQLite 调用都被调度到专用的数据库线程池中执行，
+事件循环上的路由、中间件和后台服务只需 await 即可，不会因为一次慢写入而卡住正在进行的流式传输。
+"""
+
+import asyncio
+import functools
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from . import database
+
+T = TypeVar("T")
+
+# 专用数据库线程池：与 asyncio 默认线程池隔离，避免和文件 IO / 其他 to_thread 调用互相争抢
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="gramdrive-db")
+
+
+async def run_in_db(func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """在数据库线程池中执行同步的数据库函数。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+
+class FileRepository:
+    """文件元数据的异步仓储。"""
+
+    async def query(
+        self,
+        category: str | None = None,
+        sort_by: str | None = None,
+        sort_order: str | None = None,
+        local_only: bool = True,
+    ) -> list[dict]:
+        return await run_in_db(
+            database.get_all_files,
+            category=category,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            local_only=local_only,
+        )
+
+    async def page(
+        self,
+        category: str | None = None,
+        sort_by: str | None = None,
+        sort_order: str | None = None,
+        local_only: bool = True,
+        limit: int = 100,
+        cursor: str | None = None,
+    ) -> dict:
+        return await run_in_db(
+            database.get_files_page,
+            category=category,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            local_only=local_only,
+            limit=limit,
+            cursor=cursor,
+        )
+
+    async def count(self, category: str | None = None, local_only: bool = True) -> int:
+        return await run_in_db(database.count_files, category=category, local_only=local_only)
+
+    async def get(self, identifier: str) -> dict | None:
+        return await run_in_db(database.get_file_by_id, identifier)
+
+    async def add(
+        self,
+        filename: str,
+        file_id: str,
+        filesize: int,
+        mime_type: str | None = None,
+        blob_kind: str | None = None,
+        chunk_count: int | None = None,
+        chunk_size: int | None = None,
+        content_hash: str | None = None,
+    ) -> str:
+        return await run_in_db(
+            database.add_file_metadata,
+            filename,
+            file_id,
+            filesize,
+            mime_type,
+            blob_kind,
+            chunk_count,
+            chunk_size,
+            content_hash,
+        )
+
+    async def add_many(self, records: list[dict]) -> list[str]:
+        return await run_in_db(database.add_files_metadata, records)
+
+    async def get_by_content_hash(self, content_hash: str) -> dict | None:
+        return await run_in_db(database.get_file_by_content_hash, content_hash)
+
+    async def get_local_copy(self, content_hash: str, exclude_file_id: str | None = None) -> str | None:
+        return await run_in_db(database.get_local_copy_by_content_hash, content_hash, exclude_file_id)
+
+    async def update_content_hash(self, file_id: str, content_hash: str) -> bool:
+        return await run_in_db(database.update_content_hash, file_id, content_hash)
+
+    async def update_blob_layout(
+        self, file_id: str, blob_kind: str, chunk_count: int | None = None, chunk_size: int | None = None
+    ) -> bool:
+        return await run_in_db(database.update_blob_layout, file_id, blob_kind, chunk_count, chunk_size)
+
+    async def delete(self, file_id: str) -> bool:
+        return await run_in_db(database.delete_file_metadata, file_id)
+
+    async def delete_by_message_id(self, message_id: int) -> str | None:
+        return await run_in_db(database.delete_file_by_message_id, message_id)
+
+    async def update_local_path(self, file_id: str, local_path: str) -> bool:
+        return await run_in_db(database.update_local_path, file_id, local_path)
+
+    async def clear_local_path(self, file_id: str) -> bool:
+        return await run_in_db(database.clear_local_path, file_id)
+
+    async def mark_download_started(self, file_id: str) -> bool:
+        return await run_in_db(database.mark_download_started, file_id)
+
+    async def mark_download_failed(
+        self, file_id: str, max_retries: int = database.DEFAULT_DOWNLOAD_MAX_RETRIES
+    ) -> str | None:
+        return await run_in_db(database.mark_download_failed, file_id, max_retries)
+
+    async def due_for_download(
+        self,
+        categories: list[str] | None = None,
+        min_size: int = 0,
+        max_size: int | None = None,
+        limit: int = 500,
+    ) -> list[dict]:
+        return await run_in_db(
+            database.get_files_due_for_download,
+            categories=categories,
+            min_size=min_size,
+            max_size=max_size,
+            limit=limit,
+        )
+
+    async def next_retry_delay(
+        self,
+        categories: list[str] | None = None,
+        min_size: int = 0,
+        max_size: int | None = None,
+        exclude_file_ids: list[str] | None = None,
+    ) -> float | None:
+        return await run_in_db(
+            database.get_next_retry_delay,
+            categories=categories,
+            min_size=min_size,
+            max_size=max_size,
+            exclude_file_ids=exclude_file_ids,
+        )
+
+    async def reset_retry_count(self, file_id: str) -> bool:
+        return await run_in_db(database.reset_retry_count, file_id)
+
+    async def list_local(self) -> list[dict]:
+        return await run_in_db(database.get_local_files)
+
+    async def clear_error_markers(self) -> int:
+        return await run_in_db(database.clear_error_markers)
+
+    async def increment_download_count(self, file_id: str) -> bool:
+        return await run_in_db(database.increment_download_count, file_id)
+
+    async def statistics(self) -> dict:
+        return await run_in_db(database.get_statistics)
+
+
+class SessionRepository:
+    """登录会话的异步仓储。"""
+
+    async def create(self, session_id: str, expires_in_hours: int = 24) -> None:
+        await run_in_db(database.create_session, session_id, expires_in_hours)
+
+    async def get(self, session_id: str) -> dict | None:
+        return await run_in_db(database.get_session, session_id)
+
+    async def delete(self, session_id: str) -> bool:
+        return await run_in_db(database.delete_session, session_id)
+
+    async def cleanup_expired(self) -> int:
+        return await run_in_db(database.cleanup_expired_sessions)
+
+
+class TagRepository:
+    """文件标签的异步仓储。"""
+
+    async def add(self, file_id: str, tag: str) -> bool:
+        return await run_in_db(database.add_file_tag, file_id, tag)
+
+    async def remove(self, file_id: str, tag: str) -> bool:
+        return await run_in_db(database.remove_file_tag, file_id, tag)
+
+    async def for_file(self, file_id: str) -> list[str]:
+        return await run_in_db(database.get_file_tags, file_id)
+
+    async def all(self) -> list[dict]:
+        return await run_in_db(database.get_all_tags)
+
+    async def file_ids(self, tag: str) -> list[str]:
+        return await run_in_db(database.get_files_by_tag, tag)
+
+
+class ManifestRepository:
+    """分块文件清单缓存的异步仓储。"""
+
+    async def get(self, manifest_id: str) -> dict | None:
+        return await run_in_db(database.get_manifest, manifest_id)
+
+    async def save(
+        self,
+        manifest_id: str,
+        filename: str,
+        chunk_ids: list[str],
+        chunk_sizes: list[int | None] | None = None,
+    ) -> None:
+        await run_in_db(database.save_manifest, manifest_id, filename, chunk_ids, chunk_sizes)
+
+    async def delete(self, manifest_id: str) -> bool:
+        return await run_in_db(database.delete_manifest, manifest_id)
+
+
+class UploadSessionRepository:
+    """可续传上传会话的异步仓储。"""
+
+    async def create(self, upload_id: str, filename: str, total_size: int) -> None:
+        await run_in_db(database.create_upload_session, upload_id, filename, total_size)
+
+    async def get(self, upload_id: str) -> dict | None:
+        return await run_in_db(database.get_upload_session, upload_id)
+
+    async def record_chunk(
+        self, upload_id: str, chunk_index: int, chunk_id: str, chunk_size: int, received_bytes: int
+    ) -> None:
+        await run_in_db(database.record_upload_chunk, upload_id, chunk_index, chunk_id, chunk_size, received_bytes)
+
+    async def update_progress(self, upload_id: str, received_bytes: int) -> None:
+        await run_in_db(database.update_upload_progress, upload_id, received_bytes)
+
+    async def complete(self, upload_id: str, short_id: str) -> None:
+        await run_in_db(database.complete_upload_session, upload_id, short_id)
+
+    async def delete(self, upload_id: str) -> bool:
+        return await run_in_db(database.delete_upload_session, upload_id)
+
+    async def stale(self, max_age_hours: int) -> list[str]:
+        return await run_in_db(database.get_stale_upload_sessions, max_age_hours)
+
+
+class SettingsRepository:
+    """应用设置（app_settings 单行表）的异步仓储。"""
+
+    async def get(self) -> dict:
+        return await run_in_db(database.get_app_settings_from_db)
+
+    async def save(self, payload: dict) -> None:
+        await run_in_db(database.save_app_settings_to_db, payload)
+
+    async def reset(self) -> None:
+        await run_in_db(database.reset_app_settings_in_db)
+
+
+file_repo = FileRepository()
+session_repo = SessionRepository()
+tag_repo = TagRepository()
+manifest_repo = ManifestRepository()
+upload_session_repo = UploadSessionRepository()
+settings_repo = SettingsRepository()
@@ -0,0 +1,140 @@
+"""
+批量上传。
+
+一个请求中的多个文件共用一条有界流水线：请求体按顺序解析，每个文件读完后放入容量为 BATCH_UPLOAD_CONCURRENCY 的队列，
+由同样数量的工作协程发送到 Telegram，队列已满时 add() 等待，调用方随之暂停读取请求体。
+发送成功的文件交给登记协程成组写入数据库：同一时刻已发送完成的文件在一个事务中插入，随后逐个产出结果。
+中途取消（abort）时丢弃尚未发送的文件，已发送的文件仍然登记，频道中不会留下没有记录的消息。
+"""
+
+import asyncio
+import hashlib
+import os
+from collections.abc import AsyncIterator
+
+from ..core.logging_config import get_logger
+from .telegram_service import CHUNK_SIZE_BYTES, TelegramService
+
+logger = get_logger(__name__)
+
+# 批量上传时同时发送到 Telegram 的文件数（也是等待发送的队列长度）
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "4"))
+# 批量上传中单个文件的大小上限：只支持单个文档上传，更大的文件请使用 /api/upload 或续传接口
+BATCH_UPLOAD_MAX_FILE_SIZE = CHUNK_SIZE_BYTES - 1
+
+
+class BatchUpload:
+    """
+    批量上传流水线。add() 依次提交文件，close() 表示提交结束，results() 按完成顺序产出每个文件的结果：
+    成功为 {"index", "filename", "short_id", "duplicate"}，失败为 {"index", "filename", "error": {"code", "message"}}。
+    """
+
+    def __init__(self, service: TelegramService, concurrency: int = BATCH_UPLOAD_CONCURRENCY):
+        self.service = service
+        self.count = 0
+        concurrency = max(1, concurrency)
+        self._pending: asyncio.Queue[tuple[int, str, bytes] | None] = asyncio.Queue(maxsize=concurrency)
+        self._sent: asyncio.Queue[dict | None] = asyncio.Queue()
+        self._results: asyncio.Queue[dict | None] = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(concurrency)]
+        self._registrar = asyncio.create_task(self._register())
+        self._closed = False
+        self._done = asyncio.create_task(self._drain())
+
+    async def add(self, filename: str, data: bytes) -> None:
+        """提交一个文件；等待发送的文件已满时等待。"""
+        index = self._next_index()
+        await self._pending.put((index, filename, data))
+
+    def reject(self, filename: str | None, code: str, message: str) -> None:
+        """记录一个无法上传的条目（例如超过大小上限），直接产出失败结果。"""
+        self._results.put_nowait(self._error(self._next_index(), filename, code, message))
+
+    async def close(self) -> None:
+        """提交结束：已提交的文件继续上传，全部完成后 results() 结束。"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            await self._pending.put(None)
+
+    async def results(self) -> AsyncIterator[dict]:
+        while (result := await self._results.get()) is not None:
+            yield result
+
+    async def abort(self) -> None:
+        """
+        停止批量上传：丢弃尚未开始发送的文件，等待正在发送的文件完成并登记全部已发送的文件。
+        调用方被取消时登记仍在后台完成（取消发送中的请求无法确定消息是否已发出，因此不取消）。
+        """
+        self._closed = True
+        while not self._pending.empty():
+            self._pending.get_nowait()
+        for _ in self._workers:
+            self._pending.put_nowait(None)
+        await asyncio.shield(self._done)
+
+    def _next_index(self) -> int:
+        index = self.count
+        self.count += 1
+        return index
+
+    async def _worker(self) -> None:
+        while (item := await self._pending.get()) is not None:
+            index, filename, data = item
+            try:
+                await self._upload(index, filename, data)
+            except Exception as e:
+                logger.error(f"【批量上传】文件上传失败。文件名: {filename}，错误: {str(e)}", exc_info=e)
+                self._results.put_nowait(self._error(index, filename, "upload_failed", str(e)))
+
+    async def _upload(self, index: int, filename: str, data: bytes) -> None:
+        content_hash = (await asyncio.to_thread(hashlib.sha256, data)).hexdigest()
+        existing_short_id = await self.service.find_duplicate(content_hash)
+        if existing_short_id:
+            self._results.put_nowait(
+                {"index": index, "filename": filename, "short_id": existing_short_id, "duplicate": True}
+            )
+            return
+        record = await self.service.send_document(data, filename, len(data), content_hash)
+        self._sent.put_nowait({"index": index, "record": record})
+
+    async def _register(self) -> None:
+        """成组登记已发送的文件：每次取出当前已完成的全部文件，在一个事务中插入。"""
+        finished = False
+        while not finished:
+            group = [await self._sent.get()]
+            while not self._sent.empty():
+                group.append(self._sent.get_nowait())
+            if group[-1] is None:
+                finished = True
+                group.pop()
+            if not group:
+                continue
+            records = [item["record"] for item in group]
+            try:
+                short_ids = await self.service.register_uploads(records)
+            except Exception as e:
+                logger.error(f"【批量上传】登记文件元数据失败。文件数: {len(records)}，错误: {str(e)}", exc_info=e)
+                for item in group:
+                    self._results.put_nowait(
+                        self._error(item["index"], item["record"]["filename"], "register_failed", str(e))
+                    )
+                continue
+            logger.info(f"【批量上传】已登记 {len(records)} 个文件")
+            for item, short_id in zip(group, short_ids, strict=True):
+                self._results.put_nowait(
+                    {"index": item["index"], "filename": item["record"]["filename"], "short_id": short_id, "duplicate": False}
+                )
+
+    async def _drain(self) -> None:
+        try:
+            await asyncio.gather(*self._workers)
+            self._sent.put_nowait(None)
+            await self._registrar
+        finally:
+            self._results.put_nowait(None)
+
+    @staticmethod
+    def _error(index: int, filename: str | None, code: str, message: str) -> dict:
+        return {"index": index, "filename": filename, "error": {"code": code, "message": message}}
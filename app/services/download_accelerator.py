@@ -1,40 +1,222 @@
 """多线程并发下载的下载加速器。"""
 
 import asyncio
-from collections.abc import AsyncGenerator
+import contextlib
+import os
+import random
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from typing import TypeVar
 
 import httpx
 
+from ..core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# 流式加速下载：每个范围请求的初始大小，以及同时在途 / 缓冲的最大字节数（决定峰值内存）
+STREAM_SEGMENT_SIZE = int(os.getenv("DOWNLOAD_STREAM_SEGMENT_SIZE", str(1024 * 1024)))
+STREAM_MAX_INFLIGHT_BYTES = int(os.getenv("DOWNLOAD_STREAM_MAX_INFLIGHT", str(16 * 1024 * 1024)))
+
+# 自适应调节：分段大小范围、单个分段的目标耗时、并发上限
+MIN_SEGMENT_SIZE = 256 * 1024
+MAX_SEGMENT_SIZE = 32 * 1024 * 1024
+TARGET_SEGMENT_SECONDS = 2.0
+MAX_CONCURRENCY = 16
+# 增加并发后总带宽至少提升该比例才继续探测；停止探测后间隔多久重新探测（秒）
+BANDWIDTH_GAIN = 1.1
+PROBE_INTERVAL_SECONDS = 60.0
+# 超过该时间（秒）没有新样本时重新开始统计总带宽（两次下载之间的空闲不计入）
+IDLE_RESET_SECONDS = 5.0
+# 视为限流 / 服务端过载的响应状态码
+THROTTLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# 表示下载链接已失效（需重新 getFile）的响应状态码
+EXPIRED_URL_STATUS_CODES = frozenset({403, 404, 410})
+# 流式下载中单个分段的最大尝试次数；重试间隔按指数退避（带随机抖动），服务端给出 Retry-After 时以其为下限
+STREAM_SEGMENT_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# 对冲请求：分段耗时超过同主机单连接预期耗时的 HEDGE_FACTOR 倍（且不少于 HEDGE_MIN_DELAY 秒）时发出副本请求
+HEDGE_FACTOR = 3.0
+HEDGE_MIN_DELAY = 1.0
+# 单连接吞吐量的指数滑动平均系数
+THROUGHPUT_EWMA_ALPHA = 0.2
+
+
+class UrlExpired(Exception):
+    """下载链接已失效（EXPIRED_URL_STATUS_CODES）。抛出方已丢弃旧链接，重试时会重新获取，因此可以重试。"""
+
+
+class HostTuning:
+    """
+    单个主机的自适应下载参数。
+
+    分段大小跟随单连接吞吐量调整，使每个分段耗时约 TARGET_SEGMENT_SECONDS；
+    并发数逐步增加，直到总带宽不再明显提升，遇到 429 / 5xx 时减半。
+    range_supported 记录该主机是否支持 Range 请求（None 表示尚未确认），由实际响应更新，避免每次下载前探测。
+    """
+
+    def __init__(self, segment_size: int, concurrency: int):
+        self.segment_size = max(MIN_SEGMENT_SIZE, min(MAX_SEGMENT_SIZE, segment_size))
+        self.concurrency = max(1, min(MAX_CONCURRENCY, concurrency))
+        self.best_bandwidth = 0.0
+        self.connection_throughput = 0.0
+        self.throttle_count = 0
+        self.hedge_count = 0
+        self.hedge_wins = 0
+        self.range_supported: bool | None = None
+        self._probing = True
+        self._increased = False
+        self._probe_at = 0.0
+        self._window_start = 0.0
+        self._window_bytes = 0
+        self._window_segments = 0
+        self._last_sample = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "segment_size": self.segment_size,
+            "concurrency": self.concurrency,
+            "best_bandwidth": round(self.best_bandwidth),
+            "connection_throughput": round(self.connection_throughput),
+            "throttle_count": self.throttle_count,
+            "hedge_count": self.hedge_count,
+            "hedge_wins": self.hedge_wins,
+            "range_supported": self.range_supported,
+            "probing": self._probing,
+        }
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        """记录一个成功完成的分段（字节数与耗时）。"""
+        now = time.monotonic()
+        if seconds > 0 and nbytes > 0:
+            throughput = nbytes / seconds
+            if self.connection_throughput:
+                self.connection_throughput += THROUGHPUT_EWMA_ALPHA * (throughput - self.connection_throughput)
+            else:
+                self.connection_throughput = throughput
+            # 向目标分段大小靠拢（取平均以平滑抖动）
+            ideal = throughput * TARGET_SEGMENT_SECONDS
+            self.segment_size = int(max(MIN_SEGMENT_SIZE, min(MAX_SEGMENT_SIZE, (self.segment_size + ideal) / 2)))
+
+        if not self._probing and now >= self._probe_at:
+            self._probing = True
+        if not self._window_start or now - self._last_sample > IDLE_RESET_SECONDS:
+            self._reset_window(now - seconds)
+        self._last_sample = now
+        self._window_bytes += nbytes
+        self._window_segments += 1
+
+        # 每完成约两轮并发的分段评估一次总带宽
+        if self._window_segments < self.concurrency * 2:
+            return
+        elapsed = now - self._window_start
+        bandwidth = self._window_bytes / elapsed if elapsed > 0 else 0.0
+        if bandwidth > self.best_bandwidth * BANDWIDTH_GAIN:
+            self.best_bandwidth = bandwidth
+            if self._probing and self.concurrency < MAX_CONCURRENCY:
+                self.concurrency += 1
+                self._increased = True
+                self._reset_window(now)
+                return
+        elif self._probing:
+            # 总带宽不再提升：刚增加过并发则退回一步，一段时间后再探测
+            if self._increased:
+                self.concurrency = max(1, self.concurrency - 1)
+            self._stop_probing(now)
+        self._increased = False
+        self._reset_window(now)
+
+    def record_throttle(self) -> None:
+        """服务端返回 429 / 5xx：并发减半，并暂停探测。"""
+        now = time.monotonic()
+        self.throttle_count += 1
+        self.concurrency = max(1, self.concurrency // 2)
+        # 限流后的带宽基线不再可信
+        self.best_bandwidth = 0.0
+        self._increased = False
+        self._stop_probing(now)
+        self._reset_window(now)
+
+    def hedge_delay(self, nbytes: int) -> float | None:
+        """大小为 nbytes 的分段在多久之后仍未完成就应发出对冲请求；尚无吞吐量样本时返回 None（不对冲）。"""
+        if self.connection_throughput <= 0:
+            return None
+        return max(HEDGE_MIN_DELAY, HEDGE_FACTOR * nbytes / self.connection_throughput)
+
+    def _stop_probing(self, now: float) -> None:
+        self._probing = False
+        self._probe_at = now + PROBE_INTERVAL_SECONDS
+
+    def _reset_window(self, now: float) -> None:
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_segments = 0
+
+
+# 按主机记住调节后的参数，后续下载直接从接近最优的参数开始
+_host_tunings: dict[str, HostTuning] = {}
+
+
+def get_host_tuning(url: str, segment_size: int = STREAM_SEGMENT_SIZE, concurrency: int = 4) -> HostTuning:
+    """获取（或以给定初始值创建）URL 所在主机的自适应参数。"""
+    host = httpx.URL(url).host
+    tuning = _host_tunings.get(host)
+    if tuning is None:
+        tuning = _host_tunings[host] = HostTuning(segment_size, concurrency)
+    return tuning
+
+
+def get_host_tunings() -> dict[str, dict]:
+    """所有主机当前的自适应参数（用于状态展示）。"""
+    return {host: tuning.snapshot() for host, tuning in _host_tunings.items()}
+
 
 class DownloadAccelerator:
-    """使用并发范围请求的多线程下载加速器。"""
+    """使用并发范围请求的多线程下载加速器，分段大小与并发数按主机自适应调节。"""
 
     def __init__(self, http_client: httpx.AsyncClient, thread_count: int = 4):
         """Initialize the download accelerator.
 
         Args:
             http_client: Async HTTP client for making requests
-            thread_count: Number of concurrent download threads (1-16)
+            thread_count: Initial concurrency for hosts without tuning history (1-16)
         """
         self.client = http_client
-        self.thread_count = max(1, min(thread_count, 16))
+        self.thread_count = max(1, min(thread_count, MAX_CONCURRENCY))
+
+    def tuning_for(self, url: str, segment_size: int = STREAM_SEGMENT_SIZE) -> HostTuning:
+        """URL 所在主机的自适应参数；首次访问的主机以 segment_size / thread_count 为初始值。"""
+        return get_host_tuning(url, segment_size, self.thread_count)
 
-    async def supports_range_requests(self, url: str) -> tuple[bool, int]:
+    async def supports_range_requests(self, url: str, content_length: int | None = None) -> tuple[bool, int]:
         """Check if the URL supports Range requests and get content length.
 
+        When the content length is already known (e.g. from the database) and the
+        host's Range support has been recorded, no request is made; otherwise a
+        HEAD probe is issued and its result is remembered for the host.
+
         Args:
             url: The URL to check
+            content_length: Known content length, if any
 
         Returns:
             Tuple of (supports_ranges, content_length)
         """
+        tuning = self.tuning_for(url)
+        if content_length and tuning.range_supported is not None:
+            return tuning.range_supported, content_length
         try:
             resp = await self.client.head(url, follow_redirects=True)
-            accepts_ranges = resp.headers.get("Accept-Ranges") == "bytes"
-            content_length = int(resp.headers.get("Content-Length", 0))
-            return accepts_ranges and content_length > 0, content_length
+            resp.raise_for_status()
         except Exception:
-            return False, 0
+            return False, content_length or 0
+        tuning.range_supported = resp.headers.get("Accept-Ranges") == "bytes"
+        content_length = content_length or int(resp.headers.get("Content-Length", 0))
+        return tuning.range_supported and content_length > 0, content_length
 
     async def download_chunk(
         self, url: str, start: int, end: int, chunk_id: int
@@ -51,34 +233,185 @@ class DownloadAccelerator:
             Tuple of (chunk_id, chunk_data)
         """
         headers = {"Range": f"bytes={start}-{end}"}
+        started = time.monotonic()
         async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as resp:
-            resp.raise_for_status()
+            self._check_status(url, resp)
             data = await resp.aread()
-            return chunk_id, data
+        if resp.status_code != 206:
+            # 服务器忽略 Range 时返回 200 与完整内容，截取所需区间
+            data = data[start:end + 1]
+        self.tuning_for(url).record(len(data), time.monotonic() - started)
+        return chunk_id, data
+
+    async def download_range_to_file(
+        self, url: str, start: int, end: int, write: Callable[[int, bytes], None]
+    ) -> int:
+        """Stream a byte range straight to disk without buffering it in memory.
+
+        Args:
+            url: The URL to download from
+            start: Start byte position
+            end: End byte position (inclusive)
+            write: Callback receiving (offset relative to start, data)
+
+        Returns:
+            Number of bytes written
+        """
+        length = end - start + 1
+        headers = {"Range": f"bytes={start}-{end}"}
+        written = 0
+        started = time.monotonic()
+        async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as resp:
+            self._check_status(url, resp)
+            # 服务器忽略 Range 时返回 200 与完整内容，跳过区间之前的字节
+            skip = start if resp.status_code != 206 else 0
+            async for data in resp.aiter_bytes():
+                if skip:
+                    if len(data) <= skip:
+                        skip -= len(data)
+                        continue
+                    data = data[skip:]
+                    skip = 0
+                data = data[:length - written]
+                write(written, data)
+                written += len(data)
+                if written >= length:
+                    break
+        if written == length:
+            self.tuning_for(url).record(written, time.monotonic() - started)
+        return written
 
     async def accelerated_download(
-        self, url: str, file_size: int
+        self,
+        url: str,
+        file_size: int,
+        segment_size: int = STREAM_SEGMENT_SIZE,
+        max_inflight_bytes: int = STREAM_MAX_INFLIGHT_BYTES,
     ) -> AsyncGenerator[bytes, None]:
-        """Download file using multiple concurrent threads.
+        """Download file using a sliding window of concurrent range requests.
+
+        Segments are yielded in order as soon as the head of the window has
+        landed, so time-to-first-byte does not depend on the file size. At most
+        ``max_inflight_bytes`` (rounded to whole segments, at least one) are
+        requested or buffered at any time. Segment size and window width follow
+        the host's adaptive tuning and are re-read every time the window refills.
 
         Args:
             url: The URL to download from
             file_size: Total file size in bytes
+            segment_size: Initial segment size for hosts without tuning history
+            max_inflight_bytes: Upper bound on buffered + in-flight bytes
 
         Yields:
             Chunks of file data in order
         """
-        chunk_size = file_size // self.thread_count
+        tuning = self.tuning_for(url, segment_size)
+        pending: deque[asyncio.Task] = deque()
+        next_start = 0
+        try:
+            while pending or next_start < file_size:
+                # 窗口内包含正在交给调用方的分段，内存占用不超过 max_inflight_bytes
+                size = max(1, min(tuning.segment_size, max_inflight_bytes))
+                window = max(1, min(tuning.concurrency, max_inflight_bytes // size))
+                while next_start < file_size and len(pending) < window:
+                    end = min(next_start + size, file_size) - 1
+                    pending.append(asyncio.create_task(self._download_segment(url, next_start, end)))
+                    next_start = end + 1
+                yield await pending.popleft()
+        finally:
+            # 调用方提前停止（客户端断开）或某个分段失败时，取消窗口内剩余的请求
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
 
-        tasks = []
-        for i in range(self.thread_count):
-            start = i * chunk_size
-            end = start + chunk_size - 1 if i < self.thread_count - 1 else file_size - 1
-            tasks.append(self.download_chunk(url, start, end, i))
+    async def run_segment(
+        self,
+        tuning: HostTuning,
+        nbytes: int,
+        attempt: Callable[[], Awaitable[T]],
+        attempts: int = STREAM_SEGMENT_ATTEMPTS,
+    ) -> T:
+        """
+        执行一个分段请求：失败时按指数退避重试，单次尝试明显慢于同主机的其他连接时发出对冲请求。
+
+        Args:
+            tuning: 分段所在主机的自适应参数（提供预期耗时）
+            nbytes: 分段大小，用于计算对冲时机
+            attempt: 发起一次请求的协程工厂；对冲时会被同时调用两次，因此必须可以并发执行
+            attempts: 最大尝试次数
+        """
+        attempt_no = 0
+        while True:
+            attempt_no += 1
+            try:
+                return await self._hedged(tuning, nbytes, attempt)
+            except Exception as e:
+                if attempt_no >= attempts or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(attempt_no, e)
+                logger.warning(f"【下载加速】分段请求失败，{delay:.1f}秒后第 {attempt_no} 次重试。大小: {nbytes}，错误: {e}")
+                await asyncio.sleep(delay)
 
-        # Execute concurrently and return in order
-        results = await asyncio.gather(*tasks)
-        results.sort(key=lambda x: x[0])
+    async def _hedged(self, tuning: HostTuning, nbytes: int, attempt: Callable[[], Awaitable[T]]) -> T:
+        """发起请求；超过预期耗时仍未完成则再发一个副本，采用先成功的一个并取消另一个。"""
+        tasks = {asyncio.ensure_future(attempt())}
+        hedge = None
+        try:
+            delay = tuning.hedge_delay(nbytes)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    hedge = asyncio.ensure_future(attempt())
+                    tasks.add(hedge)
+                    tuning.hedge_count += 1
+            error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            tuning.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _download_segment(self, url: str, start: int, end: int) -> bytes:
+        """下载流式分段（带重试与对冲）。"""
+        tuning = self.tuning_for(url)
+        _, data = await self.run_segment(tuning, end - start + 1, lambda: self.download_chunk(url, start, end, start))
+        return data
+
+    def _check_status(self, url: str, resp: httpx.Response) -> None:
+        """校验响应状态；429 / 5xx 会降低该主机的并发，成功的范围请求同时记录该主机是否支持 Range。"""
+        tuning = self.tuning_for(url)
+        if resp.status_code in THROTTLE_STATUS_CODES:
+            tuning.record_throttle()
+        resp.raise_for_status()
+        if "Range" in resp.request.headers:
+            tuning.range_supported = resp.status_code == 206
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """
+        除 408 / 429 以外的 4xx 属于请求本身的问题，重试无意义；网络错误与 5xx 均可重试。
+        链接失效（UrlExpired）时重试会使用重新获取的链接，同样可以重试。
+        """
+        if isinstance(error, UrlExpired):
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            status_code = error.response.status_code
+            return status_code in (408, 429) or status_code >= 500
+        return True
 
-        for _, chunk_data in results:
-            yield chunk_data
+    @staticmethod
+    def _retry_delay(attempt_no: int, error: Exception) -> float:
+        """指数退避（带随机抖动）；服务端给出 Retry-After 时不短于该值。"""
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt_no - 1)) * random.uniform(0.5, 1.0)
+        if isinstance(error, httpx.HTTPStatusError):
+            with contextlib.suppress(ValueError):
+                delay = max(delay, min(RETRY_MAX_DELAY, float(error.response.headers.get("Retry-After", 0))))
+        return delay
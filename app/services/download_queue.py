@@ -0,0 +1,170 @@
+"""
+自动下载使用的优先级队列。
+
+排序键依次为：用户需求（最近通过 /d/ 或缩略图访问过的文件优先）、大小级别、文件类别、入队顺序。
+小文件单独成堆，预留的工作协程只从小文件堆取任务，保证小文件不会被多 GB 的大文件饿死。
+成员判断、入队、提升优先级均为 O(1) / O(log n)，不再线性扫描队列。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+# 不超过该大小（字节）的文件走小文件通道，默认与 Telegram getFile 的 20MB 上限一致
+SMALL_FILE_MAX_BYTES = int(os.getenv("DOWNLOAD_SMALL_FILE_MAX", str(20 * 1024 * 1024)))
+# 超过该大小（字节）的文件归为大文件级别
+LARGE_FILE_MIN_BYTES = 512 * 1024 * 1024
+
+SIZE_CLASS_SMALL = 0
+SIZE_CLASS_MEDIUM = 1
+SIZE_CLASS_LARGE = 2
+
+# 类别优先级：图片最常被浏览，其次是音频 / 文档，视频通常体积最大
+CATEGORY_PRIORITY = {"image": 0, "audio": 1, "document": 2, "video": 3, "other": 4}
+
+# 需求记录的有效期与容量：有效期内入队 / 已在队列中的文件会被提升到最高优先级
+DEMAND_TTL_SECONDS = 600
+DEMAND_MAX_ENTRIES = 1024
+
+_REMOVED = object()
+
+
+def size_class(filesize: int | None) -> int:
+    size = filesize or 0
+    if size <= SMALL_FILE_MAX_BYTES:
+        return SIZE_CLASS_SMALL
+    if size < LARGE_FILE_MIN_BYTES:
+        return SIZE_CLASS_MEDIUM
+    return SIZE_CLASS_LARGE
+
+
+class DownloadQueue:
+    """按优先级出队的下载队列，同一 file_id 只会排队一次。"""
+
+    def __init__(self):
+        self._small: list[list] = []
+        self._other: list[list] = []
+        self._entries: dict[str, list] = {}
+        self._items: dict[str, dict[str, Any]] = {}
+        self._demand: OrderedDict[str, float] = OrderedDict()
+        self._counter = itertools.count()
+        self._getters: list[asyncio.Future] = []
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def file_ids(self) -> list[str]:
+        return list(self._entries)
+
+    def qsize(self) -> int:
+        return len(self._entries)
+
+    def empty(self) -> bool:
+        return not self._entries
+
+    def lane_sizes(self) -> dict[str, int]:
+        small = sum(1 for entry in self._small if entry[-1] is not _REMOVED)
+        return {"small": small, "other": len(self._entries) - small}
+
+    def put(self, file_info: dict[str, Any]) -> bool:
+        """加入队列；已在队列中时返回 False（若有新的需求记录则顺带提升优先级）。"""
+        file_id = file_info['file_id']
+        if file_id in self._entries:
+            if self._has_demand(file_id):
+                self._reprioritize(file_id)
+            return False
+        self._items[file_id] = file_info
+        self._push(file_id)
+        self._notify()
+        return True
+
+    def mark_demand(self, file_id: str) -> None:
+        """记录用户对文件的访问需求；文件已在队列中则立即提升到最高优先级。"""
+        self._demand[file_id] = time.monotonic()
+        self._demand.move_to_end(file_id)
+        while len(self._demand) > DEMAND_MAX_ENTRIES:
+            self._demand.popitem(last=False)
+        if file_id in self._entries:
+            self._reprioritize(file_id)
+
+    def notify(self) -> None:
+        """唤醒所有等待中的 get()，让它们重新判断可取的通道（例如预留协程数量变化后）。"""
+        self._notify()
+
+    async def get(self, small_only: Callable[[], bool] | None = None) -> dict[str, Any]:
+        """
+        取出优先级最高的文件。
+
+        Args:
+            small_only: 返回 True 时只从小文件通道取任务（预留给小文件的工作协程）
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            file_info = self._pop(small_only() if small_only else False)
+            if file_info is not None:
+                return file_info
+            getter = loop.create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            finally:
+                if getter in self._getters:
+                    self._getters.remove(getter)
+
+    def _has_demand(self, file_id: str) -> bool:
+        requested_at = self._demand.get(file_id)
+        return requested_at is not None and time.monotonic() - requested_at < DEMAND_TTL_SECONDS
+
+    def _push(self, file_id: str) -> None:
+        file_info = self._items[file_id]
+        cls = size_class(file_info.get('filesize'))
+        entry = [
+            0 if self._has_demand(file_id) else 1,
+            cls,
+            CATEGORY_PRIORITY.get(file_info.get('category') or "other", len(CATEGORY_PRIORITY)),
+            next(self._counter),
+            file_id,
+        ]
+        self._entries[file_id] = entry
+        heapq.heappush(self._small if cls == SIZE_CLASS_SMALL else self._other, entry)
+
+    def _reprioritize(self, file_id: str) -> None:
+        entry = self._entries.get(file_id)
+        if entry is None or entry[0] == 0:
+            return
+        entry[-1] = _REMOVED
+        self._push(file_id)
+        self._notify()
+
+    def _pop(self, small_only: bool) -> dict[str, Any] | None:
+        for heap in (self._small, self._other):
+            while heap and heap[0][-1] is _REMOVED:
+                heapq.heappop(heap)
+
+        if small_only or not self._other:
+            heap = self._small
+        elif not self._small:
+            heap = self._other
+        else:
+            heap = self._small if self._small[0] < self._other[0] else self._other
+        if not heap:
+            return None
+
+        file_id = heapq.heappop(heap)[-1]
+        del self._entries[file_id]
+        self._demand.pop(file_id, None)
+        return self._items.pop(file_id)
+
+    def _notify(self) -> None:
+        getters, self._getters = self._getters, []
+        for getter in getters:
+            if not getter.done():
+                getter.set_result(None)
@@ -1,16 +1,29 @@
 import asyncio
+import contextlib
+import datetime
 import json
 import os
 import time
 import uuid
+from collections import deque
 from typing import Any
 
 import httpx
 
 from .. import database
 from ..core.logging_config import get_logger
-from ..events import file_update_queue
-from ..services.telegram_service import TelegramService
+from ..events import file_update_queue, new_file_queue
+from ..repository import file_repo, settings_repo
+from ..services.telegram_service import CHUNK_SIZE_BYTES, TelegramService, file_sha256
+from .download_accelerator import (
+    EXPIRED_URL_STATUS_CODES,
+    DownloadAccelerator,
+    HostTuning,
+    UrlExpired,
+)
+from .download_queue import DownloadQueue
+from .download_url_cache import download_url_cache
+from .partial_download import PartialDownload, sweep_stale_partials
 
 logger = get_logger(__name__)
 
@@ -18,13 +31,34 @@ logger = get_logger(__name__)
 # 在多工作进程设置中，这需要被替换为像 Redis Pub/Sub 这样的机制。
 progress_event_queue = asyncio.Queue()
 
+# 对账扫描间隔（秒）：新文件由上传 / Bot 事件即时推送，定期扫描仅作为兜底
+DOWNLOAD_RECONCILE_INTERVAL = int(os.getenv("DOWNLOAD_RECONCILE_INTERVAL", "600"))
+# 下载工作协程数量上限（与设置页 DOWNLOAD_THREADS 的取值范围一致）
+MAX_DOWNLOAD_WORKERS = 16
+# 预留给小文件通道的工作协程数量（仅当总数大于该值时生效）
+DOWNLOAD_SMALL_FILE_WORKERS = int(os.getenv("DOWNLOAD_SMALL_FILE_WORKERS", "1"))
+# 分段并行下载：初始分段大小（字节）与初始并发数（之后按下载主机自适应调节）、单个分段的最大尝试次数
+DOWNLOAD_SEGMENT_SIZE = int(os.getenv("DOWNLOAD_SEGMENT_SIZE", str(4 * 1024 * 1024)))
+DOWNLOAD_SEGMENT_CONCURRENCY = int(os.getenv("DOWNLOAD_SEGMENT_CONCURRENCY", "4"))
+DOWNLOAD_SEGMENT_RETRIES = int(os.getenv("DOWNLOAD_SEGMENT_RETRIES", "3"))
+# 超过该时间（小时）没有进展的 .part 文件在启动时清理
+DOWNLOAD_PARTIAL_TTL_HOURS = int(os.getenv("DOWNLOAD_PARTIAL_TTL_HOURS", "168"))
+
 class DownloadService:
     def __init__(self, telegram_service: TelegramService, http_client: httpx.AsyncClient = None):
         self.telegram_service = telegram_service
         self.http_client = http_client  # 使用共享的 HTTP 客户端
         self.running = False
         self.download_task = None
-        self.download_queue: asyncio.Queue = asyncio.Queue()
+        self.ingest_task = None
+        self.download_queue = DownloadQueue()
+        # 常驻下载工作协程：worker_id -> Task / 状态，worker_id 从 1 开始连续编号
+        self._workers: dict[int, asyncio.Task] = {}
+        self._worker_status: dict[int, dict[str, Any]] = {}
+        self._target_workers = 0
+        # 唤醒调度循环：有新文件入队或需要立即对账时置位
+        self._wake_event = asyncio.Event()
+        self._reconcile_requested = True
         logger.info("【下载服务】已初始化")
 
     async def start(self):
@@ -33,7 +67,19 @@ class DownloadService:
             return
         logger.info("【下载服务】正在启动...")
         self.running = True
+        self._reconcile_requested = True
+        settings = await self._get_download_settings()
+        try:
+            removed = await asyncio.to_thread(
+                sweep_stale_partials, settings['download_dir'], DOWNLOAD_PARTIAL_TTL_HOURS * 3600
+            )
+            if removed:
+                logger.info(f"【下载服务】已清理 {removed} 个过期的未完成下载文件")
+        except OSError as e:
+            logger.warning(f"【下载服务】清理未完成下载文件失败: {e}")
+        self.resize_workers(settings['threads'])
         self.download_task = asyncio.create_task(self._monitor_and_download())
+        self.ingest_task = asyncio.create_task(self._consume_new_files())
         logger.info("【下载服务】已启动")
 
     async def stop(self):
@@ -42,36 +88,203 @@ class DownloadService:
             return
         logger.info("正在停止 DownloadService...")
         self.running = False
-        if self.download_task:
-            self.download_task.cancel()
+        for task in (self.ingest_task, self.download_task, *self._workers.values()):
+            if not task:
+                continue
+            task.cancel()
             try:
-                await self.download_task
+                await task
             except asyncio.CancelledError:
                 logger.info("DownloadService 任务已取消。")
             except Exception as e:
                 logger.error("停止 DownloadService 任务出错: %s", e)
+        self.ingest_task = None
+        self.download_task = None
+        self._workers.clear()
+        self._worker_status.clear()
+        self._target_workers = 0
         logger.info("DownloadService 已停止。")
 
+    def request_reconcile(self) -> None:
+        """请求立即执行一次对账扫描（例如下载配置变更、清除错误标记之后）。"""
+        self._reconcile_requested = True
+        self._wake_event.set()
+
+    def resize_workers(self, count: int) -> None:
+        """
+        调整常驻下载工作协程数量（DOWNLOAD_THREADS）。
+        扩容立即生效；缩容时空闲的协程立即退出，忙碌的协程完成当前文件后退出。
+        """
+        count = max(1, min(MAX_DOWNLOAD_WORKERS, int(count or 1)))
+        if count == self._target_workers and len(self._workers) == count:
+            return
+        previous = self._target_workers
+        self._target_workers = count
+
+        for worker_id in range(1, count + 1):
+            task = self._workers.get(worker_id)
+            if task is None or task.done():
+                self._worker_status[worker_id] = {"worker_id": worker_id, "state": "idle"}
+                self._workers[worker_id] = asyncio.create_task(self._worker_loop(worker_id))
+
+        for worker_id in [wid for wid in self._workers if wid > count]:
+            if self._worker_status.get(worker_id, {}).get("state") == "idle":
+                self._workers.pop(worker_id).cancel()
+                self._worker_status.pop(worker_id, None)
+
+        if previous != count:
+            # 预留协程是否生效取决于总数，唤醒等待中的协程重新选择通道
+            self.download_queue.notify()
+            logger.info("【下载服务】下载工作协程数量: %d -> %d", previous, count)
+
+    def get_worker_status(self) -> list[dict[str, Any]]:
+        """返回每个下载工作协程的当前状态。"""
+        now = time.time()
+        result = []
+        for worker_id in sorted(self._worker_status):
+            status = dict(self._worker_status[worker_id])
+            if status.get("started_at"):
+                status["elapsed"] = round(now - status["started_at"], 1)
+            status["retiring"] = worker_id > self._target_workers
+            status["lane"] = "small" if self._is_small_file_worker(worker_id) else "any"
+            result.append(status)
+        return result
+
+    def _is_small_file_worker(self, worker_id: int) -> bool:
+        """前 DOWNLOAD_SMALL_FILE_WORKERS 个协程只处理小文件，保证小文件不被大文件饿死。"""
+        return worker_id <= DOWNLOAD_SMALL_FILE_WORKERS < self._target_workers
+
+    def _is_scheduled(self, file_id: str) -> bool:
+        """文件是否已在下载队列中或正在被某个工作协程下载。"""
+        if file_id in self.download_queue:
+            return True
+        return any(status.get("file_id") == file_id for status in self._worker_status.values())
+
+    def _scheduled_file_ids(self) -> list[str]:
+        """已在下载队列中或正在下载的全部 file_id。"""
+        active = [status["file_id"] for status in self._worker_status.values() if status.get("file_id")]
+        return [*self.download_queue.file_ids(), *active]
+
+    async def _next_retry_delay(self, settings: dict[str, Any]) -> float | None:
+        """最早一次会被加入队列的重试距今的秒数（过滤条件与对账查询一致，不含已排队 / 正在下载的文件）。"""
+        return await file_repo.next_retry_delay(
+            categories=None if 'all' in settings['file_types'] else settings['file_types'],
+            min_size=settings['min_size'],
+            max_size=settings['max_size'],
+            exclude_file_ids=self._scheduled_file_ids(),
+        )
+
+    async def request_file(self, file_info: dict[str, Any]) -> None:
+        """
+        记录用户对文件的访问（/d/ 下载、缩略图）。已排队的文件提升到最高优先级；
+        尚未排队但符合自动下载条件的文件直接以最高优先级入队。
+        """
+        file_id = file_info['file_id']
+        self.download_queue.mark_demand(file_id)
+        if not self.running or self._is_scheduled(file_id):
+            return
+        settings = await self._get_download_settings()
+        if settings['enabled'] and self._should_download(file_info, settings):
+            self.download_queue.put(file_info)
+
+    async def _worker_loop(self, worker_id: int):
+        """常驻工作协程：持续从下载队列取文件下载，一个大文件不会阻塞其他协程。"""
+        status = self._worker_status[worker_id]
+        try:
+            while self.running and worker_id <= self._target_workers:
+                file_info = await self.download_queue.get(small_only=lambda: self._is_small_file_worker(worker_id))
+                status.update(
+                    state="downloading",
+                    file_id=file_info['file_id'],
+                    filename=file_info['filename'],
+                    total_size=file_info.get('filesize', 0),
+                    bytes_downloaded=0,
+                    speed=0,
+                    started_at=time.time(),
+                )
+                try:
+                    settings = await self._get_download_settings()
+                    await self._download_file(file_info, settings, status)
+                except Exception as e:
+                    logger.error("【下载服务】工作协程 %d 处理文件出错: %s", worker_id, e)
+                finally:
+                    status.clear()
+                    status.update(worker_id=worker_id, state="idle")
+                    # 下载结束后文件可能进入重试状态：唤醒调度协程重新计算下一次重试时间
+                    self._wake_event.set()
+        finally:
+            # 同一 worker_id 可能已被新的协程复用，只清理属于自己的记录
+            if self._worker_status.get(worker_id) is status:
+                del self._worker_status[worker_id]
+            if self._workers.get(worker_id) is asyncio.current_task():
+                del self._workers[worker_id]
+
     async def _monitor_and_download(self):
+        last_reconcile = 0.0
         while self.running:
+            wait_seconds = DOWNLOAD_RECONCILE_INTERVAL
+            # 在读取配置之前清除唤醒标记：本轮处理期间到达的唤醒（request_reconcile / 下载结束）会让下面的等待立即返回
+            self._wake_event.clear()
             try:
                 settings = await self._get_download_settings()
-                if not settings['enabled']:
+                self.resize_workers(settings['threads'])
+                if settings['enabled']:
+                    if self._reconcile_requested or time.monotonic() - last_reconcile >= DOWNLOAD_RECONCILE_INTERVAL:
+                        self._reconcile_requested = False
+                        last_reconcile = time.monotonic()
+                        await self._fetch_and_queue_files_for_download(settings)
+                    else:
+                        # 非对账轮次只补充已到期的重试（走 retrying 部分索引，代价很小）
+                        retry_delay = await self._next_retry_delay(settings)
+                        if retry_delay == 0:
+                            await self._fetch_and_queue_files_for_download(settings)
+
+                    # 下一次唤醒：对账时间与最早重试时间中较早者。
+                    # 刚获取过仍显示已到期（例如超出单次获取上限）时不再按秒轮询，等待对账或下载完成的唤醒
+                    wait_seconds = max(0.0, DOWNLOAD_RECONCILE_INTERVAL - (time.monotonic() - last_reconcile))
+                    retry_delay = await self._next_retry_delay(settings)
+                    if retry_delay:
+                        wait_seconds = min(wait_seconds, retry_delay + 1)
+                else:
+                    # 自动下载关闭时保留对账请求，开启后的第一轮立即对账；这里照常等待唤醒或超时
                     logger.debug("Auto-download is disabled. Waiting...")
-                    await asyncio.sleep(settings.get('polling_interval', 60))
-                    continue
-
-                await self._fetch_and_queue_files_for_download(settings)
-                await self._process_download_queue(settings)
 
             except Exception as e:
                 logger.error("DownloadService _monitor_and_download 过程中出错: %s", e)
 
-            await asyncio.sleep(settings.get('polling_interval', 60)) # Poll every minute by default
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wake_event.wait(), timeout=wait_seconds)
+
+    async def _consume_new_files(self):
+        """消费上传 / Bot 推送的新文件 ID，符合条件的直接加入下载队列，由空闲的工作协程立即处理。"""
+        while self.running:
+            file_id = await new_file_queue.get()
+            try:
+                settings = await self._get_download_settings()
+                if not settings['enabled']:
+                    continue
+                file_info = await file_repo.get(file_id)
+                if not file_info or not self._should_download(file_info, settings):
+                    continue
+                if self._is_scheduled(file_id):
+                    continue
+                self.download_queue.put(file_info)
+                logger.info(f"【下载服务】新文件已加入下载队列。文件名: {file_info['filename']}")
+            except Exception as e:
+                logger.error("【下载服务】处理新文件通知出错。file_id: %s，错误: %s", file_id, e)
+
+    @staticmethod
+    def _should_download(file_info: dict[str, Any], settings: dict[str, Any]) -> bool:
+        """新文件是否满足自动下载条件（与对账查询使用相同的过滤规则）。"""
+        if file_info.get('download_state') != database.DOWNLOAD_STATE_PENDING:
+            return False
+        filesize = file_info.get('filesize') or 0
+        if filesize < settings['min_size'] or filesize > settings['max_size']:
+            return False
+        return 'all' in settings['file_types'] or file_info.get('category') in settings['file_types']
 
     async def _get_download_settings(self) -> dict[str, Any]:
-        # 在线程池中执行同步数据库调用
-        settings = await asyncio.to_thread(database.get_app_settings_from_db)
+        settings = await settings_repo.get()
         return {
             'enabled': settings.get('AUTO_DOWNLOAD_ENABLED', False),
             'download_dir': settings.get('DOWNLOAD_DIR', '/app/downloads'),
@@ -79,325 +292,370 @@ class DownloadService:
             'max_size': settings.get('DOWNLOAD_MAX_SIZE', 10 * 1024 * 1024 * 1024), # Default 10GB
             'min_size': settings.get('DOWNLOAD_MIN_SIZE', 0), # Default 0MB
             'threads': settings.get('DOWNLOAD_THREADS', 3), # Default 3 threads
-            'polling_interval': settings.get('DOWNLOAD_POLLING_INTERVAL', 60), # Default 60 seconds
             'max_retries': settings.get('DOWNLOAD_MAX_RETRIES', 5), # Default 5 retries
         }
 
     async def _fetch_and_queue_files_for_download(self, settings: dict[str, Any]):
         logger.info("【下载服务】正在获取待下载文件...")
-        # 下载服务需要扫描所有文件（包括未下载的），所以使用 local_only=False
-        # 使用 asyncio.to_thread 在线程池中执行同步的数据库调用，避免阻塞事件循环
-        all_files = await asyncio.to_thread(database.get_all_files, local_only=False)
+        # 只向数据库查询到期的文件（待下载 / 到期重试 / 中断的下载），类型与大小过滤也在 SQL 中完成
+        categories = None if 'all' in settings['file_types'] else settings['file_types']
+        due_files = await file_repo.due_for_download(
+            categories=categories,
+            min_size=settings['min_size'],
+            max_size=settings['max_size'],
+        )
 
-        # Filter files that are not yet local and match criteria
         files_to_download = []
-        for file_info in all_files:
-            # Check if already downloaded or currently downloading
-            local_path = file_info.get('local_path')
-            if local_path:
-                # Skip if already downloaded or has a placeholder (downloading/error)
-                if not local_path.startswith('__'):
-                    logger.debug(f"【下载服务】文件已下载，跳过。文件名: {file_info['filename']}")
-                    continue
-                # If placeholder is error marker, we'll skip for now to avoid infinite retries
-                if local_path.startswith('__error_'):
-                    retry_count = file_info.get('retry_count', 0)
-                    last_retry_time_str = file_info.get('last_retry_time')
-
-                    # 使用配置的最大重试次数
-                    max_retries = settings.get('max_retries', 5)
-                    if retry_count >= max_retries:
-                        logger.debug(f"【下载服务】文件已达最大重试次数，跳过。文件名: {file_info['filename']}，重试次数: {retry_count}")
-                        continue
-
-                    # 计算指数退避延迟：30s * (2 ^ retry_count)
-                    # retry_count=0: 30s, 1: 60s, 2: 120s, 3: 240s, 4: 480s
-                    base_delay = 30  # 基础延迟（秒）
-                    delay_seconds = base_delay * (2 ** retry_count)
-
-                    # 检查是否应该重试（距离上次重试已过足够时间）
-                    if last_retry_time_str:
-                        from datetime import datetime, timezone
-                        try:
-                            # SQLite CURRENT_TIMESTAMP 格式为 'YYYY-MM-DD HH:MM:SS'
-                            last_retry_time = datetime.strptime(last_retry_time_str, '%Y-%m-%d %H:%M:%S')
-                            # 假设数据库时间为 UTC（根据实际情况调整）
-                            last_retry_time = last_retry_time.replace(tzinfo=timezone.utc)
-                            elapsed_seconds = (datetime.now(timezone.utc) - last_retry_time).total_seconds()
-
-                            if elapsed_seconds < delay_seconds:
-                                remaining = int(delay_seconds - elapsed_seconds)
-                                logger.debug(f"【下载服务】文件等待重试中。文件名: {file_info['filename']}，重试次数: {retry_count}，剩余等待时间: {remaining}秒")
-                                continue
-                            else:
-                                logger.info(f"【下载服务】文件达到重试时间，将重试。文件名: {file_info['filename']}，重试次数: {retry_count}，延迟: {delay_seconds}秒")
-                        except Exception as e:
-                            logger.error(f"【下载服务】解析重试时间失败。文件名: {file_info['filename']}，错误: {e}")
-                            # 解析失败，立即重试
-                    else:
-                        # 首次失败，立即重试
-                        logger.info(f"【下载服务】文件首次失败，立即重试。文件名: {file_info['filename']}")
-                    # 继续处理，将文件加入下载队列
-                # If placeholder is downloading marker, check if it's stale (>10 minutes)
-                if local_path.startswith('__downloading_'):
-                    import re
-                    import time
-                    match = re.search(r'__downloading_(\d+)', local_path)
-                    if match:
-                        timestamp = int(match.group(1))
-                        if time.time() - timestamp < 600:  # 10 minutes
-                            logger.debug(f"【下载服务】文件正在下载中，跳过。文件名: {file_info['filename']}")
-                            continue
-                        else:
-                            logger.warning(f"【下载服务】检测到陈旧的下载标记，将重试。文件名: {file_info['filename']}")
-
-            # Check file size
-            if file_info['filesize'] > settings['max_size'] or file_info['filesize'] < settings['min_size']:
-                size_mb = file_info['filesize'] / 1024 / 1024
-                max_mb = settings['max_size'] / 1024 / 1024
-                min_mb = settings['min_size'] / 1024 / 1024
-                logger.debug(f"【下载服务】文件大小不符合要求，跳过。文件名: {file_info['filename']}，大小: {size_mb:.2f}MB（范围: {min_mb:.2f}-{max_mb:.2f}MB）")
-                continue
-
-            # Check file type
-            file_category = database._get_file_category_from_mime(file_info.get('mime_type'), file_info.get('filename'))
-            if 'all' not in settings['file_types'] and file_category not in settings['file_types']:
-                logger.debug(f"【下载服务】文件类型不匹配，跳过。文件名: {file_info['filename']}，类型: {file_category}（允许: {','.join(settings['file_types'])}）")
+        for file_info in due_files:
+            if self._is_scheduled(file_info['file_id']):
                 continue
-
-            # Add to queue if not already there
-            if file_info['file_id'] not in [qf['file_id'] for qf in list(self.download_queue._queue)]:
-                files_to_download.append(file_info)
+            status = file_info['download_status']['status']
+            if status == 'retrying':
+                logger.info(f"【下载服务】文件达到重试时间，将重试。文件名: {file_info['filename']}，重试次数: {file_info.get('retry_count', 0)}")
+            elif status == 'downloading':
+                logger.warning(f"【下载服务】检测到中断的下载，将重试。文件名: {file_info['filename']}")
+            files_to_download.append(file_info)
 
         for file_info in files_to_download:
-            await self.download_queue.put(file_info)
+            self.download_queue.put(file_info)
 
         logger.info(f"【下载服务】已排队 {len(files_to_download)} 个文件待下载")
 
 
-    async def _process_download_queue(self, settings: dict[str, Any]):
-        if self.download_queue.empty():
-            logger.debug("Download queue is empty.")
+    async def _resolve_sources(self, file_info: dict[str, Any], total_size: int) -> list[tuple[str, int]]:
+        """
+        解析文件在 Telegram 上的数据来源，返回 [(Telegram file_id, 字节数), ...]。
+        大文件以清单 + 分块形式存储，按分块顺序返回；普通文件只有一个来源。
+        数据库中记录了存储形式（blob_kind）时直接使用，不再探测。
+        """
+        actual_file_id = file_info['file_id'].split(':', 1)[-1]
+        blob_kind = file_info.get('blob_kind')
+        if total_size < CHUNK_SIZE_BYTES or blob_kind == database.BLOB_KIND_SINGLE:
+            return [(actual_file_id, total_size)]
+
+        manifest = await self.telegram_service.get_manifest(
+            actual_file_id, self.http_client, total_size, known_manifest=blob_kind == database.BLOB_KIND_MANIFEST
+        )
+        if manifest is None:
+            return [(actual_file_id, total_size)]
+        # 传入 total_size 后缓存中的分块大小均已知（除最后一块外每块均为 CHUNK_SIZE_BYTES）
+        return [
+            (chunk_id.split(':', 1)[-1], size)
+            for chunk_id, size in zip(manifest["chunk_ids"], manifest["chunk_sizes"], strict=True)
+        ]
+
+    @staticmethod
+    def _final_local_path(file_info: dict[str, Any], download_dir: str) -> str:
+        """最终存放位置：/download_dir/类型/日期/文件名，重名时追加时间戳后缀。"""
+        now = datetime.datetime.now()
+        filename = file_info['filename']
+        file_category = file_info.get('category') or database._get_file_category_from_mime(file_info.get('mime_type'), filename)
+        target_dir = os.path.join(download_dir, file_category, now.strftime("%Y-%m-%d"))
+        local_filepath = os.path.join(target_dir, filename)
+        if os.path.exists(local_filepath):
+            base_name, ext = os.path.splitext(filename)
+            local_filepath = os.path.join(target_dir, f"{base_name}_{now.strftime('%H%M%S')}{ext}")
+        return local_filepath
+
+    @staticmethod
+    def _hardlink(source_path: str, target_path: str) -> None:
+        """以硬链接方式在 target_path 创建 source_path 的副本（先链接到临时路径再原子替换）。"""
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f"{target_path}.link"
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        os.link(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+
+    async def _link_duplicate(self, file_info: dict[str, Any], content_hash: str, download_dir: str, target_path: str) -> bool:
+        """
+        已有内容相同的本地文件时，在 target_path 创建指向它的硬链接，返回是否成功。
+        不支持硬链接（如跨文件系统）或本地副本已不存在时返回 False。
+        """
+        local_copy = await file_repo.get_local_copy(content_hash, file_info['file_id'])
+        if not local_copy:
+            return False
+        source_path = os.path.join(download_dir, local_copy)
+        try:
+            await asyncio.to_thread(self._hardlink, source_path, target_path)
+        except OSError as e:
+            logger.warning(f"【下载服务】创建硬链接失败: {source_path} -> {target_path}，错误: {e}")
+            return False
+        logger.info(f"【下载服务】内容相同的文件已存在，使用硬链接。文件名: {file_info['filename']}，源文件: {local_copy}")
+        return True
+
+    async def _publish_file_update(self, file_id: str) -> None:
+        """广播文件状态更新。"""
+        updated_file = await file_repo.get(file_id)
+        if updated_file:
+            await file_update_queue.publish(json.dumps({
+                "action": "update",
+                **updated_file
+            }))
+
+    @staticmethod
+    def _missing_ranges(sources: list[tuple[str, int]], partial: PartialDownload) -> list[tuple[str, int, int, int]]:
+        """
+        尚未下载的区间，返回 [(Telegram file_id, 文件内偏移, 来源内偏移, 字节数), ...]。
+        区间不跨越来源（分块）边界，下载时再按当前分段大小切分。
+        """
+        ranges = []
+        file_offset = 0
+        for source_id, length in sources:
+            for start, end in partial.missing_ranges(file_offset, file_offset + length):
+                ranges.append((source_id, start, start - file_offset, end - start))
+            file_offset += length
+        return ranges
+
+    @staticmethod
+    def _take_segment(ranges: deque, segment_size: int) -> tuple[str, int, int, int]:
+        """从待下载区间的头部切出一个不超过 segment_size 的分段。"""
+        source_id, file_offset, source_offset, length = ranges.popleft()
+        if length > segment_size:
+            ranges.appendleft((source_id, file_offset + segment_size, source_offset + segment_size, length - segment_size))
+            length = segment_size
+        return source_id, file_offset, source_offset, length
+
+    async def _fetch_segments(
+        self,
+        client: httpx.AsyncClient,
+        partial: PartialDownload,
+        ranges: list[tuple[str, int, int, int]],
+        status: dict[str, Any],
+    ) -> None:
+        """
+        并发下载全部待下载区间；任一分段重试耗尽后取消其余分段并抛出异常（已完成的分段保留，下次跳过）。
+        分段大小与并发数取自下载主机的自适应参数，每个分段完成后重新读取。
+        """
+        if not ranges:
             return
+        accelerator = DownloadAccelerator(client, DOWNLOAD_SEGMENT_CONCURRENCY)
+        pending = deque(ranges)
+        # 同一来源的多个分段共用一次 getFile 得到的下载 URL
+        urls: dict[str, str] = {}
+        tuning = accelerator.tuning_for(await self._segment_url(pending[0][0], urls), DOWNLOAD_SEGMENT_SIZE)
+
+        active: set[asyncio.Task] = set()
+        try:
+            while pending or active:
+                while pending and len(active) < tuning.concurrency:
+                    segment = self._take_segment(pending, tuning.segment_size)
+                    active.add(asyncio.create_task(self._fetch_segment(accelerator, tuning, partial, segment, urls, status)))
+                done, active = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in active:
+                task.cancel()
+            await asyncio.gather(*active, return_exceptions=True)
+
+    async def _segment_url(self, source_id: str, urls: dict[str, str]) -> str:
+        download_url = urls.get(source_id) or await self.telegram_service.get_download_url(source_id)
+        if not download_url:
+            raise Exception("无法获取下载 URL")
+        urls[source_id] = download_url
+        return download_url
+
+    async def _fetch_segment(
+        self,
+        accelerator: DownloadAccelerator,
+        tuning: HostTuning,
+        partial: PartialDownload,
+        segment: tuple[str, int, int, int],
+        urls: dict[str, str],
+        status: dict[str, Any],
+    ) -> None:
+        """
+        下载单个分段并按偏移写入 .part 文件。失败时只重试该分段（指数退避）；
+        明显慢于其他连接时发出对冲请求，两个副本写入相同的偏移与内容，先完成的一个胜出。
+        """
+        source_id, file_offset, source_offset, length = segment
+        # 该分段已写到的最远位置（任一副本 / 任一次尝试），进度只按它计算，避免重复计数
+        reached = 0
+
+        def write(offset: int, data: bytes) -> None:
+            nonlocal reached
+            partial.pwrite(file_offset + offset, data)
+            end = offset + len(data)
+            if end > reached:
+                status['bytes_downloaded'] += end - reached
+                reached = end
+
+        async def attempt() -> None:
+            download_url = await self._segment_url(source_id, urls)
+            try:
+                received = await accelerator.download_range_to_file(download_url, source_offset, source_offset + length - 1, write)
+            except httpx.HTTPStatusError as e:
+                # 链接已失效时丢弃旧链接，下一次尝试重新获取；5xx 等临时错误沿用原链接重试
+                if e.response.status_code in EXPIRED_URL_STATUS_CODES:
+                    urls.pop(source_id, None)
+                    download_url_cache.invalidate(source_id)
+                    raise UrlExpired(f"下载链接已失效（HTTP {e.response.status_code}）") from e
+                raise
+            if received != length:
+                raise Exception(f"分段数据不完整，预期: {length} bytes，实际: {received} bytes")
+
+        try:
+            await accelerator.run_segment(tuning, length, attempt, DOWNLOAD_SEGMENT_RETRIES)
+        except BaseException:
+            # 未完成的分段不计入进度
+            status['bytes_downloaded'] -= reached
+            raise
+        partial.mark_completed(file_offset, file_offset + length)
+
+    async def _download_file(self, file_info: dict[str, Any], settings: dict[str, Any], status: dict[str, Any]):
+        """
+        下载单个文件到本地下载目录，并更新数据库中的下载状态。status 为执行该任务的工作协程状态。
+
+        文件被切分为多个分段（大小与并发数按主机自适应调节），以 HTTP Range 请求并发下载，按偏移直接写入预分配的 .part 文件，
+        不在内存中缓存整个文件；分块存储的大文件按偏移定位到对应分块及块内位置。
+        单个分段失败只重试该分段；失败、超时或服务重启后，下一次尝试跳过已完成的分段继续。
+        """
+        task_id = str(uuid.uuid4())
+        file_id = file_info['file_id']
+        filename = file_info['filename']
+        total_size = file_info.get('filesize', 0)
+        logger.info("尝试下载 %s (ID: %s)", filename, file_id)
+
+        # 在开始下载前先标记为"正在下载"，避免重复排队
+        await file_repo.mark_download_started(file_id)
+        partial = PartialDownload(settings['download_dir'], file_id, total_size)
+
+        try:
+            # 内容哈希已知且本地已有相同内容：直接硬链接，不再下载
+            content_hash = file_info.get('content_hash')
+            if content_hash:
+                local_filepath = self._final_local_path(file_info, settings['download_dir'])
+                if await self._link_duplicate(file_info, content_hash, settings['download_dir'], local_filepath):
+                    await asyncio.to_thread(partial.discard)
+                    await self._complete_download(file_info, settings, task_id, local_filepath)
+                    return
+
+            await progress_event_queue.put({
+                "task_id": task_id, "file_id": file_id, "filename": filename,
+                "total_size": total_size, "status": "starting"
+            })
+
+            sources = await self._resolve_sources(file_info, total_size)
+            resumed_bytes = await asyncio.to_thread(partial.open)
+            if resumed_bytes:
+                logger.info(f"【下载服务】从断点继续下载: {filename}，已完成: {resumed_bytes / 1024 / 1024:.2f}MB / {total_size / 1024 / 1024:.2f}MB")
+            status['bytes_downloaded'] = resumed_bytes
+            missing = self._missing_ranges(sources, partial)
+
+            download_start_time = time.time()
+            client = self.http_client if self.http_client else httpx.AsyncClient(timeout=3600.0)
+            fetch_task = None
+            try:
+                logger.info(f"【下载服务】开始下载文件: {filename}，大小: {total_size / 1024 / 1024:.2f}MB，来源数: {len(sources)}，待下载: {(total_size - resumed_bytes) / 1024 / 1024:.2f}MB")
+                fetch_task = asyncio.create_task(self._fetch_segments(client, partial, missing, status))
+                while not fetch_task.done():
+                    await asyncio.wait({fetch_task}, timeout=1)
+                    # Throttle progress updates to about once per second
+                    await asyncio.to_thread(partial.checkpoint)
+                    downloaded = status['bytes_downloaded']
+                    elapsed = time.time() - download_start_time
+                    speed = (downloaded - resumed_bytes) / elapsed if elapsed > 0 else 0
+                    status['speed'] = speed
+                    logger.debug(f"【下载服务】下载进度: {filename} - {downloaded / total_size * 100 if total_size else 0:.1f}% ({downloaded / 1024 / 1024:.2f}MB / {total_size / 1024 / 1024:.2f}MB) 速度: {speed / 1024 / 1024:.2f}MB/s")
 
-        logger.info("正在处理下载队列，共 %d 个项目...", self.download_queue.qsize())
-
-        # Create a semaphore to limit concurrent downloads
-        semaphore = asyncio.Semaphore(settings['threads'])
-
-        async def download_worker(file_info: dict[str, Any]):
-            task_id = str(uuid.uuid4())
-            async with semaphore:
-                file_id = file_info['file_id']
-                filename = file_info['filename']
-                total_size = file_info.get('filesize', 0)
-                logger.info("尝试下载 %s (ID: %s)", filename, file_id)
-
-                # 在开始下载前先标记为"正在下载"，避免重复排队
-                downloading_marker = f"__downloading_{int(time.time())}"
-                await asyncio.to_thread(database.update_local_path, file_id, downloading_marker)
-
-                try:
-                    # Announce start
-                    await progress_event_queue.put({
-                        "task_id": task_id, "file_id": file_id, "filename": filename,
-                        "total_size": total_size, "status": "starting"
-                    })
-
-                    actual_file_id = file_id.split(':', 1)[-1]
-                    download_url = await self.telegram_service.get_download_url(actual_file_id)
-                    if not download_url:
-                        raise Exception("无法获取下载 URL")
-
-                    # 优化的目录结构：/download_dir/类型/日期/文件名
-                    import datetime
-                    current_time = datetime.datetime.now()
-                    date_str = current_time.strftime("%Y-%m-%d")  # YYYY-MM-DD
-
-                    file_category = database._get_file_category_from_mime(file_info.get('mime_type'), file_info.get('filename'))
-                    target_dir = os.path.join(settings['download_dir'], file_category, date_str)
-                    os.makedirs(target_dir, exist_ok=True)
-
-                    # 处理文件名冲突（添加时间戳后缀）
-                    base_name, ext = os.path.splitext(filename)
-                    local_filepath = os.path.join(target_dir, filename)
-
-                    if os.path.exists(local_filepath):
-                        timestamp_str = current_time.strftime("%H%M%S")
-                        new_filename = f"{base_name}_{timestamp_str}{ext}"
-                        local_filepath = os.path.join(target_dir, new_filename)
-
-                    bytes_downloaded = 0
-                    last_update_time = time.time()
-                    download_start_time = time.time()
-
-                    # 使用共享的 HTTP 客户端，而不是创建新的
-                    client = self.http_client if self.http_client else httpx.AsyncClient(timeout=3600.0)
-                    download_success = False
-                    try:
-                        logger.info(f"【下载服务】开始下载文件: {filename}，大小: {total_size / 1024 / 1024:.2f}MB，URL: {download_url[:100]}...")
-
-                        async with client.stream("GET", download_url) as response:
-                            response.raise_for_status()
-
-                            # 检查响应内容长度
-                            content_length = response.headers.get('content-length')
-                            if content_length:
-                                expected_size = int(content_length)
-                                logger.info(f"【下载服务】服务器返回文件大小: {expected_size / 1024 / 1024:.2f}MB")
-                                if expected_size != total_size:
-                                    logger.warning(f"【下载服务】文件大小不匹配！数据库: {total_size}, 服务器: {expected_size}")
-
-                            with open(local_filepath, "wb") as f:
-                                chunk_count = 0
-                                async for chunk in response.aiter_bytes():
-                                    f.write(chunk)
-                                    bytes_downloaded += len(chunk)
-                                    chunk_count += 1
-
-                                    # Throttle progress updates to about once per second
-                                    current_time = time.time()
-                                    if current_time - last_update_time > 1:
-                                        elapsed = current_time - download_start_time
-                                        speed = bytes_downloaded / elapsed / 1024 / 1024  # MB/s
-                                        progress_pct = (bytes_downloaded / total_size * 100) if total_size > 0 else 0
-
-                                        logger.debug(f"【下载服务】下载进度: {filename} - {progress_pct:.1f}% ({bytes_downloaded / 1024 / 1024:.2f}MB / {total_size / 1024 / 1024:.2f}MB) 速度: {speed:.2f}MB/s")
-
-                                        await progress_event_queue.put({
-                                            "task_id": task_id, "file_id": file_id, "status": "downloading",
-                                            "downloaded": bytes_downloaded, "total_size": total_size, "progress": (bytes_downloaded / total_size) if total_size > 0 else 0
-                                        })
-                                        last_update_time = current_time
-
-                        download_success = True
-                        elapsed_total = time.time() - download_start_time
-                        avg_speed = bytes_downloaded / elapsed_total / 1024 / 1024 if elapsed_total > 0 else 0
-                        logger.info(f"【下载服务】文件下载完成: {filename}，耗时: {elapsed_total:.1f}秒，平均速度: {avg_speed:.2f}MB/s，总块数: {chunk_count}")
-
-                    except httpx.TimeoutException as e:
-                        elapsed = time.time() - download_start_time
-                        logger.error(f"【下载服务】下载超时: {filename}，已下载: {bytes_downloaded / 1024 / 1024:.2f}MB / {total_size / 1024 / 1024:.2f}MB，耗时: {elapsed:.1f}秒，错误: {e}")
-                        raise Exception(f"下载超时（{elapsed:.0f}秒）: {e}")
-                    except httpx.HTTPStatusError as e:
-                        logger.error(f"【下载服务】HTTP错误: {filename}，状态码: {e.response.status_code}，错误: {e}")
-                        raise Exception(f"HTTP错误 {e.response.status_code}: {e}")
-                    except Exception as e:
-                        elapsed = time.time() - download_start_time
-                        logger.error(f"【下载服务】下载异常: {filename}，已下载: {bytes_downloaded / 1024 / 1024:.2f}MB，耗时: {elapsed:.1f}秒，错误类型: {type(e).__name__}，详情: {e}")
-                        raise
-                    finally:
-                        # 如果使用了临时客户端，需要关闭它
-                        if not self.http_client and client:
-                            await client.aclose()
-
-                    # 检查下载是否完整
-                    if download_success and os.path.exists(local_filepath):
-                        actual_file_size = os.path.getsize(local_filepath)
-                        if actual_file_size != total_size:
-                            logger.warning(f"【下载服务】文件大小不匹配，标记为错误。文件名: {filename}，预期: {total_size} bytes，实际: {actual_file_size} bytes")
-                            # 标记为错误状态，并增加重试计数
-                            await asyncio.to_thread(database.update_local_path, file_id, f"__error_size_mismatch")
-                            await asyncio.to_thread(database.increment_retry_count, file_id)
-                            await progress_event_queue.put({
-                                "task_id": task_id, "file_id": file_id, "filename": filename,
-                                "status": "error", "error": "文件大小不匹配"
-                            })
-                            # 删除不完整的文件
-                            if os.path.exists(local_filepath):
-                                os.remove(local_filepath)
-
-                            # 广播文件状态更新
-                            updated_file = await asyncio.to_thread(database.get_file_by_id, file_id)
-                            if updated_file:
-                                await file_update_queue.publish(json.dumps({
-                                    "action": "update",
-                                    **updated_file
-                                }))
-                        else:
-                            relative_local_path = os.path.relpath(local_filepath, start=settings['download_dir'])
-                            result = await asyncio.to_thread(database.update_local_path, file_id, relative_local_path)
-                            if result:
-                                logger.info(f"【下载服务】文件下载完成。文件名: {filename}，路径: {relative_local_path}")
-                                await progress_event_queue.put({
-                                    "task_id": task_id, "file_id": file_id, "filename": filename,
-                                    "status": "completed"
-                                })
-
-                                # 广播文件状态更新
-                                updated_file = await asyncio.to_thread(database.get_file_by_id, file_id)
-                                if updated_file:
-                                    await file_update_queue.publish(json.dumps({
-                                        "action": "update",
-                                        **updated_file
-                                    }))
-                            else:
-                                logger.error(f"【下载服务】数据库更新失败，标记为错误。文件名: {filename}，file_id: {file_id}")
-                                await asyncio.to_thread(database.update_local_path, file_id, f"__error_db_update")
-                                await asyncio.to_thread(database.increment_retry_count, file_id)
-                                await progress_event_queue.put({
-                                    "task_id": task_id, "file_id": file_id, "filename": filename,
-                                    "status": "error", "error": "数据库更新失败"
-                                })
-
-                                # 广播文件状态更新
-                                updated_file = await asyncio.to_thread(database.get_file_by_id, file_id)
-                                if updated_file:
-                                    await file_update_queue.publish(json.dumps({
-                                        "action": "update",
-                                        **updated_file
-                                    }))
-                    else:
-                        logger.error(f"【下载服务】文件下载失败，标记为错误。文件名: {filename}，路径: {local_filepath}")
-                        await asyncio.to_thread(database.update_local_path, file_id, f"__error_download_failed")
-                        await asyncio.to_thread(database.increment_retry_count, file_id)
-                        await progress_event_queue.put({
-                            "task_id": task_id, "file_id": file_id, "filename": filename,
-                            "status": "error", "error": "文件下载失败或不存在"
-                        })
-                        # 清理可能存在的不完整文件
-                        if os.path.exists(local_filepath):
-                            os.remove(local_filepath)
-
-                        # 广播文件状态更新
-                        updated_file = await asyncio.to_thread(database.get_file_by_id, file_id)
-                        if updated_file:
-                            await file_update_queue.publish(json.dumps({
-                                "action": "update",
-                                **updated_file
-                            }))
-
-                except Exception as e:
-                    logger.error("下载文件 %s (ID: %s) 失败: %s", filename, file_id, e)
-                    # 标记为错误，并增加重试计数
-                    await asyncio.to_thread(database.update_local_path, file_id, f"__error_exception")
-                    await asyncio.to_thread(database.increment_retry_count, file_id)
                     await progress_event_queue.put({
-                        "task_id": task_id, "file_id": file_id, "filename": filename,
-                        "status": "error", "error": str(e)
+                        "task_id": task_id, "file_id": file_id, "status": "downloading",
+                        "downloaded": downloaded, "total_size": total_size, "progress": (downloaded / total_size) if total_size > 0 else 0
                     })
-                    # 清理可能存在的不完整文件
-                    if 'local_filepath' in locals() and os.path.exists(local_filepath):
-                        try:
-                            os.remove(local_filepath)
-                        except Exception:
-                            pass
-
-                    # 广播文件状态更新
-                    updated_file = await asyncio.to_thread(database.get_file_by_id, file_id)
-                    if updated_file:
-                        await file_update_queue.publish(json.dumps({
-                            "action": "update",
-                            **updated_file
-                        }))
-
-        tasks = []
-        while not self.download_queue.empty():
-            file_info = await self.download_queue.get()
-            tasks.append(download_worker(file_info))
-
-        await asyncio.gather(*tasks)
-        logger.info("下载队列处理完毕。")
+                fetch_task.result()
+
+                elapsed_total = time.time() - download_start_time
+                avg_speed = (status['bytes_downloaded'] - resumed_bytes) / elapsed_total / 1024 / 1024 if elapsed_total > 0 else 0
+                logger.info(f"【下载服务】文件下载完成: {filename}，耗时: {elapsed_total:.1f}秒，平均速度: {avg_speed:.2f}MB/s")
+
+            except httpx.TimeoutException as e:
+                elapsed = time.time() - download_start_time
+                logger.error(f"【下载服务】下载超时: {filename}，已下载: {status['bytes_downloaded'] / 1024 / 1024:.2f}MB / {total_size / 1024 / 1024:.2f}MB，耗时: {elapsed:.1f}秒，错误: {e}")
+                raise Exception(f"下载超时（{elapsed:.0f}秒）: {e}") from e
+            except httpx.HTTPStatusError as e:
+                logger.error(f"【下载服务】HTTP错误: {filename}，状态码: {e.response.status_code}，错误: {e}")
+                raise Exception(f"HTTP错误 {e.response.status_code}: {e}") from e
+            finally:
+                if fetch_task and not fetch_task.done():
+                    fetch_task.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await fetch_task
+                # 如果使用了临时客户端，需要关闭它
+                if not self.http_client and client:
+                    await client.aclose()
+            # 校验大小后原子地移动到最终位置
+            local_filepath = self._final_local_path(file_info, settings['download_dir'])
+            try:
+                await asyncio.to_thread(partial.finalize, local_filepath)
+            except ValueError as e:
+                logger.warning(f"【下载服务】{e}，标记为错误。文件名: {filename}")
+                await file_repo.mark_download_failed(file_id, settings['max_retries'])
+                await progress_event_queue.put({
+                    "task_id": task_id, "file_id": file_id, "filename": filename,
+                    "status": "error", "error": "文件大小不匹配"
+                })
+                await self._publish_file_update(file_id)
+                return
+
+            # 计算内容哈希；本地已有相同内容时换成指向它的硬链接，只保留一份数据
+            actual_hash = await asyncio.to_thread(file_sha256, local_filepath)
+            if content_hash and content_hash != actual_hash:
+                logger.warning(f"【下载服务】内容哈希与记录不一致，以下载结果为准。文件名: {filename}")
+            if actual_hash != content_hash:
+                await file_repo.update_content_hash(file_id, actual_hash)
+            await self._link_duplicate(file_info, actual_hash, settings['download_dir'], local_filepath)
+            await self._complete_download(file_info, settings, task_id, local_filepath)
+
+        except asyncio.CancelledError:
+            # 服务停止或工作协程被回收：保留 .part 以便续传，文件回到待下载状态，下次启动后重新调度
+            partial.close()
+            await file_repo.clear_local_path(file_id)
+            raise
+        except Exception as e:
+            logger.error("下载文件 %s (ID: %s) 失败: %s", filename, file_id, e)
+            # 保留已下载的部分，下次重试从断点继续；不再重试时删除
+            with contextlib.suppress(Exception):
+                await asyncio.to_thread(partial.close)
+            if await file_repo.mark_download_failed(file_id, settings['max_retries']) == database.DOWNLOAD_STATE_FAILED:
+                with contextlib.suppress(Exception):
+                    await asyncio.to_thread(partial.discard)
+            await progress_event_queue.put({
+                "task_id": task_id, "file_id": file_id, "filename": filename,
+                "status": "error", "error": str(e)
+            })
+            await self._publish_file_update(file_id)
+
+    async def _complete_download(
+        self, file_info: dict[str, Any], settings: dict[str, Any], task_id: str, local_filepath: str
+    ) -> None:
+        """记录本地路径并广播完成事件；数据库更新失败时删除本地文件并标记为错误。"""
+        file_id = file_info['file_id']
+        filename = file_info['filename']
+        relative_local_path = os.path.relpath(local_filepath, start=settings['download_dir'])
+        if await file_repo.update_local_path(file_id, relative_local_path):
+            logger.info(f"【下载服务】文件下载完成。文件名: {filename}，路径: {relative_local_path}")
+            await progress_event_queue.put({
+                "task_id": task_id, "file_id": file_id, "filename": filename,
+                "status": "completed"
+            })
+        else:
+            logger.error(f"【下载服务】数据库更新失败，标记为错误。文件名: {filename}，file_id: {file_id}")
+            with contextlib.suppress(OSError):
+                os.remove(local_filepath)
+            await file_repo.mark_download_failed(file_id, settings['max_retries'])
+            await progress_event_queue.put({
+                "task_id": task_id, "file_id": file_id, "filename": filename,
+                "status": "error", "error": "数据库更新失败"
+            })
+        await self._publish_file_update(file_id)
+
+
+async def discard_partial_download(file_id: str) -> None:
+    """删除文件未完成的 .part 数据（文件记录被删除时调用）。"""
+    download_dir = (await settings_repo.get()).get('DOWNLOAD_DIR', '/app/downloads')
+    with contextlib.suppress(OSError):
+        await asyncio.to_thread(PartialDownload(download_dir, file_id, 0).discard)
 
 
 async def get_download_service(telegram_service: TelegramService = None, http_client: httpx.AsyncClient = None) -> DownloadService:
@@ -0,0 +1,134 @@
+"""
+Telegram 下载链接缓存。
+
+getFile 返回的临时下载链接按 file_id 缓存 DOWNLOAD_URL_CACHE_TTL 秒，最多保留 DOWNLOAD_URL_CACHE_SIZE 个（LRU 淘汰），
+过期条目由后台任务定期清理。同一 file_id 的并发未命中合并为一次 getFile 请求（single-flight）。
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from ..core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# 缓存的下载链接数量上限
+DOWNLOAD_URL_CACHE_SIZE = int(os.getenv("DOWNLOAD_URL_CACHE_SIZE", "4096"))
+# 下载链接缓存时间（秒）；Telegram 保证链接至少 1 小时内有效
+DOWNLOAD_URL_CACHE_TTL = int(os.getenv("DOWNLOAD_URL_CACHE_TTL", "300"))
+
+
+class DownloadUrlCache:
+    """带过期时间的 LRU 缓存，并合并同一 file_id 的并发解析。"""
+
+    def __init__(self, max_entries: int = DOWNLOAD_URL_CACHE_SIZE, ttl: float = DOWNLOAD_URL_CACHE_TTL):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._sweeper: asyncio.Task | None = None
+
+    async def get(self, file_id: str, resolve: Callable[[], Awaitable[str | None]]) -> str | None:
+        """
+        返回 file_id 的下载链接；未命中时调用 resolve() 获取并缓存（结果为 None 时不缓存）。
+        已有同一 file_id 的解析在进行时直接等待其结果。调用方被取消不会中断共享的解析。
+        """
+        entry = self._entries.get(file_id)
+        if entry is not None:
+            url, expires_at = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(file_id)
+                self.hits += 1
+                return url
+            del self._entries[file_id]
+            self.expirations += 1
+
+        task = self._inflight.get(file_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(resolve())
+            self._inflight[file_id] = task
+            task.add_done_callback(lambda t: self._resolved(file_id, t))
+        return await asyncio.shield(task)
+
+    def invalidate(self, file_id: str) -> None:
+        """丢弃 file_id 的缓存链接（例如请求返回 403 / 404，链接已失效），下一次 get() 重新解析。"""
+        self._entries.pop(file_id, None)
+
+    def clear(self) -> None:
+        """丢弃全部链接（例如 BOT_TOKEN 变更，链接中包含旧 token）；进行中的解析结果也不再写入缓存。"""
+        self._entries.clear()
+        self._inflight.clear()
+
+    def purge_expired(self) -> int:
+        """删除所有已过期的条目，返回删除数量。"""
+        now = time.monotonic()
+        expired = [file_id for file_id, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for file_id in expired:
+            del self._entries[file_id]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def start(self) -> None:
+        """启动后台过期清理任务（需在事件循环中调用）。"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._sweeper
+        self._sweeper = None
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _resolved(self, file_id: str, task: asyncio.Task) -> None:
+        if self._inflight.get(file_id) is not task:
+            # clear() 之后完成的旧解析
+            return
+        del self._inflight[file_id]
+        if task.cancelled() or task.exception() is not None:
+            return
+        url = task.result()
+        if not url:
+            return
+        self._entries[file_id] = (url, time.monotonic() + self.ttl)
+        self._entries.move_to_end(file_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _sweep(self) -> None:
+        interval = max(1.0, self.ttl / 2)
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.purge_expired()
+            if removed:
+                logger.debug(f"【下载链接缓存】已清理 {removed} 个过期链接，剩余: {len(self._entries)}")
+
+
+download_url_cache = DownloadUrlCache()
@@ -0,0 +1,84 @@
+"""
+分块文件清单缓存。
+
+清单按清单文件的 Telegram file_id 缓存为 {"filename", "chunk_ids", "chunk_sizes"}：
+内存中保留最近使用的 MANIFEST_CACHE_SIZE 个，全部清单持久化在 SQLite（manifests / manifest_chunks 表）中，
+上传分块文件时写入，其余情况在第一次读取清单时写入。命中缓存时无需再下载、解析清单。
+"""
+
+import os
+from collections import OrderedDict
+
+from ..core.logging_config import get_logger
+from ..repository import manifest_repo
+
+logger = get_logger(__name__)
+
+# 内存中缓存的清单数量上限
+MANIFEST_CACHE_SIZE = int(os.getenv("MANIFEST_CACHE_SIZE", "1024"))
+
+
+def chunk_sizes_for(total_size: int | None, chunk_count: int, chunk_size: int) -> list[int | None]:
+    """根据文件总大小推算各分块大小（除最后一块外均为 chunk_size）；总大小未知时返回 None 列表。"""
+    if not total_size or chunk_count <= 0:
+        return [None] * chunk_count
+    return [chunk_size] * (chunk_count - 1) + [total_size - chunk_size * (chunk_count - 1)]
+
+
+class ManifestCache:
+    """内存 LRU + SQLite 的两级清单缓存。"""
+
+    def __init__(self, max_entries: int = MANIFEST_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+
+    async def get(self, manifest_id: str) -> dict | None:
+        """读取缓存的清单；内存未命中时查询数据库。"""
+        entry = self._entries.get(manifest_id)
+        if entry is not None:
+            self._entries.move_to_end(manifest_id)
+            return entry
+        try:
+            entry = await manifest_repo.get(manifest_id)
+        except Exception as e:
+            logger.warning(f"【清单缓存】读取清单缓存失败。manifest_id: {manifest_id[:20]}...，错误: {e}")
+            return None
+        if entry is not None:
+            self._remember(manifest_id, entry)
+        return entry
+
+    async def put(
+        self,
+        manifest_id: str,
+        filename: str,
+        chunk_ids: list[str],
+        chunk_sizes: list[int | None] | None = None,
+    ) -> dict:
+        """写入（覆盖）清单；持久化失败只记录日志，不影响调用方。"""
+        entry = {
+            "filename": filename,
+            "chunk_ids": list(chunk_ids),
+            "chunk_sizes": list(chunk_sizes) if chunk_sizes is not None else [None] * len(chunk_ids),
+        }
+        self._remember(manifest_id, entry)
+        try:
+            await manifest_repo.save(manifest_id, filename, entry["chunk_ids"], entry["chunk_sizes"])
+        except Exception as e:
+            logger.warning(f"【清单缓存】保存清单缓存失败。manifest_id: {manifest_id[:20]}...，错误: {e}")
+        return entry
+
+    async def delete(self, manifest_id: str) -> None:
+        self._entries.pop(manifest_id, None)
+        try:
+            await manifest_repo.delete(manifest_id)
+        except Exception as e:
+            logger.warning(f"【清单缓存】删除清单缓存失败。manifest_id: {manifest_id[:20]}...，错误: {e}")
+
+    def _remember(self, manifest_id: str, entry: dict) -> None:
+        self._entries[manifest_id] = entry
+        self._entries.move_to_end(manifest_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+manifest_cache = ManifestCache()
@@ -0,0 +1,205 @@
+"""
+可续传的本地下载文件。
+
+下载内容先写入下载目录下 .partial/ 中的 .part 文件（预分配为完整大小，各分段按偏移写入），
+并在旁边维护一个 JSON 进度记录（sidecar），记录已经落盘的字节区间。
+重试或进程重启后跳过已完成的区间继续下载；只有在全部区间完成且大小校验通过后才原子地重命名到最终位置。
+"""
+
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import time
+
+# 未完成文件的存放目录（位于下载目录内，保证与最终位置在同一文件系统，os.replace 为原子操作）
+PARTIAL_DIR_NAME = ".partial"
+
+
+def sweep_stale_partials(download_dir: str, max_age_seconds: float) -> int:
+    """
+    删除超过 max_age_seconds 没有写入的 .part 文件及其进度记录，返回删除的文件数。
+    同一个文件的 .part 与 .json 按两者中较新的修改时间判断。
+    """
+    directory = os.path.join(download_dir, PARTIAL_DIR_NAME)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    groups: dict[str, list[str]] = {}
+    for name in names:
+        key = name.split(".", 1)[0]
+        groups.setdefault(key, []).append(os.path.join(directory, name))
+
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for paths in groups.values():
+        try:
+            newest = max(os.path.getmtime(path) for path in paths)
+        except OSError:
+            continue
+        if newest >= cutoff:
+            continue
+        for path in paths:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """合并重叠 / 相邻的半开区间 [start, end)。"""
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class PartialDownload:
+    """一个文件的 .part 数据文件与进度记录。"""
+
+    def __init__(self, download_dir: str, file_id: str, total_size: int):
+        key = hashlib.sha1(file_id.encode("utf-8")).hexdigest()
+        self.directory = os.path.join(download_dir, PARTIAL_DIR_NAME)
+        self.part_path = os.path.join(self.directory, f"{key}.part")
+        self.meta_path = f"{self.part_path}.json"
+        self.file_id = file_id
+        self.total_size = total_size
+        self.completed: list[tuple[int, int]] = []
+        self._fd: int | None = None
+
+    @property
+    def completed_bytes(self) -> int:
+        return sum(end - start for start, end in self.completed)
+
+    def open(self) -> int:
+        """
+        打开（或恢复）.part 文件并预分配到完整大小，返回已完成的字节数。
+        进度记录与当前文件不匹配（file_id / 大小变化、缺少已完成区间）时从头开始。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        completed: list[tuple[int, int]] = []
+        meta = self._read_meta()
+        if (
+            meta
+            and meta.get("file_id") == self.file_id
+            and meta.get("total_size") == self.total_size
+            and "completed" in meta
+            and os.path.exists(self.part_path)
+        ):
+            completed = [(int(start), int(end)) for start, end in meta["completed"]]
+
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not completed:
+            os.ftruncate(self._fd, 0)
+        self._preallocate()
+        self.completed = _merge_ranges([(max(0, s), min(self.total_size, e)) for s, e in completed])
+        self._write_meta(self.completed)
+        return self.completed_bytes
+
+    def missing_ranges(self, start: int, end: int) -> list[tuple[int, int]]:
+        """区间 [start, end) 中尚未完成的部分。"""
+        missing = []
+        cursor = start
+        for s, e in self.completed:
+            if e <= cursor or s >= end:
+                continue
+            if s > cursor:
+                missing.append((cursor, s))
+            cursor = max(cursor, e)
+        if cursor < end:
+            missing.append((cursor, end))
+        return missing
+
+    def pwrite(self, offset: int, data: bytes) -> None:
+        """在指定偏移写入数据（不移动文件指针，可供多个分段并发调用）。"""
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def mark_completed(self, start: int, end: int) -> None:
+        """标记区间 [start, end) 已写入；下一次 checkpoint 后才会写入进度记录。"""
+        self.completed = _merge_ranges([*self.completed, (start, end)])
+
+    def checkpoint(self) -> None:
+        """将已写入的数据刷到磁盘并更新进度记录（阻塞调用，可放到线程中执行）。"""
+        if self._fd is None:
+            return
+        # 先取快照再 fsync：快照中的区间在标记前已全部写入，fsync 之后即可安全记录
+        completed = list(self.completed)
+        os.fsync(self._fd)
+        self._write_meta(completed)
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def finalize(self, final_path: str) -> None:
+        """
+        校验完整性后将 .part 原子地移动到最终位置，并删除进度记录。
+
+        Raises:
+            ValueError: 仍有未下载的区间或文件大小与预期不一致（此时 .part 会被丢弃）
+        """
+        self.close()
+        actual_size = os.path.getsize(self.part_path)
+        if actual_size != self.total_size or (self.total_size and self.completed != [(0, self.total_size)]):
+            completed_bytes = self.completed_bytes
+            self.discard()
+            raise ValueError(
+                f"文件大小不匹配，预期: {self.total_size} bytes，实际: {actual_size} bytes，已完成: {completed_bytes} bytes"
+            )
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(self.part_path, final_path)
+        with contextlib.suppress(OSError):
+            os.remove(self.meta_path)
+
+    def discard(self) -> None:
+        """删除 .part 文件及进度记录。"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        for path in (self.part_path, self.meta_path):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def _preallocate(self) -> None:
+        """预分配完整大小，避免并发写入时文件碎片化，也能尽早发现磁盘空间不足。"""
+        if os.fstat(self._fd).st_size >= self.total_size:
+            os.ftruncate(self._fd, self.total_size)
+            return
+        if hasattr(os, "posix_fallocate") and self.total_size:
+            try:
+                os.posix_fallocate(self._fd, 0, self.total_size)
+                return
+            except OSError as e:
+                # 部分文件系统不支持 fallocate，退化为稀疏文件；空间不足则直接抛出
+                if e.errno == errno.ENOSPC:
+                    raise
+        os.ftruncate(self._fd, self.total_size)
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, completed: list[tuple[int, int]]) -> None:
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"file_id": self.file_id, "total_size": self.total_size, "completed": completed}, f)
+        os.replace(tmp_path, self.meta_path)
@@ -0,0 +1,168 @@
+"""
+Telegram Bot API 调用限速。
+
+所有 Bot API 调用共享一组令牌桶：全局桶、按方法的桶，以及按会话（chat）的发送桶。
+调用前按各桶的预约时间排队等待；Telegram 返回 RetryAfter（flood wait）时，相关的桶在提示时间内暂停发放令牌，
+然后自动重试，不再直接失败。
+"""
+
+import asyncio
+import os
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+import telegram
+
+from ..core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# 全局每秒请求数（Telegram 建议单个 Bot 不超过 30 次/秒）
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+# 向同一个群组 / 频道发送消息的速率（Telegram 限制约 20 条/分钟），突发上限为一分钟的额度
+TELEGRAM_CHAT_SEND_PER_MINUTE = float(os.getenv("TELEGRAM_CHAT_SEND_PER_MINUTE", "20"))
+# 遇到 RetryAfter 后最多自动重试的次数
+TELEGRAM_FLOOD_RETRIES = int(os.getenv("TELEGRAM_FLOOD_RETRIES", "5"))
+
+# 按方法的限速：(每秒令牌数, 突发上限)
+METHOD_LIMITS: dict[str, tuple[float, float]] = {
+    "get_file": (20.0, 40.0),
+    "delete_message": (10.0, 20.0),
+}
+# 受按会话发送限速约束的方法
+CHAT_SEND_METHODS = frozenset({"send_document", "send_message", "send_photo"})
+
+
+class TokenBucket:
+    """
+    令牌桶。acquire 采用预约方式：令牌不足时直接透支并返回需要等待的时间，
+    排在后面的调用依次顺延，因此无需加锁即可保证先来先得。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """取走一个令牌，返回需要等待的秒数（0 表示立即可用）。"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """在 seconds 秒内不再发放令牌（服务端要求等待时使用）。"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class TelegramRateLimiter:
+    """按全局 / 方法 / 会话三级令牌桶调度 Bot API 调用，并在 flood wait 后自动重试。"""
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_send_per_minute: float = TELEGRAM_CHAT_SEND_PER_MINUTE,
+        flood_retries: int = TELEGRAM_FLOOD_RETRIES,
+        method_limits: dict[str, tuple[float, float]] | None = None,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_send_per_minute = chat_send_per_minute
+        self.flood_retries = flood_retries
+        self.method_limits = METHOD_LIMITS if method_limits is None else method_limits
+        self._method_buckets: dict[str, TokenBucket] = {}
+        self._chat_buckets: dict[str, TokenBucket] = {}
+        self.calls: dict[str, int] = {}
+        self.throttled_calls = 0
+        self.throttled_seconds = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.flood_failures = 0
+
+    async def call(self, method: str, func: Callable[..., Awaitable[T]], /, **kwargs: Any) -> T:
+        """
+        在限速下调用 func(**kwargs)。kwargs 中的 chat_id 用于按会话限速。
+
+        Raises:
+            telegram.error.RetryAfter: 连续 flood wait 超过 flood_retries 次
+            其他异常原样抛出
+        """
+        buckets = self._buckets_for(method, kwargs.get("chat_id"))
+        # 待上传的文件对象在重试前需要回到初始位置
+        positions = {key: value.tell() for key, value in kwargs.items() if hasattr(value, "seek") and hasattr(value, "tell")}
+        attempt = 0
+        while True:
+            await self._acquire(buckets)
+            self.calls[method] = self.calls.get(method, 0) + 1
+            try:
+                return await func(**kwargs)
+            except telegram.error.RetryAfter as e:
+                attempt += 1
+                retry_after = _seconds(e.retry_after)
+                self.flood_waits += 1
+                self.flood_wait_seconds += retry_after
+                if attempt > self.flood_retries:
+                    self.flood_failures += 1
+                    raise
+                logger.warning(
+                    f"【Telegram限速】{method} 触发 flood wait，{retry_after:.0f} 秒后第 {attempt} 次重试。"
+                )
+                # 同一范围内的其他调用也一起等待，避免继续触发限流
+                for bucket in buckets:
+                    bucket.pause(retry_after)
+                for key, position in positions.items():
+                    kwargs[key].seek(position)
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "throttled_calls": self.throttled_calls,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": round(self.flood_wait_seconds, 3),
+            "flood_failures": self.flood_failures,
+        }
+
+    def _buckets_for(self, method: str, chat_id: Any) -> list[TokenBucket]:
+        buckets = [self.global_bucket]
+        limit = self.method_limits.get(method)
+        if limit:
+            bucket = self._method_buckets.get(method)
+            if bucket is None:
+                bucket = self._method_buckets[method] = TokenBucket(*limit)
+            buckets.append(bucket)
+        if chat_id is not None and method in CHAT_SEND_METHODS:
+            key = str(chat_id)
+            bucket = self._chat_buckets.get(key)
+            if bucket is None:
+                bucket = self._chat_buckets[key] = TokenBucket(
+                    self.chat_send_per_minute / 60, self.chat_send_per_minute
+                )
+            buckets.append(bucket)
+        return buckets
+
+    async def _acquire(self, buckets: list[TokenBucket]) -> None:
+        delay = max(bucket.reserve() for bucket in buckets)
+        if delay > 0:
+            self.throttled_calls += 1
+            self.throttled_seconds += delay
+            await asyncio.sleep(delay)
+
+
+def _seconds(retry_after: Any) -> float:
+    """RetryAfter.retry_after 在不同版本中为整数秒或 timedelta。"""
+    total_seconds = getattr(retry_after, "total_seconds", None)
+    return float(total_seconds() if total_seconds else retry_after)
+
+
+# 所有 Bot API 调用共享的限速器
+telegram_rate_limiter = TelegramRateLimiter()
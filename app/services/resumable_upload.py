@@ -0,0 +1,271 @@
+"""
+可续传上传（参照 tus 协议）。
+
+客户端先创建上传会话，然后按偏移追加数据（可随时中断，查询当前偏移后继续），最后提交完成。
+服务端按 CHUNK_SIZE_BYTES 切分：每凑满一个分块立即上传到 Telegram 并记录到 SQLite，之后续传不会重复发送；
+不足一个分块的尾部数据暂存在 DATA_DIR/uploads/<upload_id>.spool 中。
+
+数据按顺序到达，服务端边接收边计算 SHA-256，提交时登记内容哈希（相同内容已存在时返回已有文件并删除已发送的分块）。
+哈希状态只保存在内存中：会话跨越进程重启、或暂存数据丢失导致偏移回退时无法得到完整的哈希，该文件登记时不带内容哈希。
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import os
+import uuid
+from collections.abc import AsyncIterator
+from typing import Any
+
+from .. import database
+from ..core.logging_config import get_logger
+from ..repository import upload_session_repo
+from .telegram_service import CHUNK_SIZE_BYTES, TelegramService
+
+logger = get_logger(__name__)
+
+# 尾部数据暂存目录
+UPLOAD_SPOOL_DIR = os.path.join(database.DATA_DIR, "uploads")
+# 超过该时间（小时）没有更新的上传会话会被清理
+RESUMABLE_UPLOAD_TTL_HOURS = int(os.getenv("RESUMABLE_UPLOAD_TTL_HOURS", "24"))
+
+
+class UploadSessionError(Exception):
+    """上传会话请求无法处理（携带 HTTP 状态码与错误码，由 API 层转换为响应）。"""
+
+    def __init__(self, status_code: int, message: str, code: str, offset: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.code = code
+        self.offset = offset
+
+
+class ResumableUploads:
+    """可续传上传会话管理。同一会话同时只允许一个追加 / 提交请求。"""
+
+    def __init__(self, spool_dir: str = UPLOAD_SPOOL_DIR):
+        self.spool_dir = spool_dir
+        self._busy: set[str] = set()
+        # upload_id -> (已接收数据的增量 SHA-256, 已计入哈希的字节数)
+        self._hashes: dict[str, tuple[Any, int]] = {}
+
+    async def create(self, filename: str, total_size: int, telegram_service: TelegramService | None = None) -> dict:
+        if not filename:
+            raise UploadSessionError(400, "缺少文件名。", "invalid_upload")
+        if total_size <= 0:
+            raise UploadSessionError(400, "文件大小必须大于 0。", "invalid_upload")
+        await self.cleanup_stale(telegram_service)
+        upload_id = uuid.uuid4().hex
+        await upload_session_repo.create(upload_id, filename, total_size)
+        return await self.status(upload_id)
+
+    async def status(self, upload_id: str) -> dict:
+        session = await upload_session_repo.get(upload_id)
+        if session is None:
+            raise UploadSessionError(404, "上传会话不存在或已过期。", "upload_not_found")
+        return session
+
+    async def append(
+        self, upload_id: str, offset: int, stream: AsyncIterator[bytes], telegram_service: TelegramService
+    ) -> int:
+        """
+        从 offset 开始追加数据，返回追加后的偏移。
+        凑满的分块立即上传到 Telegram；请求中断时已收到的数据同样保留，客户端可从返回（或查询到）的偏移继续。
+        """
+        async with self._exclusive(upload_id):
+            session = await self.status(upload_id)
+            if session["short_id"]:
+                raise UploadSessionError(409, "上传已完成。", "upload_completed", session["received_bytes"])
+            if offset != session["received_bytes"]:
+                raise UploadSessionError(409, "偏移与服务端不一致。", "offset_mismatch", session["received_bytes"])
+
+            state = {"chunk_index": len(session["chunk_ids"]), "first_message_id": session["first_message_id"]}
+            tail_length = offset - state["chunk_index"] * CHUNK_SIZE_BYTES
+            buffer = bytearray(await asyncio.to_thread(self._read_spool, upload_id, tail_length))
+            if len(buffer) != tail_length:
+                # 暂存数据丢失（例如数据目录被清理）：回退到实际保存的位置，由客户端从该偏移重传
+                received = state["chunk_index"] * CHUNK_SIZE_BYTES + len(buffer)
+                await upload_session_repo.update_progress(upload_id, received)
+                raise UploadSessionError(409, "暂存数据不完整，请从服务端偏移继续。", "offset_mismatch", received)
+
+            received = offset
+            content_hash = self._take_hash(upload_id, offset)
+            try:
+                await self._flush_chunks(telegram_service, session, state, buffer)
+                async for data in stream:
+                    if received + len(data) > session["total_size"]:
+                        raise UploadSessionError(413, "数据超出声明的文件大小。", "upload_too_large", received)
+                    buffer += data
+                    received += len(data)
+                    if content_hash is not None:
+                        content_hash.update(data)
+                    await self._flush_chunks(telegram_service, session, state, buffer)
+            finally:
+                # 无论请求是否完整，都保存已收到的尾部数据，之后可从该偏移继续
+                await asyncio.to_thread(self._write_spool, upload_id, bytes(buffer))
+                saved = state["chunk_index"] * CHUNK_SIZE_BYTES + len(buffer)
+                await upload_session_repo.update_progress(upload_id, saved)
+                if content_hash is not None and saved == received:
+                    self._hashes[upload_id] = (content_hash, saved)
+            return saved
+
+    async def finalize(self, upload_id: str, telegram_service: TelegramService) -> str:
+        """
+        上传剩余的尾部数据和清单，登记文件元数据，返回 short_id。重复提交返回同一个 short_id。
+        相同内容（SHA-256）已存在时删除已发送的分块，直接返回已有文件的 short_id。
+        """
+        async with self._exclusive(upload_id):
+            session = await self.status(upload_id)
+            if session["short_id"]:
+                return session["short_id"]
+            received = session["received_bytes"]
+            if received != session["total_size"]:
+                raise UploadSessionError(409, "数据尚未全部上传。", "upload_incomplete", received)
+
+            content_hash = self._take_hash(upload_id, received)
+            content_hash = content_hash.hexdigest() if content_hash is not None else None
+            short_id = await telegram_service.find_duplicate(content_hash) if content_hash else None
+            if short_id:
+                await self._delete_chunks(session, telegram_service)
+            else:
+                if content_hash is None:
+                    logger.warning(f"【续传上传】会话数据的哈希不完整（服务曾重启或偏移回退），登记时不记录内容哈希。upload_id: {upload_id}")
+                short_id = await self._upload_rest(upload_id, session, telegram_service, content_hash)
+
+            await upload_session_repo.complete(upload_id, short_id)
+            await asyncio.to_thread(self._remove_spool, upload_id)
+            logger.info(f"【续传上传】上传完成。upload_id: {upload_id}，文件名: {session['filename']}，short_id: {short_id}")
+            return short_id
+
+    async def abort(self, upload_id: str, telegram_service: TelegramService | None = None) -> None:
+        """取消上传：删除会话与暂存数据，并尽量删除已上传到 Telegram 的分块。"""
+        async with self._exclusive(upload_id):
+            session = await self.status(upload_id)
+            await self._discard(session, telegram_service)
+
+    async def cleanup_stale(self, telegram_service: TelegramService | None = None) -> int:
+        """清理长时间没有更新的上传会话，与 abort() 相同地删除已上传到 Telegram 的分块。"""
+        upload_ids = await upload_session_repo.stale(RESUMABLE_UPLOAD_TTL_HOURS)
+        for upload_id in upload_ids:
+            if upload_id in self._busy:
+                continue
+            session = await upload_session_repo.get(upload_id)
+            if session is not None:
+                await self._discard(session, telegram_service)
+        if upload_ids:
+            logger.info(f"【续传上传】已清理 {len(upload_ids)} 个过期的上传会话")
+        return len(upload_ids)
+
+    async def _upload_rest(
+        self, upload_id: str, session: dict, telegram_service: TelegramService, content_hash: str | None
+    ) -> str:
+        """上传尾部数据与清单（不足一个分块时作为单个文档上传）并登记文件元数据，返回 short_id。"""
+        received = session["received_bytes"]
+        state = {"chunk_index": len(session["chunk_ids"]), "first_message_id": session["first_message_id"]}
+        tail = await asyncio.to_thread(self._read_spool, upload_id, received - state["chunk_index"] * CHUNK_SIZE_BYTES)
+        if not state["chunk_index"] and len(tail) < CHUNK_SIZE_BYTES:
+            # 不足一个分块：作为单个文档上传
+            short_id = await telegram_service._upload_single(tail, session["filename"], received, content_hash)
+        else:
+            await self._flush_chunks(telegram_service, session, state, bytearray(tail), final=True)
+            session = await self.status(upload_id)
+            short_id = await telegram_service._upload_manifest(
+                session["filename"], session["chunk_ids"], session["chunk_sizes"], state["first_message_id"], content_hash
+            )
+        if not short_id:
+            raise UploadSessionError(502, "上传到 Telegram 失败。", "upload_failed", received)
+        return short_id
+
+    async def _discard(self, session: dict, telegram_service: TelegramService | None) -> None:
+        """删除会话与暂存数据；会话未完成时尽量删除已上传到 Telegram 的分块。"""
+        upload_id = session["upload_id"]
+        self._hashes.pop(upload_id, None)
+        await upload_session_repo.delete(upload_id)
+        await asyncio.to_thread(self._remove_spool, upload_id)
+        if not session["short_id"]:
+            await self._delete_chunks(session, telegram_service)
+
+    @staticmethod
+    async def _delete_chunks(session: dict, telegram_service: TelegramService | None) -> None:
+        if telegram_service is None:
+            if session["chunk_ids"]:
+                logger.warning(f"【续传上传】未配置 Telegram，无法删除已上传的分块。upload_id: {session['upload_id']}")
+            return
+        for chunk_id in session["chunk_ids"]:
+            await telegram_service.delete_message(int(chunk_id.split(":", 1)[0]))
+
+    def _take_hash(self, upload_id: str, offset: int) -> Any | None:
+        """取出恰好覆盖 [0, offset) 的增量哈希；从 0 开始时新建，无法衔接（重启或偏移回退）时返回 None。"""
+        content_hash, hashed = self._hashes.pop(upload_id, (None, 0))
+        if offset == 0:
+            return hashlib.sha256()
+        return content_hash if hashed == offset else None
+
+    async def _flush_chunks(
+        self,
+        telegram_service: TelegramService,
+        session: dict,
+        state: dict,
+        buffer: bytearray,
+        final: bool = False,
+    ) -> None:
+        """
+        将缓冲区中凑满的分块（final 时包括最后不足一块的数据）依次上传到 Telegram 并记录，已上传的部分从缓冲区移除。
+        每记录一个分块，已接收偏移回落到该分块末尾，暂存文件同时清空（其中的数据已包含在分块中）。
+        """
+        while len(buffer) >= CHUNK_SIZE_BYTES or (final and buffer):
+            chunk = bytes(buffer[:CHUNK_SIZE_BYTES])
+            chunk_index = state["chunk_index"]
+            chunk_name = f"{session['filename']}.part{chunk_index + 1}"
+            logger.info(f"【续传上传】正在上传分块。分块名: {chunk_name}，upload_id: {session['upload_id']}")
+            # 第一个块正常发送，其余块作为对第一个块的回复发送
+            chunk_id = await telegram_service._upload_chunk(chunk, chunk_name, state["first_message_id"])
+            await upload_session_repo.record_chunk(
+                session["upload_id"], chunk_index, chunk_id, len(chunk), chunk_index * CHUNK_SIZE_BYTES + len(chunk)
+            )
+            await asyncio.to_thread(self._write_spool, session["upload_id"], b"")
+            del buffer[:CHUNK_SIZE_BYTES]
+            if chunk_index == 0:
+                state["first_message_id"] = int(chunk_id.split(":", 1)[0])
+            state["chunk_index"] = chunk_index + 1
+
+    @contextlib.asynccontextmanager
+    async def _exclusive(self, upload_id: str):
+        if upload_id in self._busy:
+            raise UploadSessionError(409, "该上传会话正在处理其他请求。", "upload_busy")
+        self._busy.add(upload_id)
+        try:
+            yield
+        finally:
+            self._busy.discard(upload_id)
+
+    def _spool_path(self, upload_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{upload_id}.spool")
+
+    def _read_spool(self, upload_id: str, length: int) -> bytes:
+        """读取暂存的尾部数据（只取数据库中记录的长度，多出的部分是未确认的写入）。"""
+        if length <= 0:
+            return b""
+        try:
+            with open(self._spool_path(upload_id), "rb") as f:
+                return f.read(length)
+        except FileNotFoundError:
+            return b""
+
+    def _write_spool(self, upload_id: str, data: bytes) -> None:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self._spool_path(upload_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_spool(self, upload_id: str) -> None:
+        with contextlib.suppress(OSError):
+            os.remove(self._spool_path(upload_id))
+
+
+resumable_uploads = ResumableUploads()
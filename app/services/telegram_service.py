@@ -1,26 +1,63 @@
 import asyncio
-import io
+import hashlib
 import mimetypes
 import os
-import time
 from functools import lru_cache
 
+import httpx
 import telegram
 from telegram.request import HTTPXRequest
 
-from .. import database
 from ..core.config import get_app_settings
 from ..core.logging_config import get_logger
+from ..database import BLOB_KIND_MANIFEST, BLOB_KIND_SINGLE
+from ..events import new_file_queue
+from ..repository import file_repo
+from .download_accelerator import EXPIRED_URL_STATUS_CODES
+from .download_url_cache import download_url_cache
+from .manifest_cache import chunk_sizes_for, manifest_cache
+from .rate_limiter import telegram_rate_limiter
 
 # Telegram Bot API 对通过 getFile 方法下载的文件有 20MB 的限制。
 # GramDrive 将文件按 19.5MB 分块上传，并通过 .manifest 文件记录原始文件名与分块列表。
 CHUNK_SIZE_BYTES = int(19.5 * 1024 * 1024)
 
+# 分块上传的并发数，以及单个分块的最大尝试次数与首次重试间隔（秒，指数增长）
+UPLOAD_CHUNK_CONCURRENCY = int(os.getenv("UPLOAD_CHUNK_CONCURRENCY", "4"))
+UPLOAD_CHUNK_ATTEMPTS = int(os.getenv("UPLOAD_CHUNK_ATTEMPTS", "3"))
+UPLOAD_CHUNK_RETRY_DELAY = 2.0
+
+# 清单文件的固定头部
+MANIFEST_HEADER = b"tgstate-blob\n"
+
 logger = get_logger(__name__)
 
-# 为下载 URL 添加一个简单的内存缓存
-_download_url_cache = {}
-_download_url_cache_ttl = 300 # 5 minutes TTL
+def parse_manifest(content: bytes) -> tuple[str, list[str]] | None:
+    """
+    解析清单文件内容。
+
+    返回:
+        (原始文件名, 分块复合ID列表)；内容不是有效清单时返回 None。
+    """
+    if not content.startswith(MANIFEST_HEADER):
+        return None
+    try:
+        lines = content.decode("utf-8").strip().split("\n")
+    except UnicodeDecodeError:
+        return None
+    if len(lines) < 3:
+        return None
+    return lines[1].strip(), [line.strip() for line in lines[2:] if line.strip()]
+
+
+def file_sha256(file_path: str) -> str:
+    """计算本地文件内容的 SHA-256（十六进制），按块读取，不整体载入内存。"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class TelegramService:
     """
@@ -36,96 +73,181 @@ class TelegramService:
         self.bot = telegram.Bot(token=bot_token, request=request)
         self.channel_name = channel_name
 
-    async def _upload_chunk(self, chunk_data: bytes, chunk_name: str) -> str | None:
-        """一个上传单个数据块的辅助函数。"""
-        try:
-            with io.BytesIO(chunk_data) as document_chunk:
-                message = await self.bot.send_document(
+    async def _api(self, method: str, **kwargs):
+        """通过共享的限速器调用 Bot API 方法（排队等待令牌，遇到 flood wait 自动等待并重试）。"""
+        return await telegram_rate_limiter.call(method, getattr(self.bot, method), **kwargs)
+
+    async def _upload_chunk(self, chunk_data: bytes, chunk_name: str, reply_to_message_id: int | None = None) -> str:
+        """
+        上传单个数据块，失败时单独重试（指数退避），返回复合ID "message_id:file_id"。
+
+        异常:
+            重试 UPLOAD_CHUNK_ATTEMPTS 次后仍失败时抛出最后一次的异常。
+        """
+        attempt = 1
+        while True:
+            try:
+                # 直接以 bytes 发送，不再复制到 BytesIO
+                message = await self._api(
+                    "send_document",
                     chat_id=self.channel_name,
-                    document=document_chunk,
-                    filename=chunk_name
+                    document=chunk_data,
+                    filename=chunk_name,
+                    reply_to_message_id=reply_to_message_id
                 )
-            if message.document:
+                if not message.document:
+                    raise Exception("响应中缺少文档信息")
                 logger.debug(f"【Telegram】分块上传成功。分块名: {chunk_name}，file_id: {message.document.file_id[:16]}...")
-                return message.document.file_id
-        except Exception as e:
-            logger.error(f"【Telegram】上传分块失败。分块名: {chunk_name}，错误: {str(e)}", exc_info=e)
-        return None
+                # 存储复合ID (message_id:file_id) 而不是只有 file_id
+                return f"{message.message_id}:{message.document.file_id}"
+            except Exception as e:
+                # BadRequest 属于请求本身的问题，重试无意义
+                if attempt >= UPLOAD_CHUNK_ATTEMPTS or isinstance(e, telegram.error.BadRequest):
+                    raise
+                delay = UPLOAD_CHUNK_RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"【Telegram】上传分块失败，{delay:.0f}秒后第 {attempt} 次重试。分块名: {chunk_name}，错误: {str(e)}")
+                await asyncio.sleep(delay)
+                attempt += 1
 
     async def _upload_as_chunks(self, file_path: str, original_filename: str) -> str | None:
         """
-        将大文件分割成块，并通过回复链将所有部分聚合起来。
+        将大文件分割成块，并通过回复链将所有部分聚合起来（与流式上传共用 ChunkedUpload）。
         """
-        chunk_file_ids = []
-        first_message_id = None
-
+        upload = self.open_upload(original_filename)
         try:
             with open(file_path, "rb") as f:
-                chunk_number = 1
-                while True:
-                    chunk = f.read(CHUNK_SIZE_BYTES)
-                    if not chunk:
-                        break
-
-                    chunk_name = f"{original_filename}.part{chunk_number}"
-                    logger.info(f"【Telegram】正在上传分块。分块名: {chunk_name}，分块号: {chunk_number}")
-
-                    with io.BytesIO(chunk) as chunk_io:
-                        # 如果是第一个块，正常发送。否则，作为对第一个块的回复发送。
-                        reply_to_id = first_message_id if first_message_id else None
-                        message = await self.bot.send_document(
-                            chat_id=self.channel_name,
-                            document=chunk_io,
-                            filename=chunk_name,
-                            reply_to_message_id=reply_to_id
-                        )
-
-                    # 如果是第一个块，保存其 message_id
-                    if not first_message_id:
-                        first_message_id = message.message_id
-
-                    # 关键变更：存储复合ID (message_id:file_id) 而不是只有 file_id
-                    chunk_file_ids.append(f"{message.message_id}:{message.document.file_id}")
-                    chunk_number += 1
+                while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE_BYTES):
+                    await upload.write(chunk)
+            return await upload.finish()
         except OSError as e:
             logger.error(f"【Telegram】读取文件时出错。文件名: {original_filename}，错误: {str(e)}", exc_info=e)
-            return None
         except Exception as e:
             logger.error(f"【Telegram】发送文件分块时出错。文件名: {original_filename}，错误: {str(e)}", exc_info=e)
-            return None
+        await upload.abort()
+        return None
 
-        # 生成并上传清单文件，同样作为对第一个块的回复
+    async def _upload_manifest(
+        self,
+        original_filename: str,
+        chunk_file_ids: list[str],
+        chunk_sizes: list[int],
+        first_message_id: int,
+        content_hash: str | None = None,
+    ) -> str | None:
+        """上传清单文件（作为对第一个块的回复）并登记文件元数据，返回 short_id。"""
         manifest_content = f"tgstate-blob\n{original_filename}\n" + "\n".join(chunk_file_ids)
         manifest_name = f"{original_filename}.manifest"
 
         logger.info(f"【Telegram】所有分块上传完毕。正在上传清单文件。文件名: {manifest_name}，分块数: {len(chunk_file_ids)}")
         try:
-            with io.BytesIO(manifest_content.encode('utf-8')) as manifest_file:
-                message = await self.bot.send_document(
-                    chat_id=self.channel_name,
-                    document=manifest_file,
-                    filename=manifest_name,
-                    reply_to_message_id=first_message_id
-                )
+            message = await self._api(
+                "send_document",
+                chat_id=self.channel_name,
+                document=manifest_content.encode('utf-8'),
+                filename=manifest_name,
+                reply_to_message_id=first_message_id
+            )
             if message.document:
                 logger.info(f"【Telegram】清单文件上传成功。文件名: {manifest_name}")
+                # 清单内容已知，直接写入缓存，之后访问该文件无需再下载清单
+                await manifest_cache.put(message.document.file_id, original_filename, chunk_file_ids, chunk_sizes)
                 # 将大文件的元数据存入数据库
-                total_size = os.path.getsize(file_path)
-                # 创建复合ID，格式为 "message_id:file_id"
-                composite_id = f"{message.message_id}:{message.document.file_id}"
-                mime_type, _ = mimetypes.guess_type(original_filename)
-                short_id = database.add_file_metadata(
-                    filename=original_filename,
-                    file_id=composite_id, # 我们存储复合ID
-                    filesize=total_size,
-                    mime_type=mime_type
+                return await self._register_upload(
+                    message,
+                    original_filename,
+                    sum(chunk_sizes),
+                    content_hash,
+                    blob_kind=BLOB_KIND_MANIFEST,
+                    chunk_count=len(chunk_file_ids),
+                    chunk_size=CHUNK_SIZE_BYTES,
                 )
-                return short_id # 返回 short_id
         except Exception as e:
             logger.error(f"【Telegram】上传清单文件时出错。文件名: {manifest_name}，错误: {str(e)}", exc_info=e)
 
         return None
 
+    async def _upload_single(
+        self, document, file_name: str, file_size: int, content_hash: str | None = None
+    ) -> str | None:
+        """以单个文档上传（document 为文件对象或 bytes）并登记文件元数据，返回 short_id。"""
+        try:
+            message = await self._send_single(document, file_name)
+            if message.document:
+                short_id = await self._register_upload(
+                    message, file_name, file_size, content_hash, blob_kind=BLOB_KIND_SINGLE
+                )
+                logger.info(f"【Telegram】文件上传成功。文件名: {file_name}，short_id: {short_id}")
+                return short_id # 返回 short_id
+        except Exception as e:
+            logger.error(f"【Telegram】上传文件到 Telegram 时出错。文件名: {file_name}，错误: {str(e)}", exc_info=e)
+
+        return None
+
+    async def _send_single(self, document, file_name: str) -> telegram.Message:
+        """发送单个文档到频道（不登记元数据）。"""
+        return await self._api(
+            "send_document",
+            chat_id=self.channel_name,
+            document=document,
+            filename=file_name
+        )
+
+    @staticmethod
+    def _file_record(
+        message: telegram.Message, file_name: str, file_size: int, content_hash: str | None = None, **layout
+    ) -> dict:
+        """由发送结果构造文件元数据记录（参数与 file_repo.add 一致）。"""
+        mime_type, _ = mimetypes.guess_type(file_name)
+        return {
+            "filename": file_name,
+            # 创建复合ID，格式为 "message_id:file_id"
+            "file_id": f"{message.message_id}:{message.document.file_id}",
+            "filesize": file_size,
+            "mime_type": mime_type,
+            "content_hash": content_hash,
+            **layout,
+        }
+
+    async def _register_upload(
+        self, message: telegram.Message, file_name: str, file_size: int, content_hash: str | None = None, **layout
+    ) -> str:
+        """将上传结果存入数据库并通知下载服务，返回 short_id。"""
+        record = self._file_record(message, file_name, file_size, content_hash, **layout)
+        short_id = await file_repo.add(**record)
+        new_file_queue.push(record["file_id"])
+        return short_id
+
+    async def send_document(self, document, file_name: str, file_size: int, content_hash: str | None = None) -> dict:
+        """
+        以单个文档发送到频道但不登记元数据，返回文件记录（之后交给 register_uploads 登记）。
+
+        异常:
+            发送失败或响应中缺少文档信息时抛出异常。
+        """
+        message = await self._send_single(document, file_name)
+        if not message.document:
+            raise Exception("响应中缺少文档信息")
+        return self._file_record(message, file_name, file_size, content_hash, blob_kind=BLOB_KIND_SINGLE)
+
+    async def register_uploads(self, records: list[dict]) -> list[str]:
+        """在一个事务中登记多条 send_document 返回的记录并通知下载服务，返回对应的 short_id 列表。"""
+        short_ids = await file_repo.add_many(records)
+        for record in records:
+            new_file_queue.push(record["file_id"])
+        return short_ids
+
+    async def find_duplicate(self, content_hash: str) -> str | None:
+        """按内容哈希查找已上传过的相同文件，返回其 short_id。"""
+        existing = await file_repo.get_by_content_hash(content_hash)
+        if existing and existing.get("short_id"):
+            logger.info(f"【Telegram】内容已存在，跳过上传。原文件名: {existing['filename']}，short_id: {existing['short_id']}")
+            return existing["short_id"]
+        return None
+
+    def open_upload(self, file_name: str) -> "ChunkedUpload":
+        """开始一个流式上传：按顺序写入数据，结束时调用 finish() 得到 short_id。"""
+        return ChunkedUpload(self, file_name)
+
     async def upload_file(self, file_path: str, file_name: str) -> str | None:
         """
         将文件上传到指定的 Telegram 频道。
@@ -148,6 +270,16 @@ class TelegramService:
             logger.error(f"【Telegram】无法获取文件大小。文件路径: {file_path}，错误: {str(e)}", exc_info=e)
             return None
 
+        try:
+            content_hash = await asyncio.to_thread(file_sha256, file_path)
+        except OSError as e:
+            logger.error(f"【Telegram】读取文件时出错。文件路径: {file_path}，错误: {str(e)}", exc_info=e)
+            return None
+        # 相同内容已上传过：直接复用，不再发送到 Telegram
+        existing_short_id = await self.find_duplicate(content_hash)
+        if existing_short_id:
+            return existing_short_id
+
         if file_size >= CHUNK_SIZE_BYTES:
             logger.info(
                 f"【Telegram】文件大小 {file_size / 1024 / 1024:.2f}MB >= {CHUNK_SIZE_BYTES / 1024 / 1024:.2f}MB，启动分块上传。文件名: {file_name}"
@@ -159,33 +291,15 @@ class TelegramService:
         )
         try:
             with open(file_path, "rb") as document_file:
-                message = await self.bot.send_document(
-                    chat_id=self.channel_name,
-                    document=document_file,
-                    filename=file_name
-                )
-            if message.document:
-                # 将小文件的元数据存入数据库
-                # 创建复合ID，格式为 "message_id:file_id"
-                composite_id = f"{message.message_id}:{message.document.file_id}"
-                mime_type, _ = mimetypes.guess_type(file_name)
-                short_id = database.add_file_metadata(
-                    filename=file_name,
-                    file_id=composite_id, # 存储复合ID
-                    filesize=file_size,
-                    mime_type=mime_type
-                )
-                logger.info(f"【Telegram】文件上传成功。文件名: {file_name}，short_id: {short_id}")
-                return short_id # 返回 short_id
-        except Exception as e:
+                return await self._upload_single(document_file, file_name, file_size, content_hash)
+        except OSError as e:
             logger.error(f"【Telegram】上传文件到 Telegram 时出错。文件名: {file_name}，错误: {str(e)}", exc_info=e)
-
-        return None
+            return None
 
     async def get_download_url(self, file_id: str) -> str | None:
         """
         为给定的 file_id 获取临时下载链接。
-        使用内存缓存，减少对 Telegram API 的频繁请求。
+        链接缓存在有界的过期缓存中，同一 file_id 的并发请求只会调用一次 getFile。
 
         参数:
             file_id: 来自 Telegram 的文件 ID。
@@ -193,53 +307,94 @@ class TelegramService:
         返回:
             如果成功，则返回临时下载链接，否则返回 None。
         """
-        # Check cache first
-        cached_entry = _download_url_cache.get(file_id)
-        if cached_entry:
-            url, timestamp = cached_entry
-            if (time.time() - timestamp) < _download_url_cache_ttl:
-                logger.debug(f"Cache hit for download URL: {file_id}")
-                return url
-            else:
-                logger.debug(f"Cache expired for download URL: {file_id}")
+        return await download_url_cache.get(file_id, lambda: self._resolve_download_url(file_id))
 
+    async def _resolve_download_url(self, file_id: str) -> str | None:
         try:
-            file = await self.bot.get_file(file_id)
-            url = file.file_path
-            if url:
-                _download_url_cache[file_id] = (url, time.time())
-                logger.debug(f"Cache miss, fetched and cached download URL for: {file_id}")
-            return url
+            file = await self._api("get_file", file_id=file_id)
+            logger.debug(f"已从 Telegram 获取下载链接: {file_id}")
+            return file.file_path
         except Exception as e:
             logger.error(f"从 Telegram 获取下载链接时出错: {e}", exc_info=True)
             return None
 
-    async def try_get_manifest_original_filename(self, manifest_file_id: str) -> tuple[bool, str | None, str | None]:
-        download_url = await self.get_download_url(manifest_file_id)
-        if not download_url:
-            return False, None, "无法获取下载链接（文件可能已过期或不存在）"
+    async def get_manifest(
+        self,
+        manifest_id: str,
+        client: httpx.AsyncClient | None = None,
+        total_size: int | None = None,
+        known_manifest: bool = False,
+    ) -> dict | None:
+        """
+        获取分块文件的清单，优先使用清单缓存；未命中时下载并解析，然后写入缓存。
 
-        try:
-            import httpx
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                resp = await client.get(download_url)
-                resp.raise_for_status()
-        except Exception as e:
-            return False, None, f"下载清单失败：{e}"
+        参数:
+            manifest_id: 清单文件的 Telegram file_id（不含 message_id 前缀）。
+            client: 可选的共享 HTTP 客户端。
+            total_size: 文件总大小（来自数据库），用于推算各分块大小。
+            known_manifest: 已知该文件是清单（数据库中记录了 blob_kind），跳过开头 128 字节的探测。
 
-        content = resp.content
-        if not content.startswith(b"tgstate-blob\n"):
-            return False, None, "清单格式不正确（缺少 tgstate-blob 头）"
+        返回:
+            {"filename", "chunk_ids", "chunk_sizes"}；该文件不是清单时返回 None。
+
+        异常:
+            无法获取下载链接或下载失败时抛出 Exception。
+        """
+        cached = await manifest_cache.get(manifest_id)
+        if cached is not None:
+            if total_size and None in cached["chunk_sizes"]:
+                sizes = chunk_sizes_for(total_size, len(cached["chunk_ids"]), CHUNK_SIZE_BYTES)
+                cached = await manifest_cache.put(manifest_id, cached["filename"], cached["chunk_ids"], sizes)
+            return cached
+
+        http = client or httpx.AsyncClient(timeout=60.0)
+        try:
+            for attempt in range(2):
+                download_url = await self.get_download_url(manifest_id)
+                if not download_url:
+                    raise Exception("无法获取下载链接（文件可能已过期或不存在）")
+                try:
+                    if not known_manifest:
+                        # 先读取开头一小段判断是否为清单，避免完整下载普通文件
+                        head = await http.get(download_url, headers={"Range": "bytes=0-127"})
+                        head.raise_for_status()
+                        if not head.content.startswith(MANIFEST_HEADER):
+                            return None
+                    resp = await http.get(download_url)
+                    resp.raise_for_status()
+                    break
+                except httpx.HTTPStatusError as e:
+                    # 缓存的链接已失效：丢弃后重新获取一次
+                    if attempt or e.response.status_code not in EXPIRED_URL_STATUS_CODES:
+                        raise
+                    download_url_cache.invalidate(manifest_id)
+        finally:
+            if client is None:
+                await http.aclose()
+
+        manifest = parse_manifest(resp.content)
+        if not manifest:
+            return None
+        filename, chunk_ids = manifest
+        logger.debug(f"【Telegram】已下载并缓存清单。文件名: {filename}，分块数: {len(chunk_ids)}")
+        return await manifest_cache.put(
+            manifest_id, filename, chunk_ids, chunk_sizes_for(total_size, len(chunk_ids), CHUNK_SIZE_BYTES)
+        )
 
+    async def try_get_manifest_original_filename(self, manifest_file_id: str) -> tuple[bool, str | None, str | None]:
         try:
-            lines = content.decode("utf-8").strip().split("\n")
+            manifest = await self.get_manifest(manifest_file_id)
+        except httpx.HTTPError as e:
+            return False, None, f"下载清单失败：{e}"
         except Exception as e:
-            return False, None, f"清单解码失败：{e}"
+            return False, None, str(e)
 
-        if len(lines) < 2 or not lines[1].strip():
+        if manifest is None:
+            return False, None, "清单格式不正确（缺少 tgstate-blob 头）"
+        if not manifest["filename"]:
             return False, None, "清单缺少原始文件名"
 
-        return True, lines[1].strip(), None
+        return True, manifest["filename"], None
 
     async def delete_message(self, message_id: int) -> tuple[bool, str]:
         """
@@ -253,7 +408,8 @@ class TelegramService:
             reason 可以是 'deleted', 'not_found', 或 'error'。
         """
         try:
-            await self.bot.delete_message(
+            await self._api(
+                "delete_message",
                 chat_id=self.channel_name,
                 message_id=message_id
             )
@@ -269,13 +425,14 @@ class TelegramService:
             logger.error("删除消息 %s 时发生未知错误: %s", message_id, e)
             return (False, "错误")
 
-    async def delete_file_with_chunks(self, file_id: str) -> dict:
+    async def delete_file_with_chunks(self, file_id: str, blob_kind: str | None = None) -> dict:
         """
         完全删除一个文件，包括其所有可能的分块。
         该函数会处理清单文件，并删除所有引用的分块。
 
         参数:
             file_id: 要删除的文件的复合 ID ("message_id:actual_file_id")。
+            blob_kind: 数据库中记录的存储方式；为 single 时不读取清单，为 manifest 时跳过清单探测。
 
         返回:
             一个包含删除操作结果的字典。
@@ -299,52 +456,50 @@ class TelegramService:
             results["reason"] = "复合文件ID格式无效。"
             return results
 
-        # 步骤 1: 检查文件是否为清单
-        download_url = await self.get_download_url(main_actual_file_id)
-        if not download_url:
-            logger.warning("无法为文件 %s 获取下载链接，将只尝试删除主消息", main_actual_file_id)
-            results["reason"] = f"无法获取 {main_actual_file_id} 的下载 URL。"
-        else:
+        # 步骤 1: 检查文件是否为清单（优先使用清单缓存）
+        try:
+            if blob_kind == BLOB_KIND_SINGLE:
+                manifest = None
+            else:
+                manifest = await self.get_manifest(main_actual_file_id, known_manifest=blob_kind == BLOB_KIND_MANIFEST)
+        except Exception as e:
+            logger.warning("无法读取文件 %s 的清单，将只尝试删除主消息: %s", main_actual_file_id, e)
+            results["reason"] = f"无法读取 {main_actual_file_id} 的清单：{e}"
+            manifest = None
+
+        if manifest is not None:
             try:
-                import httpx
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.get(download_url)
-                    if response.status_code == 200 and response.content.startswith(b'tgstate-blob\n'):
-                        results["is_manifest"] = True
-                        logger.info("文件 %s 是清单文件，开始删除分块", file_id)
-
-                        manifest_content = response.content.decode('utf-8')
-                        lines = manifest_content.strip().split('\n')
-                        chunk_composite_ids = [cid for cid in lines[2:] if cid.strip()]
-
-                        chunk_items: list[tuple[str, int]] = []
-                        for chunk_id in chunk_composite_ids:
-                            try:
-                                chunk_message_id_str, _ = chunk_id.split(":", 1)
-                                chunk_items.append((chunk_id, int(chunk_message_id_str)))
-                            except Exception as e:
-                                logger.warning("处理分块ID %s 时出错: %s", chunk_id, e)
-                                results["failed_chunks"].append(chunk_id)
-
-                        semaphore = asyncio.Semaphore(10)
-
-                        async def delete_one(chunk_id: str, message_id: int) -> tuple[str, bool]:
-                            async with semaphore:
-                                ok, _ = await self.delete_message(message_id)
-                                return chunk_id, ok
-
-                        tasks = [asyncio.create_task(delete_one(chunk_id, mid)) for chunk_id, mid in chunk_items]
-                        for fut in asyncio.as_completed(tasks):
-                            try:
-                                chunk_id, ok = await fut
-                                if ok:
-                                    results["deleted_chunks"].append(chunk_id)
-                                else:
-                                    results["failed_chunks"].append(chunk_id)
-                            except Exception as e:
-                                logger.error("删除分块时出错: %s", e)
+                results["is_manifest"] = True
+                logger.info("文件 %s 是清单文件，开始删除分块", file_id)
+
+                chunk_items: list[tuple[str, int]] = []
+                for chunk_id in manifest["chunk_ids"]:
+                    try:
+                        chunk_message_id_str, _ = chunk_id.split(":", 1)
+                        chunk_items.append((chunk_id, int(chunk_message_id_str)))
+                    except Exception as e:
+                        logger.warning("处理分块ID %s 时出错: %s", chunk_id, e)
+                        results["failed_chunks"].append(chunk_id)
+
+                semaphore = asyncio.Semaphore(10)
+
+                async def delete_one(chunk_id: str, message_id: int) -> tuple[str, bool]:
+                    async with semaphore:
+                        ok, _ = await self.delete_message(message_id)
+                        return chunk_id, ok
+
+                tasks = [asyncio.create_task(delete_one(chunk_id, mid)) for chunk_id, mid in chunk_items]
+                for fut in asyncio.as_completed(tasks):
+                    try:
+                        chunk_id, ok = await fut
+                        if ok:
+                            results["deleted_chunks"].append(chunk_id)
+                        else:
+                            results["failed_chunks"].append(chunk_id)
+                    except Exception as e:
+                        logger.error("删除分块时出错: %s", e)
             except Exception as e:
-                error_message = f"下载或解析清单文件 {file_id} 时出错: {e}"
+                error_message = f"删除清单文件 {file_id} 的分块时出错: {e}"
                 logger.error(error_message)
                 results["reason"] += " " + error_message
                 # 即使清单处理失败，我们也要继续尝试删除主消息
@@ -365,6 +520,8 @@ class TelegramService:
         # 步骤 3: 决定最终状态
         if results["main_message_deleted"] and (not results["is_manifest"] or not results["failed_chunks"]):
              results["status"] = "success"
+             if results["is_manifest"]:
+                 await manifest_cache.delete(main_actual_file_id)
         else:
              results["status"] = "partial_failure"
              if not results["main_message_deleted"]:
@@ -420,26 +577,18 @@ class TelegramService:
                         })
                     # 清单文件
                     elif doc.file_name.endswith('.manifest'):
-                        # 下载并解析清单文件以获取原始文件名和大小
-                        manifest_url = await self.get_download_url(doc.file_id)
-                        if not manifest_url:
+                        # 读取清单（优先使用缓存）以获取原始文件名
+                        try:
+                            manifest = await self.get_manifest(doc.file_id)
+                        except Exception:
                             continue
-
-                        import httpx
-                        async with httpx.AsyncClient() as client:
-                            try:
-                                resp = await client.get(manifest_url)
-                                if resp.status_code == 200 and resp.content.startswith(b'tgstate-blob\n'):
-                                    lines = resp.content.decode('utf-8').strip().split('\n')
-                                    original_filename = lines[1]
-                                    # 注意：这里我们无法轻易获得原始总大小，暂时留空
-                                    files.append({
-                                        "name": original_filename,
-                                        "file_id": doc.file_id, # 关键：使用清单文件的ID
-                                        "size": None # 标记为未知大小
-                                    })
-                            except httpx.RequestError:
-                                continue
+                        if manifest:
+                            sizes = manifest["chunk_sizes"]
+                            files.append({
+                                "name": manifest["filename"],
+                                "file_id": doc.file_id, # 关键：使用清单文件的ID
+                                "size": sum(sizes) if None not in sizes else None # 缓存中没有分块大小时为未知
+                            })
 
             # 设置下一次迭代的偏移量
             last_message_id = messages[-1].message_id
@@ -448,6 +597,129 @@ class TelegramService:
         logger.info("文件列表获取完毕，共找到 %s 个有效文件", len(files))
         return files
 
+class ChunkedUpload:
+    """
+    流式分块上传。
+
+    数据按顺序通过 write() 写入，每凑满 CHUNK_SIZE_BYTES 就开始上传该分块，不落盘、不等待全部数据到达。
+    第一个块上传完成后，其余块作为对它的回复并发上传（最多 UPLOAD_CHUNK_CONCURRENCY 个）；
+    并发已满时 write() 会等待，调用方随之停止读取数据，内存占用不超过 (并发数 + 1) 个分块。
+    总大小不足一个分块的数据在 finish() 时作为单个文档上传，与 upload_file 的规则一致。
+    写入的同时计算内容的 SHA-256：finish() 时发现相同内容已存在则直接返回已有文件，删除已发送的分块，不再登记新记录。
+    这只节省存储，不节省传输——判断重复时数据已全部发送过；需要在传输前去重时由客户端通过 X-Content-SHA256 声明哈希。
+    """
+
+    def __init__(self, service: TelegramService, file_name: str):
+        self.service = service
+        self.file_name = file_name
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._chunk_ids: list[str | None] = []
+        self._chunk_sizes: list[int] = []
+        self._tasks: list[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(UPLOAD_CHUNK_CONCURRENCY)
+        self._first_message_id: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+        self._error: BaseException | None = None
+
+    async def write(self, data: bytes) -> None:
+        """
+        追加数据；凑满的分块立即提交上传。
+
+        异常:
+            之前提交的分块已最终失败时抛出该异常。
+        """
+        self._raise_if_failed()
+        self.size += len(data)
+        self._hash.update(data)
+        self._buffer += data
+        while len(self._buffer) >= CHUNK_SIZE_BYTES:
+            chunk = bytes(self._buffer[:CHUNK_SIZE_BYTES])
+            del self._buffer[:CHUNK_SIZE_BYTES]
+            await self._submit(chunk)
+
+    async def finish(self) -> str | None:
+        """
+        上传剩余数据，等待全部分块完成后上传清单并登记元数据，返回 short_id（失败时返回 None）。
+
+        异常:
+            有分块最终上传失败时抛出该异常。
+        """
+        content_hash = self._hash.hexdigest()
+        existing_short_id = await self.service.find_duplicate(content_hash)
+        if existing_short_id:
+            await self._discard_sent_chunks()
+            return existing_short_id
+
+        if not self._tasks:
+            # 不足一个分块：直接作为单个文档上传
+            data, self._buffer = bytes(self._buffer), bytearray()
+            return await self.service._upload_single(data, self.file_name, self.size, content_hash)
+        if self._buffer:
+            chunk, self._buffer = bytes(self._buffer), bytearray()
+            await self._submit(chunk)
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            await self.abort()
+            if self._error is not None:
+                raise self._error from None
+            raise
+        return await self.service._upload_manifest(
+            self.file_name, self._chunk_ids, self._chunk_sizes, self._first_message_id.result(), content_hash
+        )
+
+    async def abort(self) -> None:
+        """取消尚未完成的分块上传（已上传的分块不会删除）。"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._buffer = bytearray()
+
+    async def _discard_sent_chunks(self) -> None:
+        """内容重复时撤回已发送的分块：等待上传中的分块结束（避免取消后留下无记录的消息），再删除已发送的分块消息。"""
+        self._buffer = bytearray()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for chunk_id in self._chunk_ids:
+            if chunk_id:
+                await self.service.delete_message(int(chunk_id.split(":", 1)[0]))
+
+    async def _submit(self, chunk: bytes) -> None:
+        await self._slots.acquire()
+        try:
+            self._raise_if_failed()
+        except BaseException:
+            self._slots.release()
+            raise
+        index = len(self._chunk_ids)
+        self._chunk_ids.append(None)
+        self._chunk_sizes.append(len(chunk))
+        self._tasks.append(asyncio.create_task(self._upload(index, chunk)))
+
+    async def _upload(self, index: int, chunk: bytes) -> None:
+        try:
+            chunk_name = f"{self.file_name}.part{index + 1}"
+            logger.info(f"【Telegram】正在上传分块。分块名: {chunk_name}，分块号: {index + 1}")
+            # 第一个块正常发送，其余块作为对第一个块的回复发送
+            reply_to = None if index == 0 else await asyncio.shield(self._first_message_id)
+            self._chunk_ids[index] = await self.service._upload_chunk(chunk, chunk_name, reply_to)
+            if index == 0:
+                self._first_message_id.set_result(int(self._chunk_ids[0].split(":", 1)[0]))
+        except BaseException as e:
+            if self._error is None and not isinstance(e, asyncio.CancelledError):
+                self._error = e
+            if index == 0 and not self._first_message_id.done():
+                # 后续分块无法回复到第一个块，一并失败
+                self._first_message_id.cancel()
+            raise
+        finally:
+            self._slots.release()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+
 @lru_cache
 def get_telegram_service() -> TelegramService:
     """
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+数据库访问基准测试：对比旧的「全局锁 + 每次新建连接」设计与连接池（WAL）设计。
+
+旧设计在单独的数据库文件上测试，该文件保持 SQLite 默认的回滚日志模式（journal_mode=DELETE），
+与引入连接池之前的配置一致；连接池设计使用 init_db() 初始化的 WAL 数据库。两者预置相同的数据。
+
+场景：若干读线程持续执行 get_file_by_id，同时一个写线程持续执行
+increment_download_count / update_local_path，统计每秒完成的查询次数。
+
+用法:
+    python scripts/bench_db.py [--files 20000] [--readers 8] [--seconds 5]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# 在导入 app.database 之前指定临时数据目录（结束时删除）
+_tmp_dir = tempfile.TemporaryDirectory(prefix="gramdrive-bench-")
+os.environ["DATA_DIR"] = _tmp_dir.name
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import database  # noqa: E402
+
+# ==================== 旧设计（基线） ====================
+
+_legacy_lock = threading.Lock()
+LEGACY_DATABASE_URL = os.path.join(_tmp_dir.name, "legacy.db")
+
+
+def _legacy_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(LEGACY_DATABASE_URL, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_get_file_by_id(identifier: str) -> dict | None:
+    with _legacy_lock:
+        conn = _legacy_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT filename, filesize, upload_date, file_id, short_id FROM files WHERE short_id = ? OR file_id = ?",
+                (identifier, identifier),
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+
+def legacy_increment_download_count(file_id: str) -> bool:
+    with _legacy_lock:
+        conn = _legacy_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE files SET download_count = download_count + 1 WHERE file_id = ?", (file_id,)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+
+def legacy_update_local_path(file_id: str, local_path: str) -> bool:
+    with _legacy_lock:
+        conn = _legacy_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE files SET local_path = ? WHERE file_id = ?", (local_path, file_id)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+
+# ==================== 基准逻辑 ====================
+
+_INSERT_FILES = "INSERT OR IGNORE INTO files (filename, file_id, filesize, short_id, mime_type) VALUES (?, ?, ?, ?, ?)"
+
+
+def _seed(count: int) -> list[tuple[str, str]]:
+    rows = []
+    ids = []
+    for i in range(count):
+        file_id = f"{i}:bench_file_{i}"
+        short_id = f"b{i:07d}"
+        rows.append((f"file_{i}.jpg", file_id, 1024 * (i % 500 + 1), short_id, "image/jpeg"))
+        ids.append((file_id, short_id))
+
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        conn.executemany(_INSERT_FILES, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # 旧设计的数据库：引入连接池之前的 files 表结构，默认回滚日志模式
+    conn = sqlite3.connect(LEGACY_DATABASE_URL)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute(
+            """
+            CREATE TABLE files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                file_id TEXT NOT NULL UNIQUE,
+                filesize INTEGER NOT NULL,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                short_id TEXT UNIQUE,
+                local_path TEXT,
+                download_count INTEGER DEFAULT 0,
+                mime_type TEXT
+            )
+            """
+        )
+        conn.executemany(_INSERT_FILES, rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return ids
+
+
+def _run(name: str, lookup, increment, update_path, ids, readers: int, seconds: float) -> float:
+    stop = threading.Event()
+    counts = [0] * readers
+    writes = [0]
+
+    def reader_loop(idx: int):
+        rnd = random.Random(idx)
+        n = 0
+        while not stop.is_set():
+            _, short_id = ids[rnd.randrange(len(ids))]
+            lookup(short_id)
+            n += 1
+        counts[idx] = n
+
+    def writer_loop():
+        rnd = random.Random(-1)
+        n = 0
+        while not stop.is_set():
+            file_id, _ = ids[rnd.randrange(len(ids))]
+            if n % 2:
+                increment(file_id)
+            else:
+                update_path(file_id, f"image/2026-01-01/{file_id}.jpg")
+            n += 1
+        writes[0] = n
+
+    threads = [threading.Thread(target=reader_loop, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer_loop))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    lookups_per_sec = sum(counts) / seconds
+    print(
+        f"{name:<12} 查询: {lookups_per_sec:>10.0f} 次/秒    写入: {writes[0] / seconds:>8.0f} 次/秒"
+    )
+    return lookups_per_sec
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="GramDrive 数据库访问基准测试")
+    parser.add_argument("--files", type=int, default=20000, help="预置文件记录数")
+    parser.add_argument("--readers", type=int, default=8, help="并发读线程数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="每轮测试时长（秒）")
+    args = parser.parse_args()
+
+    try:
+        _benchmark(args)
+    finally:
+        database.get_pool().close_all()
+        _tmp_dir.cleanup()
+
+
+def _benchmark(args: argparse.Namespace) -> None:
+    print(f"数据库: {database.DATABASE_URL}（连接池）, {LEGACY_DATABASE_URL}（旧设计）")
+    ids = _seed(args.files)
+    print(f"已预置 {len(ids)} 条记录，读线程: {args.readers}，时长: {args.seconds}s\n")
+
+    legacy = _run(
+        "db_lock",
+        legacy_get_file_by_id,
+        legacy_increment_download_count,
+        legacy_update_local_path,
+        ids,
+        args.readers,
+        args.seconds,
+    )
+    pooled = _run(
+        "pool+WAL",
+        database.get_file_by_id,
+        database.increment_download_count,
+        database.update_local_path,
+        ids,
+        args.readers,
+        args.seconds,
+    )
+    if legacy > 0:
+        print(f"\n提升: {pooled / legacy:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
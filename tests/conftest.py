@@ -0,0 +1,66 @@
+"""
+测试公共配置。
+
+app.database 在导入时读取 DATA_DIR 并创建目录，因此在导入任何应用模块之前先指向临时目录；
+需要数据库的测试使用 db fixture，每个测试一个独立的空数据库。
+"""
+
+import itertools
+import os
+import tempfile
+from types import SimpleNamespace
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="gramdrive-tests-"))
+
+import pytest  # noqa: E402
+
+from app import database  # noqa: E402
+from app.services import telegram_service as telegram_service_module  # noqa: E402
+from app.services.rate_limiter import TelegramRateLimiter  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_URL", str(tmp_path / "file_metadata.db"))
+    database.init_db()
+    yield database
+    database.get_pool().close_all()
+
+
+class FakeBot:
+    """代替 telegram.Bot：记录发送的文档（按文件名）与删除的消息。"""
+
+    def __init__(self):
+        self.sent: dict[str, SimpleNamespace] = {}
+        self.deleted: list[int] = []
+        self._message_ids = itertools.count(100)
+
+    async def send_document(self, chat_id, document, filename, reply_to_message_id=None):
+        data = document if isinstance(document, bytes) else document.read()
+        message_id = next(self._message_ids)
+        self.sent[filename] = SimpleNamespace(
+            message_id=message_id, reply_to_message_id=reply_to_message_id, data=data
+        )
+        return SimpleNamespace(
+            message_id=message_id, document=SimpleNamespace(file_id=f"file{message_id}")
+        )
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+        return True
+
+
+@pytest.fixture
+def telegram_service(db, monkeypatch):
+    """使用 FakeBot 的 TelegramService；限速器放宽，避免测试等待令牌。"""
+    monkeypatch.setattr(
+        telegram_service_module,
+        "telegram_rate_limiter",
+        TelegramRateLimiter(global_rate=1e6, chat_send_per_minute=1e6),
+    )
+    service = telegram_service_module.TelegramService.__new__(
+        telegram_service_module.TelegramService
+    )
+    service.bot = FakeBot()
+    service.channel_name = "@test"
+    return service
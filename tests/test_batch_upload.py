@@ -0,0 +1,112 @@
+import asyncio
+
+from app.services.batch_upload import BatchUpload
+
+
+def _run_batch(service, files, rejects=(), concurrency=2):
+    async def scenario():
+        batch = BatchUpload(service, concurrency=concurrency)
+
+        async def submit():
+            for name, data in files:
+                await batch.add(name, data)
+            for name in rejects:
+                batch.reject(name, "file_too_large", "too large")
+            await batch.close()
+
+        submitter = asyncio.create_task(submit())
+        results = [result async for result in batch.results()]
+        await submitter
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_every_file_gets_one_result(telegram_service, db):
+    files = [(f"f{i}.txt", f"content {i}".encode()) for i in range(7)]
+    results = _run_batch(telegram_service, files, rejects=["huge.bin"])
+
+    assert sorted(result["index"] for result in results) == list(range(8))
+    by_name = {result["filename"]: result for result in results}
+    assert by_name["huge.bin"]["error"]["code"] == "file_too_large"
+    for name, data in files:
+        assert by_name[name]["duplicate"] is False
+        assert telegram_service.bot.sent[name].data == data
+        assert db.get_file_by_id(by_name[name]["short_id"])["filename"] == name
+
+
+def test_existing_content_is_not_sent_again(telegram_service, db):
+    existing = _run_batch(telegram_service, [("a.txt", b"same")])[0]["short_id"]
+    telegram_service.bot.sent.clear()
+
+    results = _run_batch(telegram_service, [("copy.txt", b"same"), ("b.txt", b"new")])
+
+    by_name = {result["filename"]: result for result in results}
+    assert by_name["copy.txt"] == {
+        "index": 0,
+        "filename": "copy.txt",
+        "short_id": existing,
+        "duplicate": True,
+    }
+    assert list(telegram_service.bot.sent) == ["b.txt"]
+
+
+def test_failed_send_is_reported_per_file(telegram_service, db):
+    send_document = telegram_service.bot.send_document
+
+    async def flaky_send(chat_id, document, filename, reply_to_message_id=None):
+        if filename == "bad.txt":
+            raise RuntimeError("telegram down")
+        return await send_document(chat_id, document, filename, reply_to_message_id)
+
+    telegram_service.bot.send_document = flaky_send
+    results = _run_batch(telegram_service, [("good.txt", b"1"), ("bad.txt", b"2")])
+
+    by_name = {result["filename"]: result for result in results}
+    assert by_name["bad.txt"]["error"] == {"code": "upload_failed", "message": "telegram down"}
+    assert "short_id" in by_name["good.txt"]
+
+
+def test_sent_files_are_registered_in_groups(telegram_service, db, monkeypatch):
+    groups = []
+    register_uploads = telegram_service.register_uploads
+
+    async def recording_register(records):
+        groups.append(len(records))
+        return await register_uploads(records)
+
+    monkeypatch.setattr(telegram_service, "register_uploads", recording_register)
+    files = [(f"f{i}.txt", f"{i}".encode()) for i in range(12)]
+    results = _run_batch(telegram_service, files, concurrency=4)
+
+    assert sum(groups) == 12
+    assert len(groups) < 12
+    assert all("short_id" in result for result in results)
+
+
+def test_abort_registers_sent_files_and_drops_queued_ones(telegram_service, db):
+    release = asyncio.Event()
+    send_document = telegram_service.bot.send_document
+
+    async def slow_send(chat_id, document, filename, reply_to_message_id=None):
+        await release.wait()
+        return await send_document(chat_id, document, filename, reply_to_message_id)
+
+    telegram_service.bot.send_document = slow_send
+
+    async def scenario():
+        batch = BatchUpload(telegram_service, concurrency=1)
+        await batch.add("a.txt", b"a")
+        await asyncio.sleep(0)
+        await batch.add("b.txt", b"b")
+        abort = asyncio.create_task(batch.abort())
+        await asyncio.sleep(0.01)
+        assert not abort.done()
+        release.set()
+        await asyncio.wait_for(abort, timeout=1)
+        return [*batch._workers, batch._registrar, batch._done]
+
+    tasks = asyncio.run(scenario())
+    assert all(task.done() for task in tasks)
+    assert list(telegram_service.bot.sent) == ["a.txt"]
+    assert db.count_files(local_only=False) == 1
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from app.services import telegram_service as telegram_service_module
+
+CHUNK = 10
+DATA = bytes(range(48, 73))  # 25 字节：3 个分块
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(telegram_service_module, "CHUNK_SIZE_BYTES", CHUNK)
+
+
+def _stream_upload(service, filename, data, piece_size=4):
+    async def scenario():
+        upload = service.open_upload(filename)
+        for i in range(0, len(data), piece_size):
+            await upload.write(data[i : i + piece_size])
+        return await upload.finish()
+
+    return asyncio.run(scenario())
+
+
+def test_streamed_upload_records_content_hash(telegram_service, db):
+    short_id = _stream_upload(telegram_service, "a.bin", DATA)
+
+    meta = db.get_file_by_id(short_id)
+    assert meta["content_hash"] == hashlib.sha256(DATA).hexdigest()
+    assert (meta["blob_kind"], meta["chunk_count"]) == ("manifest", 3)
+
+
+def test_streamed_duplicate_returns_existing_file_and_deletes_its_chunks(telegram_service, db):
+    first = _stream_upload(telegram_service, "a.bin", DATA)
+    telegram_service.bot.sent.clear()
+
+    second = _stream_upload(telegram_service, "copy.bin", DATA)
+
+    assert second == first
+    assert db.count_files(local_only=False) == 1
+    # 重复内容只能在数据全部发送后才被发现：分块已发送，随后被删除，不上传清单
+    sent = telegram_service.bot.sent
+    assert "copy.bin.manifest" not in sent
+    assert sorted(telegram_service.bot.deleted) == sorted(
+        message.message_id for message in sent.values()
+    )
+
+
+def test_small_duplicate_is_not_sent(telegram_service, db):
+    first = _stream_upload(telegram_service, "a.txt", b"hello")
+    telegram_service.bot.sent.clear()
+
+    assert _stream_upload(telegram_service, "b.txt", b"hello") == first
+    assert telegram_service.bot.sent == {}
+
+
+def test_find_duplicate_ignores_unhashed_files(telegram_service, db):
+    # Bot 收到的文件登记时没有哈希，下载完成并回填之前不会被匹配
+    db.add_file_metadata("bot.txt", "1:bot", 5)
+    content_hash = hashlib.sha256(b"hello").hexdigest()
+    assert asyncio.run(telegram_service.find_duplicate(content_hash)) is None
+
+    db.update_content_hash("1:bot", content_hash)
+    assert (
+        asyncio.run(telegram_service.find_duplicate(content_hash))
+        == db.get_file_by_id("1:bot")["short_id"]
+    )
@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+
+import pytest
+
+from app import database
+
+
+def test_connections_use_wal(db):
+    with database.get_pool().reader() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_reader_connection_is_reused_per_thread(db):
+    pool = database.get_pool()
+    with pool.reader() as first, pool.reader() as second:
+        assert first is second
+
+    other = []
+
+    def read_in_thread():
+        with pool.reader() as conn:
+            other.append(conn)
+
+    thread = threading.Thread(target=read_in_thread)
+    thread.start()
+    thread.join()
+    assert other[0] is not first
+
+
+def test_reader_connection_is_read_only(db):
+    with database.get_pool().reader() as conn, pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM files")
+
+
+def test_writer_rolls_back_on_error(db):
+    with pytest.raises(RuntimeError), database.get_pool().writer() as conn:
+        conn.execute("INSERT INTO files (filename, file_id, filesize) VALUES ('a.txt', '1:a', 1)")
+        raise RuntimeError("boom")
+    assert database.get_file_by_id("1:a") is None
+
+
+def test_readers_see_committed_writes(db):
+    short_id = database.add_file_metadata("a.txt", "1:a", 10)
+    assert database.get_file_by_id(short_id)["file_id"] == "1:a"
+
+
+def test_pool_is_rebuilt_when_database_url_changes(db, tmp_path, monkeypatch):
+    pool = database.get_pool()
+    assert database.get_pool() is pool
+    monkeypatch.setattr(database, "DATABASE_URL", str(tmp_path / "other.db"))
+    assert database.get_pool() is not pool
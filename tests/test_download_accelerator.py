@@ -0,0 +1,272 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from app.services import download_accelerator
+from app.services.download_accelerator import DownloadAccelerator, HostTuning
+
+URL = "https://files.test/file/a"
+SEGMENT = 10
+DATA = os.urandom(95)  # 10 个分段：9 个完整分段 + 5 字节的尾段
+
+
+@pytest.fixture(autouse=True)
+def fixed_tuning(monkeypatch):
+    """每个测试使用新的主机参数，并固定分段大小与并发数（不随测得的吞吐量调整）。"""
+    monkeypatch.setattr(download_accelerator, "_host_tunings", {})
+    monkeypatch.setattr(HostTuning, "record", lambda *_: None)
+    monkeypatch.setattr(download_accelerator, "HEDGE_MIN_DELAY", 0.02)
+
+
+def _range(request):
+    start, end = (int(v) for v in request.headers["Range"][len("bytes=") :].split("-"))
+    return start, end
+
+
+class _Server:
+    """按 Range 返回 DATA 的模拟服务器；delays 指定各分段起点的响应延迟，记录请求顺序与最大并发数。"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.requested: list[int] = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, request):
+        start, end = _range(request)
+        self.requested.append(start)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(start, 0))
+        finally:
+            self.active -= 1
+        return httpx.Response(206, content=DATA[start : end + 1])
+
+
+def _accelerator(client, concurrency):
+    accelerator = DownloadAccelerator(client)
+    tuning = accelerator.tuning_for(URL)
+    tuning.segment_size = SEGMENT
+    tuning.concurrency = concurrency
+    return accelerator, tuning
+
+
+def _download(server, concurrency=4, max_inflight=10 * SEGMENT, consume=None):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(server.handle)) as client:
+            accelerator, tuning = _accelerator(client, concurrency)
+            stream = accelerator.accelerated_download(URL, len(DATA), SEGMENT, max_inflight)
+            if consume is not None:
+                return await consume(stream), tuning
+            return b"".join([piece async for piece in stream]), tuning
+
+    return asyncio.run(run())
+
+
+def test_segments_are_yielded_in_order_as_they_land():
+    # 后面的分段先完成，输出顺序仍与文件一致
+    server = _Server(delays={0: 0.03, 10: 0.02, 20: 0.01})
+    body, _ = _download(server)
+
+    assert body == DATA
+    assert sorted(server.requested) == list(range(0, len(DATA), SEGMENT))
+
+
+def test_window_caps_concurrent_requests():
+    server = _Server(delays=dict.fromkeys(range(0, len(DATA), SEGMENT), 0.005))
+    body, _ = _download(server, concurrency=3)
+
+    assert body == DATA
+    assert server.max_active == 3
+
+
+def test_inflight_byte_cap_limits_the_window():
+    server = _Server(delays=dict.fromkeys(range(0, len(DATA), SEGMENT), 0.005))
+    body, _ = _download(server, concurrency=8, max_inflight=2 * SEGMENT)
+
+    assert body == DATA
+    assert server.max_active <= 2
+
+
+def test_slow_consumer_stops_new_requests():
+    server = _Server()
+
+    async def read_first(stream):
+        first = await stream.__anext__()
+        # 调用方不再读取：窗口已满，不会继续请求后面的分段
+        await asyncio.sleep(0.05)
+        requested = len(server.requested)
+        await stream.aclose()
+        return first, requested
+
+    (first, requested), _ = _download(server, concurrency=3, consume=read_first)
+
+    assert first == DATA[:SEGMENT]
+    assert requested == 3
+
+
+def test_first_bytes_arrive_before_the_last_segment_is_requested():
+    server = _Server()
+
+    async def read_first(stream):
+        first = await stream.__anext__()
+        requested = list(server.requested)
+        await stream.aclose()
+        return first, requested
+
+    (first, requested), _ = _download(server, concurrency=2, consume=read_first)
+
+    assert first == DATA[:SEGMENT]
+    assert len(DATA) - len(DATA) % SEGMENT not in requested
+
+
+def test_closing_the_stream_cancels_pending_segments():
+    server = _Server(delays={10: 10, 20: 10})
+
+    async def read_first(stream):
+        await stream.__anext__()
+        await asyncio.wait_for(stream.aclose(), timeout=1)
+        return server.active
+
+    active, _ = _download(server, concurrency=3, consume=read_first)
+    assert active == 0
+
+
+def test_slow_segment_is_hedged():
+    requested = []
+
+    async def handle(request):
+        start, end = _range(request)
+        requested.append(start)
+        if start == 30 and requested.count(30) == 1:
+            # 第一次请求该分段时卡住，由对冲副本完成
+            await asyncio.sleep(10)
+        return httpx.Response(206, content=DATA[start : end + 1])
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handle)) as client:
+            accelerator, tuning = _accelerator(client, 4)
+            tuning.connection_throughput = 1e9
+            stream = accelerator.accelerated_download(URL, len(DATA), SEGMENT, 10 * SEGMENT)
+            body = b"".join([piece async for piece in stream])
+            return body, tuning
+
+    body, tuning = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert body == DATA
+    assert requested.count(30) == 2
+    assert tuning.hedge_wins >= 1
+
+
+def test_no_hedge_without_throughput_samples():
+    tuning = HostTuning(SEGMENT, 1)
+    attempts = 0
+
+    async def attempt():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        return await DownloadAccelerator(None).run_segment(tuning, SEGMENT, attempt)
+
+    assert asyncio.run(run()) == "done"
+    assert (attempts, tuning.hedge_count) == (1, 0)
+
+
+def test_hedge_wins_and_the_slow_copy_is_cancelled():
+    tuning = HostTuning(SEGMENT, 1)
+    tuning.connection_throughput = 1e9
+    cancelled = []
+    attempts = 0
+
+    async def attempt():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return "hedge"
+
+    async def run():
+        return await DownloadAccelerator(None).run_segment(tuning, SEGMENT, attempt)
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=5)) == "hedge"
+    assert cancelled == [True]
+    assert (tuning.hedge_count, tuning.hedge_wins) == (1, 1)
+
+
+def _status_error(status_code, headers=None):
+    return httpx.HTTPStatusError(
+        "", request=None, response=httpx.Response(status_code, headers=headers)
+    )
+
+
+def test_transient_failures_are_retried(monkeypatch):
+    monkeypatch.setattr(download_accelerator, "RETRY_BASE_DELAY", 0.001)
+    errors = [httpx.ConnectError("reset"), _status_error(503)]
+
+    async def attempt():
+        if errors:
+            raise errors.pop(0)
+        return "done"
+
+    async def run():
+        return await DownloadAccelerator(None).run_segment(HostTuning(SEGMENT, 1), SEGMENT, attempt)
+
+    assert asyncio.run(run()) == "done"
+    assert errors == []
+
+
+@pytest.mark.parametrize("attempt_no", [1, 2, 3, 4])
+def test_backoff_doubles_with_jitter(attempt_no):
+    delay = DownloadAccelerator._retry_delay(attempt_no, httpx.ConnectError("reset"))
+    ceiling = download_accelerator.RETRY_BASE_DELAY * 2 ** (attempt_no - 1)
+    assert ceiling / 2 <= delay <= ceiling
+
+
+def test_client_errors_are_not_retried():
+    attempts = 0
+
+    async def forbidden():
+        nonlocal attempts
+        attempts += 1
+        raise _status_error(403)
+
+    async def run():
+        await DownloadAccelerator(None).run_segment(HostTuning(SEGMENT, 1), SEGMENT, forbidden)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+    assert attempts == 1
+
+
+def test_retry_after_is_a_lower_bound_capped_at_the_max_delay():
+    retry_delay = DownloadAccelerator._retry_delay
+    assert retry_delay(1, _status_error(429, {"Retry-After": "7"})) == 7
+    assert retry_delay(1, _status_error(429, {"Retry-After": "3600"})) == 30
+
+
+def test_exhausted_retries_raise_the_last_error(monkeypatch):
+    monkeypatch.setattr(download_accelerator, "RETRY_BASE_DELAY", 0.001)
+    attempts = 0
+
+    async def unavailable():
+        nonlocal attempts
+        attempts += 1
+        raise _status_error(503)
+
+    async def run():
+        await DownloadAccelerator(None).run_segment(
+            HostTuning(SEGMENT, 1), SEGMENT, unavailable, attempts=3
+        )
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+    assert attempts == 3
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from app.services.download_queue import (
+    LARGE_FILE_MIN_BYTES,
+    SIZE_CLASS_LARGE,
+    SIZE_CLASS_MEDIUM,
+    SIZE_CLASS_SMALL,
+    SMALL_FILE_MAX_BYTES,
+    DownloadQueue,
+    size_class,
+)
+
+MB = 1024 * 1024
+
+
+def _file(file_id, filesize, category="other"):
+    return {"file_id": file_id, "filesize": filesize, "category": category}
+
+
+def _drain(queue, small_only=False):
+    async def drain():
+        ids = []
+        while not queue.empty():
+            item = await asyncio.wait_for(queue.get(lambda: small_only), timeout=1)
+            ids.append(item["file_id"])
+        return ids
+
+    return asyncio.run(drain())
+
+
+@pytest.mark.parametrize(
+    ("filesize", "expected"),
+    [
+        (None, SIZE_CLASS_SMALL),
+        (SMALL_FILE_MAX_BYTES, SIZE_CLASS_SMALL),
+        (SMALL_FILE_MAX_BYTES + 1, SIZE_CLASS_MEDIUM),
+        (LARGE_FILE_MIN_BYTES - 1, SIZE_CLASS_MEDIUM),
+        (LARGE_FILE_MIN_BYTES, SIZE_CLASS_LARGE),
+    ],
+)
+def test_size_class(filesize, expected):
+    assert size_class(filesize) == expected
+
+
+def test_orders_by_size_class_then_category_then_arrival():
+    queue = DownloadQueue()
+    queue.put(_file("large", LARGE_FILE_MIN_BYTES, "image"))
+    queue.put(_file("medium-video", 100 * MB, "video"))
+    queue.put(_file("medium-image", 100 * MB, "image"))
+    queue.put(_file("small-video", MB, "video"))
+    queue.put(_file("small-image-1", MB, "image"))
+    queue.put(_file("small-image-2", MB, "image"))
+
+    assert _drain(queue) == [
+        "small-image-1",
+        "small-image-2",
+        "small-video",
+        "medium-image",
+        "medium-video",
+        "large",
+    ]
+
+
+def test_same_file_is_queued_once():
+    queue = DownloadQueue()
+    assert queue.put(_file("a", MB))
+    assert not queue.put(_file("a", MB))
+    assert len(queue) == 1
+    assert "a" in queue
+    assert queue.file_ids() == ["a"]
+
+
+def test_demand_moves_queued_file_to_the_front():
+    queue = DownloadQueue()
+    queue.put(_file("small", MB, "image"))
+    queue.put(_file("wanted", LARGE_FILE_MIN_BYTES, "video"))
+    queue.mark_demand("wanted")
+
+    assert _drain(queue) == ["wanted", "small"]
+    assert queue.lane_sizes() == {"small": 0, "other": 0}
+
+
+def test_demand_recorded_before_enqueue_applies_on_put():
+    queue = DownloadQueue()
+    queue.mark_demand("wanted")
+    queue.put(_file("small", MB, "image"))
+    queue.put(_file("wanted", 100 * MB, "other"))
+
+    assert _drain(queue) == ["wanted", "small"]
+
+
+def test_small_lane_ignores_large_files():
+    queue = DownloadQueue()
+    queue.put(_file("big", 100 * MB))
+    queue.put(_file("tiny", MB))
+    assert queue.lane_sizes() == {"small": 1, "other": 1}
+
+    async def take_small():
+        first = await queue.get(lambda: True)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.get(lambda: True), timeout=0.05)
+        return first["file_id"]
+
+    assert asyncio.run(take_small()) == "tiny"
+    assert queue.file_ids() == ["big"]
+
+
+def test_get_waits_for_put():
+    queue = DownloadQueue()
+
+    async def scenario():
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        queue.put(_file("a", MB))
+        return (await asyncio.wait_for(getter, timeout=1))["file_id"]
+
+    assert asyncio.run(scenario()) == "a"
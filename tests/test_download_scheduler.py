@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from app.services import download_service as download_service_module
+from app.services.download_service import DownloadService
+
+
+def _settings(enabled):
+    return {
+        "enabled": enabled,
+        "download_dir": "/tmp",
+        "file_types": ["all"],
+        "max_size": 1 << 40,
+        "min_size": 0,
+        "threads": 0,
+        "max_retries": 5,
+    }
+
+
+def _run_monitor(service, seconds):
+    async def run():
+        service.running = True
+        task = asyncio.create_task(service._monitor_and_download())
+        await asyncio.sleep(seconds)
+        service.running = False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(download_service_module, "DOWNLOAD_RECONCILE_INTERVAL", 600)
+    return DownloadService(telegram_service=None)
+
+
+def test_monitor_waits_while_auto_download_is_disabled(service, monkeypatch):
+    calls = []
+
+    async def get_settings():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return _settings(enabled=False)
+
+    monkeypatch.setattr(service, "_get_download_settings", get_settings)
+    _run_monitor(service, 0.2)
+
+    # 对账请求在关闭期间保持挂起，但循环只读一次配置后就等待唤醒
+    assert len(calls) == 1
+    assert service._reconcile_requested is True
+
+
+def test_monitor_waits_after_settings_error(service, monkeypatch):
+    calls = []
+
+    async def get_settings():
+        calls.append(1)
+        await asyncio.sleep(0)
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(service, "_get_download_settings", get_settings)
+    _run_monitor(service, 0.2)
+
+    assert len(calls) == 1
+
+
+def test_request_reconcile_wakes_the_monitor(service, monkeypatch):
+    enabled = False
+    reconciled = []
+
+    async def get_settings():
+        await asyncio.sleep(0)
+        return _settings(enabled=enabled)
+
+    async def fetch_and_queue(settings):
+        reconciled.append(1)
+
+    async def next_retry_delay(settings):
+        return None
+
+    monkeypatch.setattr(service, "_get_download_settings", get_settings)
+    monkeypatch.setattr(service, "_fetch_and_queue_files_for_download", fetch_and_queue)
+    monkeypatch.setattr(service, "_next_retry_delay", next_retry_delay)
+
+    async def run():
+        nonlocal enabled
+        service.running = True
+        task = asyncio.create_task(service._monitor_and_download())
+        await asyncio.sleep(0.05)
+        assert reconciled == []
+        enabled = True
+        service.request_reconcile()
+        await asyncio.sleep(0.05)
+        service.running = False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert reconciled == [1]
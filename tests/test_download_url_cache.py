@@ -0,0 +1,206 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app.services import telegram_service as telegram_service_module
+from app.services.download_url_cache import DownloadUrlCache
+
+
+def _counting_resolver(url="http://tg.test/file", delay=0.0):
+    calls = []
+
+    async def resolve():
+        calls.append(url)
+        await asyncio.sleep(delay)
+        return url
+
+    return resolve, calls
+
+
+def test_hit_after_miss():
+    cache = DownloadUrlCache()
+    resolve, calls = _counting_resolver()
+
+    async def scenario():
+        assert await cache.get("a", resolve) == "http://tg.test/file"
+        assert await cache.get("a", resolve) == "http://tg.test/file"
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_concurrent_misses_share_one_resolution():
+    cache = DownloadUrlCache()
+    resolve, calls = _counting_resolver(delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("a", resolve) for _ in range(10)))
+
+    assert asyncio.run(scenario()) == ["http://tg.test/file"] * 10
+    assert len(calls) == 1
+    assert cache.coalesced == 9
+
+
+def test_cancelled_caller_does_not_cancel_shared_resolution():
+    cache = DownloadUrlCache()
+    resolve, calls = _counting_resolver(delay=0.05)
+
+    async def scenario():
+        first = asyncio.create_task(cache.get("a", resolve))
+        second = asyncio.create_task(cache.get("a", resolve))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "http://tg.test/file"
+    assert len(calls) == 1
+
+
+def test_failed_resolution_is_not_cached():
+    cache = DownloadUrlCache()
+
+    async def resolve_none():
+        return None
+
+    resolve, calls = _counting_resolver()
+
+    async def scenario():
+        assert await cache.get("a", resolve_none) is None
+        assert await cache.get("a", resolve) == "http://tg.test/file"
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+
+
+def test_expired_entries_are_resolved_again():
+    cache = DownloadUrlCache(ttl=0)
+    resolve, calls = _counting_resolver()
+
+    async def scenario():
+        await cache.get("a", resolve)
+        await cache.get("a", resolve)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert cache.expirations == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = DownloadUrlCache(max_entries=2)
+    resolve, calls = _counting_resolver()
+
+    async def scenario():
+        await cache.get("a", resolve)
+        await cache.get("b", resolve)
+        await cache.get("a", resolve)
+        await cache.get("c", resolve)
+        await cache.get("a", resolve)
+        await cache.get("b", resolve)
+
+    asyncio.run(scenario())
+    # a 最近被访问，c 加入时淘汰 b；之后再取 b 需要重新解析
+    assert len(calls) == 4
+    assert cache.evictions == 2
+
+
+def test_invalidate_forces_a_new_resolution():
+    cache = DownloadUrlCache()
+    resolve, calls = _counting_resolver()
+
+    async def scenario():
+        await cache.get("a", resolve)
+        cache.invalidate("a")
+        await cache.get("a", resolve)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_resolution_in_flight_during_clear_is_not_cached():
+    cache = DownloadUrlCache()
+    stale, _ = _counting_resolver("http://tg.test/old-token", delay=0.05)
+    fresh, _ = _counting_resolver("http://tg.test/new-token")
+
+    async def scenario():
+        pending = asyncio.create_task(cache.get("a", stale))
+        await asyncio.sleep(0.01)
+        cache.clear()
+        assert await cache.get("a", fresh) == "http://tg.test/new-token"
+        await pending
+        return await cache.get("a", fresh)
+
+    assert asyncio.run(scenario()) == "http://tg.test/new-token"
+
+
+def test_concurrent_get_download_url_calls_get_file_once(telegram_service, monkeypatch):
+    cache = DownloadUrlCache()
+    monkeypatch.setattr(telegram_service_module, "download_url_cache", cache)
+    calls = []
+
+    async def get_file(file_id):
+        calls.append(file_id)
+        await asyncio.sleep(0.02)
+        return SimpleNamespace(file_path=f"https://api.telegram.test/file/{file_id}")
+
+    telegram_service.bot.get_file = get_file
+
+    async def scenario():
+        return await asyncio.gather(
+            *(telegram_service.get_download_url(file_id) for file_id in ["a"] * 5 + ["b"] * 3)
+        )
+
+    urls = asyncio.run(scenario())
+    assert (
+        urls == ["https://api.telegram.test/file/a"] * 5 + ["https://api.telegram.test/file/b"] * 3
+    )
+    assert sorted(calls) == ["a", "b"]
+    assert cache.stats()["coalesced"] == 6
+    assert cache.stats()["inflight"] == 0
+
+
+def test_purge_expired_drops_only_expired_entries():
+    cache = DownloadUrlCache(ttl=60)
+    resolve, _ = _counting_resolver()
+
+    async def scenario():
+        await cache.get("fresh", resolve)
+        await cache.get("old", resolve)
+
+    asyncio.run(scenario())
+    url, _ = cache._entries["old"]
+    cache._entries["old"] = (url, time.monotonic() - 1)
+
+    assert cache.purge_expired() == 1
+    assert list(cache._entries) == ["fresh"]
+    assert cache.expirations == 1
+
+
+def test_background_sweeper_starts_once_and_stops():
+    cache = DownloadUrlCache()
+
+    async def scenario():
+        cache.start()
+        sweeper = cache._sweeper
+        cache.start()
+        assert cache._sweeper is sweeper
+        await cache.stop()
+        return sweeper
+
+    sweeper = asyncio.run(scenario())
+    assert sweeper.cancelled()
+    assert cache._sweeper is None
+
+
+def test_eviction_keeps_the_cache_at_its_cap():
+    cache = DownloadUrlCache(max_entries=3)
+    resolve, _ = _counting_resolver()
+
+    async def scenario():
+        for file_id in "abcdef":
+            await cache.get(file_id, resolve)
+
+    asyncio.run(scenario())
+    assert list(cache._entries) == ["d", "e", "f"]
+    assert cache.stats()["size"] == 3
+    assert cache.evictions == 3
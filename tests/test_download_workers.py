@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+
+from app.services import download_service as download_service_module
+from app.services.download_queue import LARGE_FILE_MIN_BYTES
+from app.services.download_service import DownloadService
+
+MB = 1024 * 1024
+
+
+def _file(file_id, filesize, category="other"):
+    return {
+        "file_id": file_id,
+        "filename": f"{file_id}.bin",
+        "filesize": filesize,
+        "category": category,
+    }
+
+
+class _Downloads:
+    """代替 _download_file：记录开始顺序，每个文件等到 release(file_id) 后才结束。"""
+
+    def __init__(self, blocking=True):
+        self.started: list[str] = []
+        self.blocking = blocking
+        self._gates: dict[str, asyncio.Event] = {}
+
+    def gate(self, file_id):
+        return self._gates.setdefault(file_id, asyncio.Event())
+
+    def release(self, file_id):
+        self.gate(file_id).set()
+
+    async def download(self, file_info, settings, status):
+        self.started.append(file_info["file_id"])
+        if self.blocking:
+            await self.gate(file_info["file_id"]).wait()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(download_service_module, "DOWNLOAD_SMALL_FILE_WORKERS", 1)
+    service = DownloadService(telegram_service=None)
+
+    async def get_settings():
+        return {}
+
+    monkeypatch.setattr(service, "_get_download_settings", get_settings)
+    return service
+
+
+def _run(service, downloads, scenario):
+    service._download_file = downloads.download
+
+    async def run():
+        service.running = True
+        try:
+            return await scenario()
+        finally:
+            service.running = False
+            tasks = list(service._workers.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_reserved_worker_keeps_small_files_moving(service):
+    downloads = _Downloads()
+
+    async def scenario():
+        service.resize_workers(3)
+        for file_id in ("big-1", "big-2", "big-3"):
+            service.download_queue.put(_file(file_id, LARGE_FILE_MIN_BYTES))
+        await _settle()
+        # 两个普通协程被大文件占满，预留协程不取大文件
+        assert sorted(downloads.started) == ["big-1", "big-2"]
+        assert service.download_queue.file_ids() == ["big-3"]
+
+        service.download_queue.put(_file("tiny", MB, "image"))
+        await _settle()
+        assert downloads.started[-1] == "tiny"
+        return {status["worker_id"]: status["lane"] for status in service.get_worker_status()}
+
+    lanes = _run(service, downloads, scenario)
+    assert lanes == {1: "small", 2: "any", 3: "any"}
+
+
+def test_single_worker_has_no_reserved_lane(service):
+    downloads = _Downloads()
+
+    async def scenario():
+        service.resize_workers(1)
+        service.download_queue.put(_file("big", LARGE_FILE_MIN_BYTES))
+        await _settle()
+        return list(downloads.started), service.get_worker_status()[0]["lane"]
+
+    assert _run(service, downloads, scenario) == (["big"], "any")
+
+
+def test_worker_drains_queue_in_priority_order(service):
+    downloads = _Downloads(blocking=False)
+
+    async def scenario():
+        service.resize_workers(1)
+        service.download_queue.put(_file("large", LARGE_FILE_MIN_BYTES, "image"))
+        service.download_queue.put(_file("medium", 100 * MB, "image"))
+        service.download_queue.put(_file("small-video", MB, "video"))
+        service.download_queue.put(_file("small-image", MB, "image"))
+        await _settle()
+
+    _run(service, downloads, scenario)
+    assert downloads.started == ["small-image", "small-video", "medium", "large"]
+
+
+def test_shrinking_retires_idle_workers_now_and_busy_ones_after_their_file(service):
+    downloads = _Downloads()
+
+    async def scenario():
+        service.resize_workers(3)
+        service.download_queue.put(_file("big", LARGE_FILE_MIN_BYTES))
+        await _settle()
+        busy_worker = next(
+            status["worker_id"]
+            for status in service.get_worker_status()
+            if status.get("file_id") == "big"
+        )
+
+        service.resize_workers(1)
+        await _settle()
+        statuses = {status["worker_id"]: status for status in service.get_worker_status()}
+        # 大文件由非预留协程（2 或 3）下载：空闲的另一个立即退出，忙碌的标记为退役
+        assert sorted(statuses) == [1, busy_worker]
+        assert statuses[busy_worker]["retiring"] is True
+
+        downloads.release("big")
+        await _settle()
+        return sorted(service._workers)
+
+    assert _run(service, downloads, scenario) == [1]
+
+
+def test_growing_starts_new_workers(service):
+    downloads = _Downloads()
+
+    async def scenario():
+        service.resize_workers(1)
+        service.resize_workers(4)
+        await _settle()
+        return [status["state"] for status in service.get_worker_status()]
+
+    assert _run(service, downloads, scenario) == ["idle"] * 4
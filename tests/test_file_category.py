@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from app import database
+
+
+@pytest.mark.parametrize(
+    ("mime_type", "filename", "category"),
+    [
+        ("image/png", "a.bin", "image"),
+        ("video/mp4", None, "video"),
+        ("audio/mpeg", "a.mp3", "audio"),
+        ("application/pdf", "a", "document"),
+        (None, "Movie.MKV", "video"),
+        ("application/octet-stream", "report.docx", "document"),
+        (None, "archive.zip", "other"),
+        (None, None, "other"),
+    ],
+)
+def test_category_from_mime_or_extension(mime_type, filename, category):
+    assert database._get_file_category_from_mime(mime_type, filename) == category
+
+
+def test_category_is_stored_on_insert(db):
+    short_id = database.add_file_metadata("clip.mov", "1:a", 1)
+    assert database.get_file_by_id(short_id)["category"] == "video"
+
+
+def test_existing_rows_are_backfilled(tmp_path, monkeypatch):
+    database_url = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(database_url)
+    conn.execute(
+        """
+        CREATE TABLE files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            file_id TEXT NOT NULL UNIQUE,
+            filesize INTEGER NOT NULL,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            short_id TEXT UNIQUE,
+            local_path TEXT,
+            download_count INTEGER DEFAULT 0,
+            mime_type TEXT
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO files (filename, file_id, filesize, short_id, mime_type) VALUES (?, ?, ?, ?, ?)",
+        [
+            ("a.jpg", "1:a", 1, "s1", "image/jpeg"),
+            ("b.mp3", "2:b", 1, "s2", None),
+            ("c.zip", "3:c", 1, "s3", "application/zip"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(database, "DATABASE_URL", database_url)
+    try:
+        database.init_db()
+        categories = {f: database.get_file_by_id(f)["category"] for f in ("1:a", "2:b", "3:c")}
+        assert categories == {"1:a": "image", "2:b": "audio", "3:c": "other"}
+        assert database.count_files(category="音频", local_only=False) == 1
+    finally:
+        database.get_pool().close_all()
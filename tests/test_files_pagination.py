@@ -0,0 +1,70 @@
+import pytest
+
+from app import database
+
+
+def _add_files(count):
+    for i in range(count):
+        # 大小只取 3 种值，制造排序字段相同的记录，检验 id 作为第二排序键
+        database.add_file_metadata(f"file{i:02d}.txt", f"{i + 1}:f{i}", (i % 3) * 100, "text/plain")
+
+
+def _collect(sort_by, sort_order, limit):
+    pages = []
+    cursor = None
+    while True:
+        page = database.get_files_page(
+            sort_by=sort_by, sort_order=sort_order, local_only=False, limit=limit, cursor=cursor
+        )
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("sort_by", database.FILE_SORT_COLUMNS)
+@pytest.mark.parametrize("sort_order", ["asc", "desc"])
+def test_pages_match_full_listing(db, sort_by, sort_order):
+    _add_files(23)
+    pages = _collect(sort_by, sort_order, limit=5)
+
+    assert [len(items) for items in pages] == [5, 5, 5, 5, 3]
+    paged_ids = [item["file_id"] for items in pages for item in items]
+    full = database.get_all_files(sort_by=sort_by, sort_order=sort_order, local_only=False)
+    assert paged_ids == [item["file_id"] for item in full]
+
+
+def test_last_full_page_has_no_cursor(db):
+    _add_files(4)
+    page = database.get_files_page(local_only=False, limit=4)
+    assert len(page["items"]) == 4
+    assert page["next_cursor"] is None
+
+
+def test_cursor_must_match_sort(db):
+    _add_files(3)
+    cursor = database.get_files_page(sort_by="filename", local_only=False, limit=1)["next_cursor"]
+    with pytest.raises(ValueError):
+        database.get_files_page(sort_by="filesize", local_only=False, limit=1, cursor=cursor)
+
+
+@pytest.mark.parametrize(
+    "cursor", ["not-a-cursor", database.encode_files_cursor("id; DROP", "ASC", 1, 1)]
+)
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        database.decode_files_cursor(cursor)
+
+
+def test_count_uses_the_same_filters(db):
+    database.add_file_metadata("a.jpg", "1:a", 1, "image/jpeg")
+    database.add_file_metadata("b.mp4", "2:b", 1, "video/mp4")
+    database.add_file_metadata("c.png", "3:c", 1, "image/png")
+    database.update_local_path("3:c", "c.png")
+
+    assert database.count_files(local_only=False) == 3
+    assert database.count_files(category="image", local_only=False) == 2
+    assert database.count_files(category="图片", local_only=False) == 2
+    assert database.count_files(category="image", local_only=True) == 1
+    page = database.get_files_page(category="image", local_only=False, limit=10)
+    assert sorted(item["file_id"] for item in page["items"]) == ["1:a", "3:c"]
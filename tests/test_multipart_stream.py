@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import multipart_stream
+from app.api.multipart_stream import FIELD, FILE_DATA, FILE_END, FILE_START, iter_multipart
+
+BOUNDARY = "testboundary"
+
+
+class _FakeRequest:
+    def __init__(self, body, piece_size, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self._body = body
+        self._piece_size = piece_size
+
+    async def stream(self):
+        for i in range(0, len(self._body), self._piece_size):
+            yield self._body[i : i + self._piece_size]
+
+
+def _part(disposition, content, content_type=None):
+    headers = f"Content-Disposition: form-data; {disposition}\r\n"
+    if content_type:
+        headers += f"Content-Type: {content_type}\r\n"
+    return f"--{BOUNDARY}\r\n{headers}\r\n".encode() + content + b"\r\n"
+
+
+def _body(*parts):
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _events(body, piece_size=65536, **kwargs):
+    async def collect():
+        return [event async for event in iter_multipart(_FakeRequest(body, piece_size, **kwargs))]
+
+    return asyncio.run(collect())
+
+
+FILE_CONTENT = bytes(range(256)) * 40 + b"\r\n--not-the-boundary\r\n"
+BODY = _body(
+    _part('name="key"', b"secret"),
+    _part('name="file"; filename="photo.jpg"', FILE_CONTENT, "image/jpeg"),
+    _part('name="note"', "备注".encode()),
+)
+
+
+@pytest.mark.parametrize("piece_size", [1, 7, 4096, len(BODY)])
+def test_fields_and_file_in_order(piece_size):
+    events = _events(BODY, piece_size)
+
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == FIELD
+    assert kinds[1] == FILE_START
+    assert kinds[-2:] == [FILE_END, FIELD]
+    assert set(kinds[2:-2]) == {FILE_DATA}
+
+    assert events[0][1] == ("key", "secret")
+    assert events[-1][1] == ("note", "备注")
+    start = events[1][1]
+    assert (start.name, start.filename, start.content_type) == ("file", "photo.jpg", "image/jpeg")
+    assert b"".join(value for kind, value in events if kind == FILE_DATA) == FILE_CONTENT
+
+
+def test_file_data_is_yielded_before_the_body_ends():
+    body = _body(_part('name="file"; filename="a.bin"', b"x" * 10000))
+
+    async def first_data():
+        async for kind, value in iter_multipart(_FakeRequest(body, 1000)):
+            if kind == FILE_DATA:
+                return len(value)
+
+    assert asyncio.run(first_data()) < 10000
+
+
+@pytest.mark.parametrize(
+    "content_type",
+    ["application/json", "multipart/form-data", "application/x-www-form-urlencoded"],
+)
+def test_non_multipart_request_is_rejected(content_type):
+    with pytest.raises(HTTPException) as exc_info:
+        _events(b"{}", content_type=content_type)
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail["code"] == "invalid_multipart"
+
+
+def test_part_without_name_is_rejected():
+    with pytest.raises(HTTPException) as exc_info:
+        _events(_body(_part('filename="a.bin"', b"data")))
+    assert exc_info.value.status_code == 400
+
+
+def test_oversized_field_is_rejected(monkeypatch):
+    monkeypatch.setattr(multipart_stream, "MAX_FIELD_SIZE", 16)
+    with pytest.raises(HTTPException) as exc_info:
+        _events(_body(_part('name="key"', b"x" * 17)))
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+from app.services.partial_download import PartialDownload, sweep_stale_partials
+
+
+def _write(partial, start, data):
+    partial.pwrite(start, data)
+    partial.mark_completed(start, start + len(data))
+
+
+def test_resume_skips_checkpointed_ranges(tmp_path):
+    data = os.urandom(1000)
+    partial = PartialDownload(str(tmp_path), "1:a", len(data))
+    assert partial.open() == 0
+    _write(partial, 0, data[:300])
+    _write(partial, 600, data[600:800])
+    partial.close()
+
+    resumed = PartialDownload(str(tmp_path), "1:a", len(data))
+    assert resumed.open() == 500
+    assert resumed.missing_ranges(0, len(data)) == [(300, 600), (800, 1000)]
+    assert resumed.missing_ranges(100, 700) == [(300, 600)]
+
+    _write(resumed, 300, data[300:600])
+    _write(resumed, 800, data[800:])
+    final_path = tmp_path / "a.bin"
+    resumed.finalize(str(final_path))
+
+    assert final_path.read_bytes() == data
+    assert not os.path.exists(resumed.part_path)
+    assert not os.path.exists(resumed.meta_path)
+
+
+def test_unflushed_ranges_are_not_trusted(tmp_path):
+    partial = PartialDownload(str(tmp_path), "1:a", 100)
+    partial.open()
+    _write(partial, 0, b"x" * 50)
+    partial.checkpoint()
+    _write(partial, 50, b"y" * 50)
+    # 模拟进程被杀：第二个区间已写入但未 checkpoint
+    os.close(partial._fd)
+
+    assert PartialDownload(str(tmp_path), "1:a", 100).open() == 50
+
+
+def test_size_change_starts_over(tmp_path):
+    partial = PartialDownload(str(tmp_path), "1:a", 100)
+    partial.open()
+    _write(partial, 0, b"x" * 100)
+    partial.close()
+
+    changed = PartialDownload(str(tmp_path), "1:a", 200)
+    assert changed.open() == 0
+    assert os.path.getsize(changed.part_path) == 200
+
+
+def test_record_without_completed_ranges_starts_over(tmp_path):
+    partial = PartialDownload(str(tmp_path), "1:a", 100)
+    os.makedirs(partial.directory)
+    with open(partial.part_path, "wb") as f:
+        f.write(b"x" * 40)
+    with open(partial.meta_path, "w", encoding="utf-8") as f:
+        f.write('{"file_id": "1:a", "total_size": 100, "offset": 60}')
+
+    assert partial.open() == 0
+    assert partial.missing_ranges(0, 100) == [(0, 100)]
+
+
+def test_incomplete_file_is_not_finalized(tmp_path):
+    partial = PartialDownload(str(tmp_path), "1:a", 100)
+    partial.open()
+    _write(partial, 0, b"x" * 60)
+
+    with pytest.raises(ValueError):
+        partial.finalize(str(tmp_path / "a.bin"))
+    assert not os.path.exists(tmp_path / "a.bin")
+    assert not os.path.exists(partial.part_path)
+
+
+def test_sweep_removes_only_stale_partials(tmp_path):
+    stale = PartialDownload(str(tmp_path), "1:old", 10)
+    stale.open()
+    stale.close()
+    fresh = PartialDownload(str(tmp_path), "2:new", 10)
+    fresh.open()
+    fresh.close()
+    old = time.time() - 7200
+    for path in (stale.part_path, stale.meta_path):
+        os.utime(path, (old, old))
+
+    assert sweep_stale_partials(str(tmp_path), 3600) == 2
+    assert not os.path.exists(stale.part_path)
+    assert os.path.exists(fresh.part_path)
+    assert os.path.exists(fresh.meta_path)
+
+
+def test_sweep_without_partial_directory(tmp_path):
+    assert sweep_stale_partials(str(tmp_path), 3600) == 0
@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.api import files
+from app.api.files import parse_range_header
+
+CHUNK = 10
+DATA = bytes(range(47))  # 5 个分块：4 个完整分块 + 7 字节的尾块
+CHUNK_IDS = [f"{100 + i}:c{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (None, None),
+        ("", None),
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-", (10, 46)),
+        ("bytes=-5", (42, 46)),
+        ("bytes=-100", (0, 46)),
+        ("bytes=40-1000", (40, 46)),
+        ("BYTES=1-2", (1, 2)),
+        ("items=0-1", None),
+        ("bytes=0-1,5-6", None),
+        ("bytes=abc", None),
+        ("bytes=5-2", None),
+        ("bytes=-", None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, len(DATA)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=47-", "bytes=100-200", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(ValueError):
+        parse_range_header(header, len(DATA))
+
+
+class _FakeTelegram:
+    async def get_download_url(self, file_id):
+        return f"http://tg.test/{file_id}"
+
+
+def _stream(start=0, end=None, honor_range=True, failing=(), received=None):
+    requests = []
+
+    def handler(request):
+        index = int(request.url.path.rsplit("c", 1)[-1])
+        if index in failing:
+            return httpx.Response(500)
+        body = DATA[index * CHUNK : (index + 1) * CHUNK]
+        range_header = request.headers.get("Range")
+        requests.append((index, range_header))
+        if range_header and honor_range:
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            body = body[int(first) : int(last) + 1 if last else None]
+            return httpx.Response(206, content=body)
+        return httpx.Response(200, content=body)
+
+    async def collect():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            pieces = []
+            async for piece in files.stream_chunks(CHUNK_IDS, _FakeTelegram(), client, start, end):
+                pieces.append(piece)
+                if received is not None:
+                    received.extend(piece)
+            return b"".join(pieces)
+
+    return asyncio.run(collect()), sorted(requests)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(files, "CHUNK_SIZE_BYTES", CHUNK)
+
+
+def test_full_stream_requests_every_chunk_without_range():
+    body, requests = _stream()
+    assert body == DATA
+    assert requests == [(i, None) for i in range(5)]
+
+
+@pytest.mark.parametrize(
+    ("start", "end", "expected_requests"),
+    [
+        (0, 9, [(0, "bytes=0-9")]),
+        (3, 7, [(0, "bytes=3-7")]),
+        (15, 34, [(1, "bytes=5-"), (2, None), (3, "bytes=0-4")]),
+        (20, 29, [(2, "bytes=0-9")]),
+        (45, 46, [(4, "bytes=5-6")]),
+        (38, 46, [(3, "bytes=8-"), (4, "bytes=0-6")]),
+    ],
+)
+def test_range_maps_to_chunks(start, end, expected_requests):
+    body, requests = _stream(start, end)
+    assert body == DATA[start : end + 1]
+    assert requests == expected_requests
+
+
+def test_range_is_cut_locally_when_server_ignores_it():
+    body, _ = _stream(15, 34, honor_range=False)
+    assert body == DATA[15:35]
+
+
+def test_failed_chunk_aborts_the_stream():
+    received = bytearray()
+    with pytest.raises(httpx.HTTPStatusError):
+        _stream(failing={2}, received=received)
+    # 失败之前的分块已输出，随后抛出异常而不是正常结束（服务器据此中断连接）
+    assert bytes(received) == DATA[:20]
@@ -0,0 +1,106 @@
+import asyncio
+import io
+
+import pytest
+import telegram
+
+from app.services import rate_limiter
+from app.services.rate_limiter import TelegramRateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的 time.monotonic。"""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+
+    def advance(seconds):
+        now[0] += seconds
+
+    return advance
+
+
+def test_bucket_allows_burst_then_spaces_calls(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+
+    clock(1.0)
+    assert bucket.reserve() == 0.5
+
+
+def test_bucket_refill_is_capped(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.reserve()
+    clock(100)
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_pause_withholds_tokens(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.pause(3)
+    assert bucket.reserve() == 3.5
+
+    clock(4)
+    assert bucket.reserve() == 0
+
+
+def test_buckets_per_method_and_chat():
+    limiter = TelegramRateLimiter(method_limits={"get_file": (20, 40)})
+
+    get_file = limiter._buckets_for("get_file", None)
+    send_a = limiter._buckets_for("send_document", "@a")
+    send_b = limiter._buckets_for("send_document", "@b")
+
+    assert len(get_file) == 2
+    assert get_file[0] is send_a[0] is limiter.global_bucket
+    assert send_a[1] is not send_b[1]
+    assert limiter._buckets_for("send_document", "@a")[1] is send_a[1]
+    # 非发送方法不受会话限速约束
+    assert limiter._buckets_for("delete_message", "@a") == [limiter.global_bucket]
+
+
+def test_flood_wait_is_retried_with_rewound_upload():
+    limiter = TelegramRateLimiter(global_rate=1000, chat_send_per_minute=60000, flood_retries=3)
+    document = io.BytesIO(b"payload")
+    received = []
+
+    async def send_document(chat_id, document):
+        received.append(document.read())
+        if len(received) < 3:
+            raise telegram.error.RetryAfter(0)
+        return "sent"
+
+    result = asyncio.run(
+        limiter.call("send_document", send_document, chat_id="@c", document=document)
+    )
+
+    assert result == "sent"
+    assert received == [b"payload"] * 3
+    stats = limiter.stats()
+    assert stats["calls"] == {"send_document": 3}
+    assert (stats["flood_waits"], stats["flood_failures"]) == (2, 0)
+
+
+def test_flood_wait_gives_up_after_retries():
+    limiter = TelegramRateLimiter(global_rate=1000, flood_retries=1)
+
+    async def get_file(file_id):
+        raise telegram.error.RetryAfter(0)
+
+    with pytest.raises(telegram.error.RetryAfter):
+        asyncio.run(limiter.call("get_file", get_file, file_id="x"))
+    assert limiter.flood_failures == 1
+    assert limiter.calls == {"get_file": 2}
+
+
+def test_other_errors_are_not_retried():
+    limiter = TelegramRateLimiter(global_rate=1000)
+    calls = []
+
+    async def get_file(file_id):
+        calls.append(file_id)
+        raise telegram.error.BadRequest("file not found")
+
+    with pytest.raises(telegram.error.BadRequest):
+        asyncio.run(limiter.call("get_file", get_file, file_id="x"))
+    assert calls == ["x"]
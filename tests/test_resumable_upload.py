@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from app.services import resumable_upload
+from app.services import telegram_service as telegram_service_module
+from app.services.resumable_upload import ResumableUploads, UploadSessionError
+
+CHUNK = 10
+DATA = bytes(range(65, 90))  # 25 字节：两个完整分块 + 5 字节尾块
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(resumable_upload, "CHUNK_SIZE_BYTES", CHUNK)
+    monkeypatch.setattr(telegram_service_module, "CHUNK_SIZE_BYTES", CHUNK)
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ResumableUploads(spool_dir=str(tmp_path / "uploads"))
+
+
+async def _stream(*pieces, error=None):
+    for piece in pieces:
+        yield piece
+    if error is not None:
+        raise error
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _spool(uploads, upload_id):
+    with open(uploads._spool_path(upload_id), "rb") as f:
+        return f.read()
+
+
+def test_chunks_are_sent_as_they_fill_up(uploads, telegram_service, db):
+    async def scenario():
+        session = await uploads.create("video.mp4", len(DATA))
+        upload_id = session["upload_id"]
+
+        assert await uploads.append(upload_id, 0, _stream(DATA[:7]), telegram_service) == 7
+        assert telegram_service.bot.sent == {}
+        assert _spool(uploads, upload_id) == DATA[:7]
+
+        assert (
+            await uploads.append(upload_id, 7, _stream(DATA[7:12], DATA[12:15]), telegram_service)
+            == 15
+        )
+        assert list(telegram_service.bot.sent) == ["video.mp4.part1"]
+        assert _spool(uploads, upload_id) == DATA[10:15]
+
+        assert await uploads.append(upload_id, 15, _stream(DATA[15:]), telegram_service) == 25
+        return upload_id, await uploads.finalize(upload_id, telegram_service)
+
+    upload_id, short_id = _run(scenario())
+
+    sent = telegram_service.bot.sent
+    assert b"".join(sent[f"video.mp4.part{i}"].data for i in (1, 2, 3)) == DATA
+    first_message_id = sent["video.mp4.part1"].message_id
+    assert sent["video.mp4.part2"].reply_to_message_id == first_message_id
+    assert sent["video.mp4.manifest"].reply_to_message_id == first_message_id
+    meta = db.get_file_by_id(short_id)
+    assert (meta["filesize"], meta["blob_kind"], meta["chunk_count"]) == (25, "manifest", 3)
+    assert not os.path.exists(uploads._spool_path(upload_id))
+
+
+def test_interrupted_append_keeps_received_bytes(uploads, telegram_service):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        with pytest.raises(ConnectionError):
+            await uploads.append(
+                upload_id, 0, _stream(DATA[:13], error=ConnectionError()), telegram_service
+            )
+        assert (await uploads.status(upload_id))["received_bytes"] == 13
+
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.append(upload_id, 0, _stream(DATA), telegram_service)
+        assert (exc_info.value.code, exc_info.value.offset) == ("offset_mismatch", 13)
+
+        await uploads.append(upload_id, 13, _stream(DATA[13:]), telegram_service)
+        return await uploads.finalize(upload_id, telegram_service)
+
+    _run(scenario())
+    sent = telegram_service.bot.sent
+    assert b"".join(sent[f"a.bin.part{i}"].data for i in (1, 2, 3)) == DATA
+
+
+def test_lost_spool_rolls_back_to_last_chunk(uploads, telegram_service):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA[:14]), telegram_service)
+        os.remove(uploads._spool_path(upload_id))
+
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.append(upload_id, 14, _stream(DATA[14:]), telegram_service)
+        assert (exc_info.value.code, exc_info.value.offset) == ("offset_mismatch", 10)
+        return await uploads.status(upload_id)
+
+    assert _run(scenario())["received_bytes"] == 10
+
+
+def test_data_beyond_declared_size_is_rejected(uploads, telegram_service):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", 5))["upload_id"]
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.append(upload_id, 0, _stream(b"abc", b"defg"), telegram_service)
+        assert (exc_info.value.status_code, exc_info.value.offset) == (413, 3)
+        return await uploads.status(upload_id)
+
+    assert _run(scenario())["received_bytes"] == 3
+
+
+def test_small_file_is_sent_as_single_document(uploads, telegram_service, db):
+    async def scenario():
+        upload_id = (await uploads.create("note.txt", 5))["upload_id"]
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.finalize(upload_id, telegram_service)
+        assert exc_info.value.code == "upload_incomplete"
+
+        await uploads.append(upload_id, 0, _stream(b"hello"), telegram_service)
+        short_id = await uploads.finalize(upload_id, telegram_service)
+        assert await uploads.finalize(upload_id, telegram_service) == short_id
+
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.append(upload_id, 5, _stream(b"!"), telegram_service)
+        assert exc_info.value.code == "upload_completed"
+        return short_id
+
+    short_id = _run(scenario())
+    assert list(telegram_service.bot.sent) == ["note.txt"]
+    assert db.get_file_by_id(short_id)["blob_kind"] == "single"
+
+
+def test_abort_deletes_sent_chunks(uploads, telegram_service):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA[:22]), telegram_service)
+        await uploads.abort(upload_id, telegram_service)
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.status(upload_id)
+        assert exc_info.value.status_code == 404
+        return upload_id
+
+    upload_id = _run(scenario())
+    sent = telegram_service.bot.sent
+    assert sorted(telegram_service.bot.deleted) == sorted(
+        sent[name].message_id for name in ("a.bin.part1", "a.bin.part2")
+    )
+    assert not os.path.exists(uploads._spool_path(upload_id))
+
+
+def test_concurrent_requests_on_one_session_are_refused(uploads, telegram_service):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        release = asyncio.Event()
+
+        async def slow_stream():
+            yield DATA[:3]
+            await release.wait()
+
+        first = asyncio.create_task(uploads.append(upload_id, 0, slow_stream(), telegram_service))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UploadSessionError) as exc_info:
+            await uploads.append(upload_id, 0, _stream(DATA), telegram_service)
+        release.set()
+        assert await first == 3
+        return exc_info.value.code
+
+    assert _run(scenario()) == "upload_busy"
+
+
+def test_finalize_records_the_content_hash(uploads, telegram_service, db):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA[:13]), telegram_service)
+        await uploads.append(upload_id, 13, _stream(DATA[13:]), telegram_service)
+        return await uploads.finalize(upload_id, telegram_service)
+
+    short_id = _run(scenario())
+    assert db.get_file_by_id(short_id)["content_hash"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_duplicate_session_returns_existing_file(uploads, telegram_service, db):
+    async def upload(filename):
+        upload_id = (await uploads.create(filename, len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA), telegram_service)
+        return await uploads.finalize(upload_id, telegram_service)
+
+    first = _run(upload("a.bin"))
+    second = _run(upload("copy.bin"))
+
+    sent = telegram_service.bot.sent
+    assert second == first
+    assert "copy.bin.manifest" not in sent
+    assert sorted(telegram_service.bot.deleted) == sorted(
+        sent[f"copy.bin.part{i}"].message_id for i in (1, 2)
+    )
+
+
+def test_session_resumed_by_a_new_process_has_no_hash(uploads, telegram_service, db):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA[:13]), telegram_service)
+        restarted = ResumableUploads(spool_dir=uploads.spool_dir)
+        await restarted.append(upload_id, 13, _stream(DATA[13:]), telegram_service)
+        return await restarted.finalize(upload_id, telegram_service)
+
+    short_id = _run(scenario())
+    meta = db.get_file_by_id(short_id)
+    assert (meta["filesize"], meta["content_hash"]) == (len(DATA), None)
+
+
+def test_stale_session_cleanup_deletes_sent_chunks(uploads, telegram_service, monkeypatch):
+    async def scenario():
+        upload_id = (await uploads.create("a.bin", len(DATA)))["upload_id"]
+        await uploads.append(upload_id, 0, _stream(DATA[:22]), telegram_service)
+        monkeypatch.setattr(resumable_upload, "RESUMABLE_UPLOAD_TTL_HOURS", 0)
+        assert await uploads.cleanup_stale(telegram_service) == 1
+        with pytest.raises(UploadSessionError):
+            await uploads.status(upload_id)
+        return upload_id
+
+    upload_id = _run(scenario())
+    sent = telegram_service.bot.sent
+    assert sorted(telegram_service.bot.deleted) == sorted(
+        sent[name].message_id for name in ("a.bin.part1", "a.bin.part2")
+    )
+    assert not os.path.exists(uploads._spool_path(upload_id))
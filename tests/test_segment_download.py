@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from app.services import download_accelerator, download_service
+from app.services.download_accelerator import DownloadAccelerator, HostTuning, UrlExpired
+from app.services.download_service import DownloadService
+from app.services.partial_download import PartialDownload
+
+DATA = os.urandom(4096)
+
+
+class FakeTelegramService:
+    """每次 getFile 返回一个新的下载链接。"""
+
+    def __init__(self):
+        self.resolved = 0
+
+    async def get_download_url(self, file_id):
+        self.resolved += 1
+        return f"https://files.test/file/v{self.resolved}"
+
+
+def _handler(expired_paths, requests):
+    def handle(request):
+        requests.append(request.url.path)
+        if request.url.path in expired_paths:
+            return httpx.Response(403)
+        start, end = (int(v) for v in request.headers["Range"][len("bytes=") :].split("-"))
+        return httpx.Response(206, content=DATA[start : end + 1])
+
+    return handle
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(download_accelerator, "RETRY_BASE_DELAY", 0)
+
+
+def _fetch(tmp_path, expired_paths):
+    requests = []
+    telegram_service = FakeTelegramService()
+    service = DownloadService(telegram_service)
+    partial = PartialDownload(str(tmp_path), "1:a", len(DATA))
+    partial.open()
+    status = {"bytes_downloaded": 0}
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(_handler(expired_paths, requests))
+        ) as client:
+            accelerator = DownloadAccelerator(client)
+            tuning = HostTuning(download_accelerator.MIN_SEGMENT_SIZE, 1)
+            await service._fetch_segment(
+                accelerator, tuning, partial, ("1:a", 0, 0, len(DATA)), {}, status
+            )
+
+    try:
+        asyncio.run(run())
+    finally:
+        partial.close()
+    return partial, status, requests, telegram_service
+
+
+def test_expired_url_is_refreshed_and_retried(tmp_path):
+    partial, status, requests, telegram_service = _fetch(tmp_path, {"/file/v1"})
+
+    assert requests == ["/file/v1", "/file/v2"]
+    assert telegram_service.resolved == 2
+    assert partial.completed == [(0, len(DATA))]
+    assert status["bytes_downloaded"] == len(DATA)
+    with open(partial.part_path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_url_that_stays_expired_fails_after_the_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_service, "DOWNLOAD_SEGMENT_RETRIES", 3)
+    with pytest.raises(UrlExpired):
+        _fetch(tmp_path, {"/file/v1", "/file/v2", "/file/v3"})
+
+
+@pytest.mark.parametrize(
+    ("error", "retryable"),
+    [
+        (UrlExpired("expired"), True),
+        (httpx.ConnectError("reset"), True),
+        (httpx.HTTPStatusError("", request=None, response=httpx.Response(503)), True),
+        (httpx.HTTPStatusError("", request=None, response=httpx.Response(403)), False),
+    ],
+)
+def test_is_retryable(error, retryable):
+    assert DownloadAccelerator._is_retryable(error) is retryable
@@ -0,0 +1,109 @@
+import hashlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import upload
+
+BOUNDARY = "testboundary"
+HEADERS = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+
+def _body(filename, content, key=None, key_first=True):
+    key_part = b""
+    if key is not None:
+        key_part = (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="key"\r\n\r\n{key}\r\n'.encode()
+        )
+    file_part = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n\r\n'.encode()
+        + content
+        + b"\r\n"
+    )
+    parts = [key_part, file_part] if key_first else [file_part, key_part]
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def client(db, telegram_service, monkeypatch):
+    db.save_app_settings_to_db(
+        {"BOT_TOKEN": "123456:test-token-value", "CHANNEL_NAME": "@test", "PICGO_API_KEY": "secret"}
+    )
+    monkeypatch.setattr(upload, "get_telegram_service", lambda: telegram_service)
+    app = FastAPI()
+    app.include_router(upload.router)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("key_first", [True, False])
+def test_key_field_before_or_after_file(client, telegram_service, db, key_first):
+    response = client.post(
+        "/api/upload", content=_body("a.txt", b"hello", "secret", key_first), headers=HEADERS
+    )
+
+    assert response.status_code == 200
+    assert telegram_service.bot.sent["a.txt"].data == b"hello"
+    meta = db.get_file_by_id(response.json()["short_id"])
+    assert meta["filesize"] == 5
+    assert meta["content_hash"] == hashlib.sha256(b"hello").hexdigest()
+
+
+@pytest.mark.parametrize("key_first", [True, False])
+def test_wrong_key_is_rejected_without_upload(client, telegram_service, key_first):
+    response = client.post(
+        "/api/upload", content=_body("a.txt", b"hello", "wrong", key_first), headers=HEADERS
+    )
+
+    assert response.status_code == 401
+    assert telegram_service.bot.sent == {}
+
+
+def test_missing_key_is_rejected(client, telegram_service):
+    response = client.post("/api/upload", content=_body("a.txt", b"hello"), headers=HEADERS)
+
+    assert response.status_code == 401
+    assert telegram_service.bot.sent == {}
+
+
+def test_large_file_before_key_field_is_rejected(client, telegram_service, monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_PENDING_AUTH_MAX_BYTES", 4)
+    response = client.post(
+        "/api/upload", content=_body("a.txt", b"hello", "secret", key_first=False), headers=HEADERS
+    )
+
+    assert response.status_code == 401
+    assert response.json()["detail"]["code"] == "auth_required_before_file"
+    assert telegram_service.bot.sent == {}
+
+
+def test_key_header(client, telegram_service):
+    response = client.post(
+        "/api/upload", content=_body("a.txt", b"hello"), headers={**HEADERS, "X-API-Key": "secret"}
+    )
+
+    assert response.status_code == 200
+    assert "a.txt" in telegram_service.bot.sent
+
+
+def test_declared_hash_of_existing_content_skips_upload(client, telegram_service):
+    first = client.post("/api/upload", content=_body("a.txt", b"hello", "secret"), headers=HEADERS)
+    telegram_service.bot.sent.clear()
+
+    second = client.post(
+        "/api/upload",
+        content=_body("copy.txt", b"hello", "secret"),
+        headers={**HEADERS, "X-Content-SHA256": hashlib.sha256(b"hello").hexdigest()},
+    )
+
+    assert second.status_code == 200
+    assert second.json()["short_id"] == first.json()["short_id"]
+    assert telegram_service.bot.sent == {}
+
+
+def test_missing_file_part(client):
+    body = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="key"\r\n\r\nsecret\r\n--{BOUNDARY}--\r\n'
+    response = client.post("/api/upload", content=body.encode(), headers=HEADERS)
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["code"] == "file_missing"